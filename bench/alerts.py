@@ -0,0 +1,215 @@
+#!/usr/bin/python
+"""
+Checks the alert rules against recomputing every decision from the full sample history, and measures
+what evaluating them costs per sample.
+
+The CPU, memory and network screens collect synthetic samples (see synthetic.py) on the samples' own
+clock while --rules rules watch their histories, with thresholds, durations, windows and clear levels
+spread over what the samples look like. After each sample every rule's firing and clearing is compared
+with a reference that keeps each rule's samples and recomputes the window average and how long the
+threshold has been crossed from scratch. Then the time the engine takes per rule and sample is reported
+for short and long windows, which should be the same, and how often the rules fire with and without a
+clear level short of the threshold.
+"""
+import argparse
+import os
+import sys
+import timeit
+
+from itertools import takewhile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lib'))
+
+from alerts import AlertEngine
+from alerts import AlertRule
+from alerts import find_history
+from screens import CpuScreen
+from screens import MemoryScreen
+from screens import NetworkScreen
+from synthetic import SyntheticSource
+
+# Metric, threshold and clear level, near the top of what the synthetic samples reach
+METRICS = (
+    ('cpu.percent', 80, 60),
+    ('cpu.iowait', 4, 3),
+    ('cpu.user', 50, 40),
+    ('memory.percent', 60, 55),
+    ('memory.used', 420e6, 400e6),
+    ('network-wlan0.bytes.in', 150000, 100000),
+    ('network-wlan0.errors.in', 0, 0),
+    ('network-wlan0.dropped.out', 0, 0)
+)
+DURATIONS = (0, 5, 30)
+
+
+class Reference:
+    """
+    A rule decided from every sample it has seen, the way it is described rather than incrementally.
+    """
+
+    def __init__(self, rule):
+        self.rule = rule
+        self.samples = []
+        self.values = []
+        self.active = False
+
+    def crossed(self, value):
+        return value > self.rule.threshold if self.rule.above else value < self.rule.threshold
+
+    def update(self, timestamp):
+        rule = self.rule
+        self.samples.append((timestamp, rule.history.raw.newest()))
+
+        # The average of every sample within the window, summed afresh
+        if rule.window > 0:
+            values = [v for t, v in takewhile(lambda sample: sample[0] > timestamp - rule.window,
+                                              reversed(self.samples))]
+            value = sum(values) / len(values)
+        else:
+            value = self.samples[-1][1]
+
+        self.values.append(value)
+
+        if self.active:
+            if value < rule.clear if rule.above else value > rule.clear:
+                self.active = False
+                return False
+
+            return None
+
+        if not self.crossed(value):
+            return None
+
+        # Back to the first sample of the stretch over the threshold, the sample a rule clears on ends one
+        first = len(self.values) - 1
+        while first > 0 and self.crossed(self.values[first - 1]):
+            first -= 1
+
+        if timestamp - self.samples[first][0] >= rule.duration:
+            self.active = True
+            return True
+
+        return None
+
+
+def create_screens(interface):
+    return [CpuScreen(), NetworkScreen(interface, ip='192.168.1.20'), MemoryScreen()]
+
+
+def create_rules(screens, count, window, hysteresis=True):
+    rules = []
+
+    for i in range(count):
+        metric, threshold, clear = METRICS[i % len(METRICS)]
+        screen, index, history = find_history(screens, metric)
+
+        # Every other rule averages over the window, one in four watches for the value dropping instead
+        above = i % 4 != 3
+        if not above:
+            threshold, clear = clear, threshold
+
+        rules.append(AlertRule('%s-%s' % (metric, i), screen, index, history, threshold, above=above,
+                               duration=DURATIONS[(i // len(METRICS)) % len(DURATIONS)],
+                               clear=clear if hysteresis else None, window=window if i % 2 else 0))
+
+    return rules
+
+
+def check(samples, count, window, seed, interface):
+    source = SyntheticSource(seed=seed, interfaces=(interface,))
+    screens = create_screens(interface)
+    rules = create_rules(screens, count, window)
+    events = []
+    engine = AlertEngine(rules, lambda rule, fired: events.append((rule, fired)), clock=lambda: source.timestamp)
+    references = dict((rule, Reference(rule)) for rule in rules)
+    mismatches = 0
+    fired = 0
+
+    for i in range(samples):
+        sample = source.sample()
+
+        for screen in screens:
+            appended = dict((rule, rule.history.raw.appended) for rule in engine.rules.get(screen, ()))
+            screen.collect(sample)
+
+            del events[:]
+            engine.handle_sample(screen)
+            decided = dict(events)
+
+            for rule in engine.rules.get(screen, ()):
+                if rule.history.raw.appended == appended[rule]:
+                    continue
+
+                reference = references[rule]
+                expected = reference.update(source.timestamp)
+
+                if decided.get(rule) != expected:
+                    mismatches += 1
+
+                    if mismatches <= 5:
+                        print 'Mismatch at %.1fs: %s decided %s, recomputed %s' % (
+                            source.timestamp, rule.name, decided.get(rule), expected)
+
+                fired += 1 if expected else 0
+
+    return mismatches, fired
+
+
+def cost(samples, count, window, seed, interface, hysteresis=True):
+    """
+    Seconds the engine takes per rule and sample, and the number of times the rules fired.
+    """
+    source = SyntheticSource(seed=seed, interfaces=(interface,))
+    screens = create_screens(interface)
+    fired = [0]
+
+    def listener(rule, state):
+        fired[0] += 1 if state else 0
+
+    engine = AlertEngine(create_rules(screens, count, window, hysteresis), listener, clock=lambda: source.timestamp)
+    elapsed = 0.0
+
+    for i in range(samples):
+        sample = source.sample()
+
+        for screen in screens:
+            screen.collect(sample)
+
+            start = timeit.default_timer()
+            engine.handle_sample(screen)
+            elapsed += timeit.default_timer() - start
+
+    return elapsed / samples / count, fired[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--samples', type=int, default=3000, help='samples collected, one per second')
+    parser.add_argument('--rules', type=int, default=48, help='alert rules watching the screens')
+    parser.add_argument('--window', type=float, default=60, help='seconds the averaging rules average over')
+    parser.add_argument('--seed', type=int, default=1, help='seed of the synthetic samples')
+    parser.add_argument('--interface', default='wlan0', help='network interface name to simulate')
+    args = parser.parse_args()
+
+    mismatches, fired = check(args.samples, args.rules, args.window, args.seed, args.interface)
+    print '%s rules over %s samples fired %s times, %s decisions differ from recomputing them' % (
+        args.rules, args.samples, fired, mismatches)
+
+    for count in (args.rules // 4, args.rules, args.rules * 4):
+        for window in (args.window, args.window * 60):
+            per_rule, fired = cost(args.samples, count, window, args.seed, args.interface)
+            print '%4s rules, %6.0fs windows: %.2fus per rule and sample' % (count, window, per_rule * 1e6)
+
+    per_rule, with_clear = cost(args.samples, args.rules, args.window, args.seed, args.interface)
+    per_rule, without_clear = cost(args.samples, args.rules, args.window, args.seed, args.interface, hysteresis=False)
+    print 'Fired %s times with clear levels, %s times clearing at the threshold' % (with_clear, without_clear)
+
+    if mismatches:
+        print 'FAIL %s decisions differ' % mismatches
+        return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,139 @@
+#!/usr/bin/python
+"""
+Plays scripted button presses, bounce included, through ButtonInput on a simulated clock and pins.
+
+Each scenario lists the edges seen on the GPIO pins and the click and long press events the monitor
+should get for them. Every scenario runs with the debounce time tuned for good switches and with the
+one etc/config.cfg ships. The script also reports what queueing an edge costs the GPIO callback thread.
+"""
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lib'))
+
+from buttons import ButtonInput
+from buttons import CLICK
+from buttons import LONG_PRESS
+
+NEXT, PREVIOUS, UP, DOWN, RESET = 19, 26, 6, 13, 5
+# The tuned debounce time and the shipped one
+DEBOUNCE_TIMES = (0.05, 0.33)
+LONG_PRESS_TIME = 1.0
+
+
+def bounce(pin, time, level, count=3, spacing=0.002):
+    """
+    Edges of a contact that chatters before it settles on level.
+    """
+    return [(time + i * spacing, pin, level if (count - i) % 2 else 1 - level) for i in range(count * 2 - 1)] + \
+           [(time + (count * 2 - 1) * spacing, pin, level)]
+
+
+def presses(pin, count, spacing, hold):
+    return [(i * spacing + offset, pin, level) for i in range(count) for offset, level in ((0.0, 0), (hold, 1))]
+
+
+def scenarios(debounce_time):
+    """
+    The scenarios for a debounce time, presses that have to get through come debounce_time apart or more.
+    """
+    return [
+        ('clean click', [(0.0, NEXT, 0), (0.15, NEXT, 1)], [(CLICK, NEXT)]),
+        ('bouncing press and release', bounce(NEXT, 0.0, 0) + bounce(NEXT, 0.2, 1), [(CLICK, NEXT)]),
+        # Next has a long press, so it clicks when released and previous, which has none, when pressed
+        ('quick presses on two buttons', [(0.0, NEXT, 0), (0.01, PREVIOUS, 0), (0.08, NEXT, 1), (0.09, PREVIOUS, 1)],
+         [(CLICK, PREVIOUS), (CLICK, NEXT)]),
+        ('double click', presses(NEXT, 2, debounce_time * 3, debounce_time * 1.5), [(CLICK, NEXT), (CLICK, NEXT)]),
+        ('short press on reset', [(0.0, RESET, 0), (0.3, RESET, 1)], [(CLICK, RESET)]),
+        ('long press on reset', [(0.0, RESET, 0), (1.5, RESET, 1)], [(LONG_PRESS, RESET)]),
+        ('long press on up', bounce(UP, 0.0, 0) + bounce(UP, 2.0, 1), [(LONG_PRESS, UP)]),
+        ('long press on next', bounce(NEXT, 0.0, 0) + bounce(NEXT, 1.5, 1), [(LONG_PRESS, NEXT)]),
+        ('click then long press on next', [(0.0, NEXT, 0), (0.2, NEXT, 1), (0.5, NEXT, 0), (2.0, NEXT, 1)],
+         [(CLICK, NEXT), (LONG_PRESS, NEXT)]),
+        ('release lost in bounce', [(0.0, DOWN, 0), (0.02, DOWN, 1)], [(CLICK, DOWN)]),
+        ('press after a lost release', [(0.0, NEXT, 0), (0.02, NEXT, 1), (0.5, NEXT, 0), (0.6, NEXT, 1)],
+         [(CLICK, NEXT), (CLICK, NEXT)]),
+        # Short presses just over the debounce time apart, each release lost in the window of its press
+        ('repeated presses on next', presses(NEXT, 4, debounce_time * 1.2, debounce_time * 0.25), [(CLICK, NEXT)] * 4),
+        ('repeated presses on previous', presses(PREVIOUS, 4, debounce_time * 1.2, debounce_time * 0.25),
+         [(CLICK, PREVIOUS)] * 4),
+    ]
+
+
+class SimulatedPins:
+    """
+    A fake GPIO: the pins are pulled up and read back whatever level the scenario last set.
+    """
+
+    def __init__(self):
+        self.levels = {}
+        self.time = 0.0
+
+    def read(self, pin):
+        return self.levels.get(pin, 1)
+
+    def clock(self):
+        return self.time
+
+
+def simulate(edges, debounce_time):
+    pins = SimulatedPins()
+    buttons = ButtonInput((NEXT, PREVIOUS, UP, DOWN, RESET), pins.read, debounce_time, LONG_PRESS_TIME,
+                          long_pins=(RESET, UP, DOWN, NEXT), clock=pins.clock)
+    edges = sorted(edges)
+    events = []
+
+    # Runs the consumer loop by hand, waking up for every edge and every timeout it asks for
+    while True:
+        timeout = buttons.next_timeout()
+        next_edge = edges[0][0] if edges else None
+
+        if next_edge is None and timeout is None:
+            break
+
+        if next_edge is not None and (timeout is None or next_edge <= timeout):
+            pins.time, pin, level = edges.pop(0)
+            pins.levels[pin] = level
+            buttons.edge(pin, level)
+        else:
+            pins.time = timeout
+
+        events.extend(buttons.process(pins.time))
+
+    os.close(buttons.wakeup_read)
+    os.close(buttons.wakeup_write)
+
+    return events
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--edges', type=int, default=100000, help='edges queued for the cost measurement')
+    args = parser.parse_args()
+
+    failures = 0
+    runs = 0
+
+    for debounce_time in DEBOUNCE_TIMES:
+        for name, edges, expected in scenarios(debounce_time):
+            events = simulate(edges, debounce_time)
+            runs += 1
+
+            if events != expected:
+                failures += 1
+                print 'FAIL %s at %gs: expected %s, got %s' % (name, debounce_time, expected, events)
+            else:
+                print 'ok   %s at %gs' % (name, debounce_time)
+
+    buttons = ButtonInput((NEXT,), lambda pin: 1, DEBOUNCE_TIMES[0], LONG_PRESS_TIME)
+    seconds = timeit.timeit(lambda: buttons.edge(NEXT, 0, 0.0), number=args.edges)
+    buttons.edges.clear()
+
+    print '%s of %s scenarios failed, queueing an edge takes %.2f us' % (failures, runs, seconds / args.edges * 1e6)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
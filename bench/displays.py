@@ -0,0 +1,168 @@
+#!/usr/bin/python
+"""
+Drives several luma dummy displays from one sampler and checks a slow bus only holds up its own display.
+
+The screens are split over the displays the way [display:*] sections split them, each display
+rendering and writing on its own DisplayWorker thread. One display sits on a bus that takes
+--bus-delay seconds for every write. The script checks every screen collected every sample exactly
+once, that the displays on fast buses drew a frame for (nearly) every sample of their visible screen
+while the slow one fell behind, and reports the frames and the sample to frame latency of each
+display.
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lib'))
+
+from luma.core.device import dummy
+from monotonic import monotonic
+
+from display import CountingSerial
+from display import DiffingDisplay
+from metrics import PerformanceCounters
+from sampler import Sampler
+from screens import CpuScreen
+from screens import MemoryScreen
+from screens import NetworkScreen
+from synthetic import SyntheticSource
+from worker import DisplayWorker
+
+
+class SlowSerial(CountingSerial):
+    """
+    A bus that takes delay seconds for every data transfer.
+    """
+
+    def __init__(self, delay):
+        CountingSerial.__init__(self)
+        self.delay = delay
+
+    def data(self, data):
+        CountingSerial.data(self, data)
+        time.sleep(self.delay)
+
+
+class LatencyDisplay(DiffingDisplay):
+    """
+    Records how long after the newest sample each frame finished going out.
+    """
+
+    def __init__(self, device, serial, sampled):
+        DiffingDisplay.__init__(self, device, serial=serial)
+        self.sampled = sampled
+        self.latencies = []
+
+    def display(self, image):
+        DiffingDisplay.display(self, image)
+        self.latencies.append(monotonic() - self.sampled[0])
+
+
+def run(seconds, interval, bus_delay, cycle_time):
+    sampled = [monotonic()]
+    counters = PerformanceCounters()
+    sampler = Sampler(interval=interval, backend=SyntheticSource(interfaces=('wlan0', 'eth0')), counters=counters)
+
+    layout = [
+        ('main', CountingSerial(), [CpuScreen(scrolling=True), MemoryScreen(scrolling=True)], 0),
+        ('side', SlowSerial(bus_delay), [NetworkScreen('wlan0', True, ip='192.168.1.20'),
+                                            NetworkScreen('eth0', ip='10.0.0.2')], cycle_time),
+        ('third', CountingSerial(), [CpuScreen()], 0)
+    ]
+
+    workers = []
+    for name, serial, screens, cycle in layout:
+        for screen in screens:
+            sampler.register(screen)
+
+        display = LatencyDisplay(dummy(width=128, height=64, mode='1'), serial, sampled)
+        workers.append(DisplayWorker(name, display, screens, counters, cycle_time=cycle))
+
+    visible_samples = dict((worker.name, 0) for worker in workers)
+
+    def handle_sample(screen):
+        sampled[0] = monotonic()
+
+        for worker in workers:
+            if screen is worker.visible_screen():
+                visible_samples[worker.name] += 1
+
+            worker.handle_sample(screen)
+
+    sampler.add_listener(handle_sample)
+
+    for worker in workers:
+        worker.visible_screen().show()
+        worker.start()
+
+    sampler.start()
+    time.sleep(seconds)
+
+    # Stop the sampler between ticks, it has no stop of its own
+    sampler.lock.acquire()
+    ticks = sampler.ticks
+
+    for worker in workers:
+        worker.running = False
+        worker.request_render()
+
+    for worker in workers:
+        worker.thread.join()
+
+    collects = dict((screen, count) for screen, count in sampler.collects.items())
+    sampler.lock.release()
+
+    return ticks, collects, workers, visible_samples, counters
+
+
+def percentile(values, percent):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percent / 100.0))] * 1000 if values else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--seconds', type=float, default=5, help='how long the displays run')
+    parser.add_argument('--interval', type=float, default=0.05, help='seconds between samples')
+    parser.add_argument('--bus-delay', type=float, default=0.1, help='seconds every write takes on the slow bus')
+    parser.add_argument('--cycle', type=float, default=1.0, help='seconds the slow display shows each screen')
+    args = parser.parse_args()
+
+    ticks, collects, workers, visible_samples, counters = run(args.seconds, args.interval, args.bus_delay, args.cycle)
+    failures = []
+
+    for screen, count in collects.items():
+        # A tick may be in progress when the sampler is stopped
+        if abs(count - ticks) > 1:
+            failures.append('%s collected %s samples in %s ticks' % (screen.name, count, ticks))
+
+    print '%s ticks, every screen collected each sample once: %s' % (ticks, 'no' if failures else 'yes')
+    print '%-6s %8s %8s %10s %10s %10s' % ('display', 'samples', 'frames', 'p50 ms', 'p99 ms', 'bus B')
+
+    for worker in workers:
+        latencies = worker.device.latencies
+        serial = worker.device.serial
+        print '%-6s %8s %8s %10.1f %10.1f %10s' % (worker.name, visible_samples[worker.name], len(latencies),
+                                                  percentile(latencies, 50), percentile(latencies, 99),
+                                                  serial.data_bytes + serial.command_bytes)
+
+        if not isinstance(serial, SlowSerial) and len(latencies) < visible_samples[worker.name] * 0.9:
+            failures.append('%s drew %s frames for %s samples' % (worker.name, len(latencies),
+                                                                  visible_samples[worker.name]))
+
+    p50, p95, p99 = counters.percentiles('jitter')
+    print 'sampler jitter p50/p95/p99 %.1f/%.1f/%.1f ms' % (p50, p95, p99)
+
+    for failure in failures:
+        print 'FAIL %s' % failure
+
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    status = main()
+
+    # The sampler thread is still blocked on its lock, leave without tearing the interpreter down under it
+    sys.stdout.flush()
+    os._exit(status)
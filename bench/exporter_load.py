@@ -0,0 +1,171 @@
+#!/usr/bin/python
+"""
+Load tests the metrics endpoint: scrapers hammer it while a sampler ticks synthetic samples.
+
+It checks the body is valid exposition text and that it was only serialized once per tick (and per
+format) no matter how many scrapes came in, then reports scrape throughput, latency and the cost of
+a cached scrape against a rebuild.
+"""
+import argparse
+import httplib
+import os
+import re
+import sys
+import threading
+import time
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lib'))
+
+from exporter import METRICS
+from exporter import MetricsServer
+from exporter import PREFIX
+from exporter import serialize
+from sampler import Sampler
+from screens import CpuScreen
+from screens import MemoryScreen
+from screens import NetworkScreen
+from synthetic import SyntheticSource
+
+LABEL = r'[a-zA-Z_][a-zA-Z0-9_]*="[^"]*"'
+SAMPLE_LINE = re.compile(r'^[a-zA-Z_:][a-zA-Z0-9_:]*(\{%s(,%s)*\})? -?[0-9.e+-]+$' % (LABEL, LABEL))
+
+
+def check_body(body, openmetrics=False):
+    failures = []
+    families = set()
+
+    for line in body.rstrip('\n').split('\n'):
+        if line.startswith('# TYPE '):
+            families.add(line.split(' ')[2])
+        elif line.startswith('#'):
+            continue
+        elif not SAMPLE_LINE.match(line):
+            failures.append('malformed line: %r' % line)
+
+    for name, (kind, description) in METRICS.items():
+        family = PREFIX + name
+
+        if openmetrics and kind == 'counter':
+            family = family[:-len('_total')]
+
+        if family not in families:
+            failures.append('missing family %s' % family)
+
+    if openmetrics and not body.endswith('# EOF\n'):
+        failures.append('OpenMetrics body does not end with # EOF')
+
+    return failures
+
+
+def scraper(port, deadline, latencies, errors):
+    connection = httplib.HTTPConnection('127.0.0.1', port)
+
+    while time.time() < deadline:
+        start = timeit.default_timer()
+
+        try:
+            connection.request('GET', '/metrics')
+            response = connection.getresponse()
+            response.read()
+
+            if response.status != 200:
+                errors.append(response.status)
+        except (httplib.HTTPException, IOError) as e:
+            errors.append(str(e))
+            connection.close()
+            connection = httplib.HTTPConnection('127.0.0.1', port)
+            continue
+
+        latencies.append(timeit.default_timer() - start)
+
+    connection.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--seconds', type=float, default=10, help='duration of the load test')
+    parser.add_argument('--clients', type=int, default=4, help='concurrent scrapers, each on a keep-alive connection')
+    parser.add_argument('--interval', type=float, default=1, help='sampling interval in seconds')
+    args = parser.parse_args()
+
+    screens = [CpuScreen(), NetworkScreen('wlan0', ip='192.168.1.20'), MemoryScreen()]
+    sampler = Sampler(args.interval, backend=SyntheticSource(interfaces=('wlan0',)))
+
+    for screen in screens:
+        sampler.register(screen)
+
+    sampler.start()
+    sampler.ready.wait()
+
+    server = MetricsServer(screens, port=0)
+    server.start()
+    port = server.server_address[1]
+
+    failures = []
+    connection = httplib.HTTPConnection('127.0.0.1', port)
+
+    connection.request('GET', '/metrics')
+    failures.extend(check_body(connection.getresponse().read()))
+
+    connection.request('GET', '/metrics', headers={'Accept': 'application/openmetrics-text; version=1.0.0'})
+    failures.extend(check_body(connection.getresponse().read(), openmetrics=True))
+
+    connection.request('GET', '/nothing-here')
+    response = connection.getresponse()
+    response.read()
+
+    if response.status != 404:
+        failures.append('unknown path answered %s' % response.status)
+
+    connection.close()
+
+    builds = server.cache.builds
+    ticks = sampler.ticks
+    latencies = []
+    errors = []
+    deadline = time.time() + args.seconds
+    threads = [threading.Thread(target=scraper, args=(port, deadline, latencies, errors)) for i in range(args.clients)]
+
+    for thread in threads:
+        thread.start()
+
+    for thread in threads:
+        thread.join()
+
+    builds = server.cache.builds - builds
+    ticks = sampler.ticks - ticks
+
+    # Every scrape asked for the Prometheus format, so one build per tick at most
+    if builds > ticks + 1:
+        failures.append('%s serializations for %s ticks' % (builds, ticks))
+
+    cached = min(timeit.repeat(server.cache.body, number=1000, repeat=3)) / 1000
+    metrics = server.cache.collect()[0]
+    rebuild = min(timeit.repeat(lambda: serialize(server.cache.collect()[0]), number=100, repeat=3)) / 100
+
+    server.stop()
+
+    latencies.sort()
+    count = len(latencies)
+
+    for failure in failures:
+        print 'FAIL %s' % failure
+
+    print 'Body check: %s' % ('failed' if failures else 'ok')
+    print '%s scrapes from %s clients in %.1fs: %.0f scrapes/s, %s errors' % (count, args.clients, args.seconds,
+                                                                             count / args.seconds, len(errors))
+
+    if count:
+        print 'latency p50 %.3f ms, p99 %.3f ms, max %.3f ms' % (latencies[count // 2] * 1000,
+                                                              latencies[min(count - 1, int(count * 0.99))] * 1000,
+                                                              latencies[-1] * 1000)
+
+    print '%s serializations over %s ticks, %s metrics per body' % (builds, ticks, len(metrics))
+    print 'cached body %.1f us, rebuild %.1f us' % (cached * 1e6, rebuild * 1e6)
+
+    return 1 if failures or errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
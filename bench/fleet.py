@@ -0,0 +1,274 @@
+#!/usr/bin/python
+"""
+Runs a fleet receiver on loopback against many local sender processes and measures throughput and loss.
+
+Before the load test it checks the datagram format round trips, that malformed datagrams are
+rejected, that the loss accounting copes with gaps, reordering, restarts and a wrapping sequence,
+that a flood of names stops at the node cap and silent nodes expire, and that a sender fed by real
+screens reports what they show. The load test then starts sender
+processes, each sending for a share of the nodes at a fixed rate, and compares what the senders
+sent with what the receiver took in and the loss it counted from the sequence numbers.
+"""
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lib'))
+
+from fleet import FleetReceiver
+from fleet import FleetSender
+from fleet import Report
+from fleet import decode
+from fleet import encode
+from sampler import Sampler
+from screens import CpuScreen
+from screens import FleetScreen
+from screens import MemoryScreen
+from screens import NetworkScreen
+from synthetic import SyntheticSource
+
+REPORT = Report(42.5, 61.25, 1234.5, 99.0, (10, 20, 30, 100))
+
+
+def check_protocol():
+    failures = []
+
+    data = encode(b'rack1-node3', 7, 12345, REPORT)
+    name, session, sequence, report = decode(data)
+
+    if (name, session, sequence) != (b'rack1-node3', 7, 12345) or report != REPORT:
+        failures.append('round trip gave %r' % ((name, session, sequence, report),))
+
+    receiver = FleetReceiver('127.0.0.1', 0)
+
+    for label, datagram in (('empty', b''), ('truncated', data[:-1]), ('padded', data + b'\0'),
+                            ('bad magic', b'XX' + data[2:]), ('bad version', data[:2] + b'\x09' + data[3:])):
+        receiver.handle(datagram, 0.0)
+
+        if receiver.malformed != 1 or receiver.datagrams != 0:
+            failures.append('%s datagram was not rejected' % label)
+
+        receiver.malformed = 0
+
+    # Sequences as they arrive, with the loss and late counts they must leave behind
+    cases = [
+        ('in order', [(1, 0), (1, 1), (1, 2)], 0, 0),
+        ('gap', [(1, 0), (1, 1), (1, 5)], 3, 0),
+        ('reordered', [(1, 0), (1, 2), (1, 1), (1, 3)], 1, 1),
+        ('duplicate', [(1, 0), (1, 1), (1, 1)], 0, 1),
+        ('restart', [(1, 0), (1, 1), (1, 2), (2, 0), (2, 1)], 0, 0),
+        ('wrap', [(1, 0xfffffffe), (1, 0xffffffff), (1, 0), (1, 2)], 1, 0)
+    ]
+
+    for label, sequences, lost, late in cases:
+        name = label.encode('ascii')
+
+        for session, sequence in sequences:
+            receiver.handle(encode(name, session, sequence, REPORT), 0.0)
+
+        node = receiver.known[name]
+
+        if (node.lost, node.late) != (lost, late):
+            failures.append('%s: lost %s late %s, expected %s and %s' % (label, node.lost, node.late, lost, late))
+
+    receiver.update(1.0)
+
+    if [node.name for node in receiver.nodes] != sorted(receiver.known):
+        failures.append('nodes are not sorted by name')
+
+    receiver.update(100.0)
+
+    if any(node.up for node in receiver.nodes):
+        failures.append('nodes still up after the timeout')
+
+    receiver.socket.close()
+
+    return failures
+
+
+def check_limits():
+    """
+    The node cap against a flood of names, and nodes expiring and coming back.
+    """
+    failures = []
+    receiver = FleetReceiver('127.0.0.1', 0, timeout=10, max_nodes=4, expire=50)
+
+    for i in range(10000):
+        receiver.handle(encode(b'flood-%05d' % i, 1, 0, REPORT), 0.0)
+
+    if len(receiver.known) != 4 or receiver.rejected != 9996 or receiver.datagrams != 4:
+        failures.append('%s nodes kept and %s rejected out of a flood of 10000 names' % (len(receiver.known),
+                                                                                        receiver.rejected))
+
+    receiver.update(1.0)
+    receiver.handle(encode(b'flood-00000', 1, 1, REPORT), 30.0)
+    receiver.update(60.0)
+
+    if [node.name for node in receiver.nodes] != [b'flood-00000']:
+        failures.append('%s left after expiring, expected flood-00000' % [node.name for node in receiver.nodes])
+
+    # One expired node reports before the receiver thread gets to forget it, it goes back on the screen
+    receiver.handle(encode(b'flood-00001', 1, 1, REPORT), 61.0)
+    receiver.forget(61.0)
+    receiver.handle(encode(b'new', 1, 0, REPORT), 61.0)
+    receiver.update(62.0)
+
+    if [node.name for node in receiver.nodes] != [b'flood-00000', b'flood-00001', b'new'] or \
+            len(receiver.known) != 3:
+        failures.append('%s on the screen and %s known after new reports' % ([node.name for node in receiver.nodes],
+                                                                              sorted(receiver.known)))
+
+    receiver.socket.close()
+
+    return failures
+
+
+def check_sender():
+    """
+    A sender fed by real screens, through the loopback interface to a receiver and its screen.
+    """
+    failures = []
+    receiver = FleetReceiver('127.0.0.1', 0)
+    screen = FleetScreen(receiver)
+
+    cpu = CpuScreen()
+    network = NetworkScreen('wlan0', ip='192.168.1.20')
+    memory = MemoryScreen()
+    sender = FleetSender('127.0.0.1', receiver.socket.getsockname()[1], b'synthetic', cpu, memory, [network])
+
+    sampler = Sampler(backend=SyntheticSource(interfaces=('wlan0',)))
+    for collector in (network, memory, cpu):
+        sampler.register(collector)
+    sampler.add_listener(sender.handle_sample)
+
+    for i in range(3):
+        sampler.tick()
+
+    time.sleep(0.1)
+    receiver.receive()
+    screen.collect(sampler.backend.sample())
+
+    if len(screen.nodes) != 1 or screen.nodes[0].received != 2:
+        failures.append('expected 2 reports from one node, got %s' % [(node.name, node.received)
+                                                                     for node in screen.nodes])
+    else:
+        expected = sender.report()
+        report = screen.nodes[0].report
+
+        if abs(report.cpu - expected.cpu) > 0.01 or abs(report.memory - expected.memory) > 0.01 or \
+                abs(report.receive - expected.receive) > expected.receive * 1e-6 or \
+                [abs(a - b) > 0.5 for a, b in zip(report.cores, expected.cores)] != [False] * len(expected.cores):
+            failures.append('received %s, the screens show %s' % (report, expected))
+
+        if list(screen.nodes[0].measures['cpu']) != [round(report.cpu, 2)] or screen.measures['cpu'] != [report.cpu]:
+            failures.append('fleet screen did not record the report')
+
+    sender.close()
+    receiver.socket.close()
+
+    return failures
+
+
+def send(port, first, nodes, rate, seconds):
+    """
+    The sender processes: nodes first..first + nodes - 1, each sending rate reports a second.
+    """
+    senders = [FleetSender('127.0.0.1', port, b'node-%04d' % i) for i in range(first, first + nodes)]
+    start = time.time()
+    ticks = int(seconds * rate)
+
+    for tick in range(ticks):
+        # Paced against the start, so the sending itself does not slow the rate down
+        delay = start + float(tick) / rate - time.time()
+        if delay > 0:
+            time.sleep(delay)
+
+        for i, sender in enumerate(senders):
+            sender.send(Report((tick + i) % 101, 50.0, 1000.0 * i, 10.0 * tick, (tick % 101,) * 4))
+
+    print sum(sender.sequence for sender in senders), sum(sender.errors for sender in senders)
+
+
+def load(processes, nodes, rate, seconds, buffer_size):
+    receiver = FleetReceiver('127.0.0.1', 0, buffer_size=buffer_size)
+    receiver.start()
+    port = receiver.socket.getsockname()[1]
+
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    started = time.time()
+
+    children = []
+    for i in range(processes):
+        children.append(subprocess.Popen([sys.executable, os.path.abspath(__file__), '--send', str(port),
+                                          '--first', str(i * nodes), '--nodes', str(nodes), '--rate', str(rate),
+                                          '--seconds', str(seconds)], stdout=subprocess.PIPE))
+
+    sent = errors = 0
+    for child in children:
+        output = child.communicate()[0].split()
+        sent += int(output[0])
+        errors += int(output[1])
+
+    # Let the receiver drain what is still queued on its socket
+    time.sleep(0.5)
+    elapsed = time.time() - started
+    receiver.stop()
+
+    after = resource.getrusage(resource.RUSAGE_SELF)
+    cpu = after.ru_utime + after.ru_stime - usage.ru_utime - usage.ru_stime
+
+    receiver.update()
+    received = sum(node.received for node in receiver.nodes)
+    lost = sum(node.lost for node in receiver.nodes)
+
+    return {
+        'nodes': len(receiver.nodes),
+        'sent': sent,
+        'errors': errors,
+        'received': received,
+        'lost': lost,
+        # Datagrams lost after a node's last received one do not show up as a gap
+        'unaccounted': sent - errors - received - lost,
+        'rate': received / elapsed,
+        'cpu_us': cpu / max(received, 1) * 1e6
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--processes', type=int, default=8, help='sender processes')
+    parser.add_argument('--nodes', type=int, default=32, help='nodes per sender process')
+    parser.add_argument('--rate', type=float, default=10, help='reports per node per second')
+    parser.add_argument('--seconds', type=float, default=5, help='duration of the load test')
+    parser.add_argument('--buffer-size', type=int, default=1 << 20, help='receive buffer of the socket')
+    parser.add_argument('--send', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--first', type=int, default=0, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.send is not None:
+        send(args.send, args.first, args.nodes, args.rate, args.seconds)
+        return 0
+
+    failures = check_protocol() + check_limits() + check_sender()
+
+    for failure in failures:
+        print 'FAIL %s' % failure
+
+    print 'Protocol check: %s, a 4 core report is %s bytes' % ('failed' if failures else 'ok',
+                                                              len(encode(b'node-0000', 0, 0, REPORT)))
+
+    result = load(args.processes, args.nodes, args.rate, args.seconds, args.buffer_size)
+
+    print '%s nodes from %s processes at %g reports/s each' % (result['nodes'], args.processes, args.rate)
+    print 'sent %(sent)s, send errors %(errors)s, received %(received)s, lost %(lost)s, ' \
+          'lost at the end %(unaccounted)s' % result
+    print 'received %.0f datagrams/s, %.1f us receiver CPU per datagram' % (result['rate'], result['cpu_us'])
+
+    return 1 if failures or result['nodes'] != args.processes * args.nodes else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,287 @@
+#!/usr/bin/python
+"""
+Checks the FrameBuffer backend draws exactly what PIL draws, and compares what a frame costs on each.
+
+Every sub-screen of every screen is rendered on two displays after each synthetic sample, one
+drawing with PIL and converting the image to the controller's pages, the other drawing into a
+FrameBuffer, in both render modes. The pages the two would send must be identical for every frame.
+The drawing calls the renderers make are also fuzzed one by one, with shapes partly or entirely
+off the display, reversed corners and bars pointing the wrong way. Then the time per frame of both
+backends is reported.
+"""
+import argparse
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lib'))
+
+from luma.core.device import dummy
+from PIL import Image
+from PIL import ImageDraw
+
+from display import CountingSerial
+from display import DiffingDisplay
+from fleet import FleetReceiver
+from fleet import Report
+from fleet import encode
+from framebuffer import FrameBuffer
+from glyphs import text_cache
+from metrics import BUS_TIME
+from metrics import LOCK_WAIT
+from metrics import PerformanceCounters
+from metrics import RENDER_TIME
+from metrics import SAMPLER_JITTER
+from renderers import LabeledBarRenderer
+from renderers import RendererConfig
+from renderers import draw_bars
+from screens import CpuScreen
+from screens import DiagnosticsScreen
+from screens import FleetScreen
+from screens import MemoryScreen
+from screens import NetworkScreen
+from screens import ProcessScreen
+from synthetic import SyntheticSource
+
+MODES = (('full', False), ('scrolling', True))
+BACKENDS = ('pil', 'framebuffer')
+
+
+class SyntheticFleet:
+    """
+    Feeds a receiver reports from a few dozen nodes on a virtual clock, some of them going quiet.
+    """
+
+    def __init__(self, seed, nodes=40):
+        self.random = random.Random(seed)
+        self.now = 0.0
+        self.names = [b'node-%02d' % i for i in range(nodes)]
+        self.receiver = FleetReceiver('127.0.0.1', 0, clock=lambda: self.now)
+        self.sequence = 0
+
+    def step(self):
+        self.now += 1.0
+        self.sequence += 1
+
+        for i, name in enumerate(self.names):
+            # Every seventh node stops reporting for a while
+            if i % 7 == 3 and (self.sequence // 20) % 2:
+                continue
+
+            cpu = self.random.uniform(0, 100)
+            report = Report(cpu, self.random.uniform(20, 90), 0.0, 0.0, (cpu,) * 4)
+            self.receiver.handle(encode(name, 1, self.sequence, report), self.now)
+
+
+def create_screens(interface, scrolling, counters, receiver):
+    process = ProcessScreen(scrolling)
+    process.show()
+
+    return [
+        CpuScreen(scrolling),
+        NetworkScreen(interface, scrolling, ip='192.168.1.20'),
+        MemoryScreen(scrolling),
+        process,
+        DiagnosticsScreen(counters, scrolling),
+        FleetScreen(receiver, scrolling)
+    ]
+
+
+class Pair:
+    """
+    A PIL and a FrameBuffer display, each with the screen's chart of its own.
+    """
+
+    def __init__(self):
+        self.displays = dict((backend, DiffingDisplay(dummy(mode='1'), serial=CountingSerial(),
+                                                      framebuffer=backend == 'framebuffer'))
+                             for backend in BACKENDS)
+        self.charts = {}
+        self.times = dict((backend, []) for backend in BACKENDS)
+
+    def render(self, screen):
+        for backend in BACKENDS:
+            display = self.displays[backend]
+            screen.chart = self.charts.get(backend)
+
+            start = timeit.default_timer()
+            screen.render(display)
+            self.times[backend].append(timeit.default_timer() - start)
+
+            self.charts[backend] = screen.chart
+
+        return self.displays['pil'].frame == self.displays['framebuffer'].frame
+
+
+def compare_screens(frames, warmup, seed, interface):
+    results = []
+
+    for mode, scrolling in MODES:
+        source = SyntheticSource(seed=seed, interfaces=(interface,))
+        fleet = SyntheticFleet(seed)
+        counters = PerformanceCounters()
+        noise = random.Random(seed)
+        screens = create_screens(interface, scrolling, counters, fleet.receiver)
+
+        def collect():
+            sample = source.sample()
+            fleet.step()
+
+            for name in (RENDER_TIME, BUS_TIME, SAMPLER_JITTER, LOCK_WAIT):
+                counters.record(name, noise.expovariate(1.0))
+
+            for screen in screens:
+                screen.collect(sample)
+
+        for i in range(warmup):
+            collect()
+
+        for screen in screens:
+            pages = len(screen.screen_config) + len(getattr(screen, 'nodes', []))
+
+            # The fleet screen has a page per node, a few of them are enough
+            for index in range(min(pages, len(screen.screen_config) + 3)):
+                screen.screen_index = index
+                pair = Pair()
+                mismatches = 0
+
+                for i in range(frames):
+                    collect()
+
+                    if not pair.render(screen):
+                        mismatches += 1
+
+                result = {'screen': screen.name, 'mode': mode, 'index': index, 'mismatches': mismatches}
+
+                for backend in BACKENDS:
+                    # The first frame draws the charts from scratch, leave it out like the steady state
+                    times = sorted(pair.times[backend][1:])
+                    result[backend] = sum(times) / len(times) * 1000
+                    result['%s_p95' % backend] = times[int(len(times) * 0.95)] * 1000
+
+                results.append(result)
+
+    return results
+
+
+def pages(image):
+    return DiffingDisplay(dummy(mode='1')).to_pages(image)
+
+
+def fuzz(rounds, seed):
+    """
+    Draws random shapes with both backends, returns the calls that came out differently.
+    """
+    rng = random.Random(seed)
+    failures = []
+    texts = ['CPU', '42.5%', 'Top Memory (123)', 'node-07 down', '1/2/3ms', '%g' % 1234.5]
+
+    def coordinate(limit):
+        return rng.randint(-10, limit + 10)
+
+    for i in range(rounds):
+        image = Image.new('1', (128, 64))
+        draw = ImageDraw.Draw(image)
+        frame = FrameBuffer(128, 64)
+        calls = []
+
+        for j in range(rng.randint(1, 8)):
+            kind = rng.choice(('rectangle', 'clear', 'hline', 'vline', 'point', 'text', 'bars'))
+
+            if kind in ('rectangle', 'clear'):
+                box = [(coordinate(128), coordinate(64)), (coordinate(128), coordinate(64))]
+                fill = 'white' if kind == 'rectangle' else 'black'
+                call = ('rectangle', (box,), {'fill': fill, 'outline': rng.choice((None, fill))})
+            elif kind == 'hline':
+                y = coordinate(64)
+                call = ('line', ([(coordinate(128), y), (coordinate(128), y)],), {'fill': 'white', 'width': 1})
+            elif kind == 'vline':
+                x = coordinate(128)
+                call = ('line', ([(x, coordinate(64)), (x, coordinate(64))],), {'fill': 'white', 'width': 1})
+            elif kind == 'point':
+                call = ('point', ((coordinate(128), coordinate(64)),), {'fill': 'white'})
+            elif kind == 'text':
+                call = ('bitmap', ((coordinate(128), coordinate(64)), text_cache.get(rng.choice(texts))),
+                        {'fill': 'white'})
+            else:
+                heights = [rng.randint(-5, 70) for k in range(rng.randint(0, 40))]
+                call = ('bars', (rng.randint(-5, 132), rng.choice((-4, -1, 1, 4)), rng.randint(0, 63), heights),
+                        {'width': rng.choice((1, 3)), 'up': rng.choice((True, False))})
+
+            calls.append(call)
+            name, args, kwargs = call
+
+            if name == 'bars':
+                draw_bars(draw, *args, **kwargs)
+                draw_bars(frame, *args, **kwargs)
+            else:
+                getattr(draw, name)(*args, **kwargs)
+                getattr(frame, name)(*args, **kwargs)
+
+        if pages(image) != frame.buffer:
+            failures.append('round %s: %s' % (i, [(name, args[:3], kwargs) for name, args, kwargs in calls]))
+
+    return failures
+
+
+def check_labeled_bars(seed):
+    """
+    The labeled bar renderer is not on any screen, it is checked on its own.
+    """
+    rng = random.Random(seed)
+    renderer = LabeledBarRenderer()
+    config = RendererConfig(renderer, 'cores', 'Cores', x_start=4, x_step=30)
+    failures = []
+
+    for i in range(50):
+        data = {'cores': dict(('cpu%s' % k, [rng.uniform(0, 50), rng.uniform(0, 50)]) for k in range(4))}
+        image = Image.new('1', (128, 64))
+        frame = FrameBuffer(128, 64)
+
+        renderer.render(ImageDraw.Draw(image), config, data)
+        renderer.render(frame, config, data)
+
+        if pages(image) != frame.buffer:
+            failures.append('labeled bars round %s differ' % i)
+
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--frames', type=int, default=100, help='frames rendered per sub-screen and mode')
+    parser.add_argument('--warmup', type=int, default=200, help='samples collected before rendering')
+    parser.add_argument('--fuzz', type=int, default=2000, help='rounds of random drawing calls')
+    parser.add_argument('--seed', type=int, default=1, help='seed of the synthetic samples and shapes')
+    parser.add_argument('--interface', default='wlan0', help='network interface name to simulate')
+    args = parser.parse_args()
+
+    failures = fuzz(args.fuzz, args.seed) + check_labeled_bars(args.seed)
+
+    for failure in failures[:20]:
+        print 'FAIL %s' % failure
+
+    print 'Drawing calls: %s' % ('failed' if failures else 'ok')
+
+    results = compare_screens(args.frames, args.warmup, args.seed, args.interface)
+
+    print '%-12s %-9s %-2s %10s %10s %10s %10s %8s' % ('screen', 'mode', '#', 'pil ms', 'p95', 'fb ms', 'p95',
+                                                       'differ')
+    for result in results:
+        print '%-12s %-9s %-2s %10.3f %10.3f %10.3f %10.3f %8s' % (result['screen'], result['mode'], result['index'],
+                                                                   result['pil'], result['pil_p95'],
+                                                                   result['framebuffer'], result['framebuffer_p95'],
+                                                                   result['mismatches'])
+
+    for backend in BACKENDS:
+        print '%-12s %.3f ms per frame on average' % (backend, sum(result[backend] for result in results) / len(results))
+
+    mismatched = sum(result['mismatches'] for result in results)
+    print 'Screens: %s frames differ' % mismatched
+
+    return 1 if failures or mismatched else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
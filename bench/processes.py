@@ -0,0 +1,189 @@
+#!/usr/bin/python
+"""
+Measures a process screen refresh on a synthetic /proc tree with hundreds of processes.
+
+Every round some processes use CPU, a few exit and new ones start, some of them reusing PIDs.
+The script checks the scanner sees exactly the live processes, with the right CPU use, and that its
+top-k selection matches a full sort. Then it reports the cost of a refresh, top processes included,
+against what sorting every process would add to it.
+"""
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lib'))
+
+from processes import PAGE_SIZE
+from processes import ProcessScanner
+from procfs import CLOCK_TICKS
+
+NAMES = ('systemd', 'kworker/0:1', 'sshd', 'python', 'bash', 'cron', 'dbus-daemon', 'node', 'nginx: worker',
+         'rsyslogd', 'avahi-daemon', 'tmux: server', 'weird) (name')
+
+
+class SyntheticProc:
+    """
+    A /proc tree holding only what the scanner reads: one directory per PID with a stat file.
+    """
+
+    def __init__(self, root, count, seed=1):
+        self.root = root
+        self.random = random.Random(seed)
+        self.processes = {}
+        self.next_pid = 1
+        self.clock = 1000
+
+        for name in ('stat', 'meminfo', 'self'):
+            open(os.path.join(root, name), 'w').close()
+
+        for i in range(count):
+            self.spawn()
+
+    def write(self, pid):
+        name, utime, stime, start, rss = self.processes[pid]
+        fields = ['S', '1', str(pid), str(pid), '0', '-1', '4194560', '120', '0', '0', '0', str(utime), str(stime),
+                  '0', '0', '20', '0', '1', '0', str(start), str(rss * PAGE_SIZE * 4), str(rss), '18446744073709551615',
+                  '1', '1', '0', '0', '0', '0', '0', '0', '0', '0', '0', '0', '0', '17', '0', '0', '0', '0', '0']
+
+        with open(os.path.join(self.root, str(pid), 'stat'), 'w') as stat:
+            stat.write('%s (%s) %s\n' % (pid, name, ' '.join(fields)))
+
+    def spawn(self, pid=None):
+        if pid is None:
+            pid = self.next_pid
+            self.next_pid += 1
+
+        if not os.path.isdir(os.path.join(self.root, str(pid))):
+            os.mkdir(os.path.join(self.root, str(pid)))
+
+        self.processes[pid] = [self.random.choice(NAMES), 0, 0, self.clock, self.random.randint(100, 50000)]
+        self.write(pid)
+
+    def exit(self, pid):
+        del self.processes[pid]
+        shutil.rmtree(os.path.join(self.root, str(pid)))
+
+    def step(self, seconds, busy_share=0.3, churn=3):
+        """
+        Advances the tree by seconds, returns the CPU percent every process used.
+        """
+        self.clock += int(seconds * CLOCK_TICKS)
+        used = {}
+
+        for pid, process in self.processes.items():
+            ticks = 0
+
+            if self.random.random() < busy_share:
+                ticks = self.random.randint(1, int(seconds * CLOCK_TICKS))
+                process[1] += ticks - ticks // 3
+                process[2] += ticks // 3
+                process[4] = max(100, process[4] + self.random.randint(-50, 50))
+                self.write(pid)
+
+            used[pid] = ticks / CLOCK_TICKS / seconds * 100
+
+        for pid in self.random.sample(sorted(self.processes.keys()), churn):
+            self.exit(pid)
+            del used[pid]
+
+            # Half of the new processes get the PID that just went away
+            self.spawn(pid if self.random.random() < 0.5 else None)
+
+        return used
+
+
+def check(root, count, rounds):
+    tree = SyntheticProc(root, count)
+    scanner = ProcessScanner(root)
+    failures = []
+    timestamp = 0.0
+
+    scanner.refresh(timestamp)
+
+    for i in range(rounds):
+        timestamp += 2.0
+        used = tree.step(2.0)
+        scanner.refresh(timestamp)
+
+        if sorted(int(pid) for pid in scanner.processes) != sorted(tree.processes):
+            failures.append('round %s: scanner has %s processes, tree %s' % (i, len(scanner.processes),
+                                                                             len(tree.processes)))
+
+        for pid, percent in used.items():
+            if abs(scanner.processes[str(pid)].cpu - percent) > 1e-6:
+                failures.append('round %s: pid %s at %.2f%%, expected %.2f%%' % (i, pid,
+                                                                                scanner.processes[str(pid)].cpu,
+                                                                                percent))
+
+        for key, top in ((lambda process: process.cpu, scanner.top_cpu),
+                         (lambda process: process.rss, scanner.top_rss)):
+            expected = [key(process) for process in sorted(scanner.processes.values(), key=key, reverse=True)[:5]]
+
+            if [key(process) for process in top] != expected:
+                failures.append('round %s: top 5 differs from a full sort' % i)
+
+    return failures
+
+
+def benchmark(root, count, rounds):
+    tree = SyntheticProc(root, count)
+    scanner = ProcessScanner(root)
+    timestamp = [0.0]
+    scanner.refresh(timestamp[0])
+
+    def refresh():
+        timestamp[0] += 2.0
+        scanner.refresh(timestamp[0])
+
+    refresh_seconds = 0.0
+    for i in range(rounds):
+        tree.step(2.0)
+        refresh_seconds += timeit.timeit(refresh, number=1)
+
+    # What picking the top processes by sorting them all after the scan would add to a refresh
+    def sort():
+        processes = scanner.processes.values()
+        return (sorted(processes, key=lambda process: process.cpu, reverse=True)[:5],
+                sorted(processes, key=lambda process: process.rss, reverse=True)[:5])
+
+    sort_seconds = min(timeit.repeat(sort, number=100, repeat=3)) / 100
+
+    return refresh_seconds / rounds, sort_seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--processes', type=int, nargs='+', default=[100, 300, 1000], help='sizes of the tree')
+    parser.add_argument('--rounds', type=int, default=20, help='refreshes per size')
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp(prefix='pi-monitor-proc-')
+
+    try:
+        os.mkdir(os.path.join(root, 'check'))
+        failures = check(os.path.join(root, 'check'), 200, args.rounds)
+
+        for failure in failures[:20]:
+            print 'FAIL %s' % failure
+
+        print 'Scanner check: %s' % ('failed' if failures else 'ok')
+        print '%10s %14s %14s' % ('processes', 'refresh ms', 'sorting ms')
+
+        for count in args.processes:
+            path = os.path.join(root, str(count))
+            os.mkdir(path)
+
+            refresh, sort = benchmark(path, count, args.rounds)
+            print '%10s %14.2f %14.2f' % (count, refresh * 1000, sort * 1000)
+    finally:
+        shutil.rmtree(root)
+
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,243 @@
+#!/usr/bin/python
+"""
+Checks the quantile sketches against exact percentiles and measures what keeping them costs.
+
+The CPU, memory and network screens collect synthetic samples (see synthetic.py) with quantile
+sketches on their histories, one sample a second on the samples' own clock. Every --check samples
+the p50/p95/p99 and maximum of each window of a few of the histories are compared with the exact
+nearest-rank values over the same samples, which have to be within the sketch's accuracy, and with
+the exact values over the window's length, which the sketch overshoots by up to a pane. A stream
+with negative values and zeros is checked the same way. Then the time a sample takes to collect
+with and without the sketches is reported, next to keeping every sample of the window sorted, with
+the buckets the sketches hold.
+"""
+import argparse
+import bisect
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lib'))
+
+from quantiles import QuantileSketch
+from quantiles import QuantileWindows
+from screens import CpuScreen
+from screens import MemoryScreen
+from screens import NetworkScreen
+from synthetic import SyntheticSource
+
+PERCENTS = (50, 95, 99)
+
+
+def create_screens(interface, quantiles):
+    return [CpuScreen(quantiles=quantiles), NetworkScreen(interface, ip='192.168.1.20', quantiles=quantiles),
+            MemoryScreen(quantiles=quantiles)]
+
+
+def exact(values):
+    values = sorted(values)
+
+    return [values[min(len(values) - 1, int(len(values) * percent / 100.0))] for percent in PERCENTS] + [values[-1]]
+
+
+def error(estimate, value):
+    if value == 0:
+        return abs(estimate)
+
+    return abs(estimate - value) / abs(value)
+
+
+class Checker:
+    """
+    Keeps every value of a stream with its timestamp and compares a sketch's windows with them.
+    """
+
+    def __init__(self, name, sketch, windows):
+        self.name = name
+        self.sketch = sketch
+        self.windows = windows
+        self.values = []
+        self.sketch_errors = [[0.0] * (len(PERCENTS) + 1) for window in windows]
+        self.window_errors = [[0.0] * (len(PERCENTS) + 1) for window in windows]
+
+    def add(self, value, timestamp):
+        self.values.append((timestamp, value))
+
+    def check(self):
+        for index, (length, label) in enumerate(self.windows):
+            estimates = self.sketch.quantiles(index, PERCENTS)
+            window = self.sketch.windows[index]
+
+            # The sketch holds the newest samples, as many as its buckets count
+            count = sum(window.counts.values())
+            covered = exact([value for timestamp, value in self.values[-count:]])
+            newest = self.values[-1][0]
+            strict = exact([value for timestamp, value in self.values if timestamp > newest - length])
+
+            for i, (estimate, value, strict_value) in enumerate(zip(estimates, covered, strict)):
+                self.sketch_errors[index][i] = max(self.sketch_errors[index][i], error(estimate, value))
+                self.window_errors[index][i] = max(self.window_errors[index][i], error(estimate, strict_value))
+
+
+def accuracy_check(samples, check, windows, accuracy, seed, interface):
+    quantiles = QuantileWindows(windows, accuracy)
+    source = SyntheticSource(seed=seed, interfaces=(interface,))
+    cpu, network, memory = create_screens(interface, quantiles)
+
+    streams = [
+        Checker('cpu percent', cpu.measures['percent'].sketch, windows),
+        Checker('cpu iowait', cpu.measures['iowait']['values'].sketch, windows),
+        Checker('memory used', memory.measures['used'].sketch, windows),
+        Checker('net bytes in', network.measures['bytes']['in'].sketch, windows),
+        Checker('net errors in', network.measures['errors']['in'].sketch, windows)
+    ]
+    histories = [cpu.measures['percent'], cpu.measures['iowait']['values'], memory.measures['used'],
+                 network.measures['bytes']['in'], network.measures['errors']['in']]
+
+    signed = Checker('signed', QuantileSketch(windows, accuracy), windows)
+    rng = random.Random(seed)
+
+    for i in range(samples):
+        sample = source.sample()
+        collected = cpu.timestamp is not None
+
+        for screen in (cpu, network, memory):
+            screen.collect(sample)
+
+        # The first sample only sets the counters up, nothing is appended yet
+        if collected:
+            for stream, history in zip(streams, histories):
+                stream.add(history.raw.newest(), sample.timestamp)
+
+        value = 0.0 if rng.random() < 0.1 else rng.gauss(0, 50)
+        signed.sketch.add(value, sample.timestamp)
+        signed.add(value, sample.timestamp)
+
+        if i and i % check == 0:
+            for stream in streams + [signed]:
+                stream.check()
+
+    return streams + [signed], (cpu, network, memory)
+
+
+def buckets(screens):
+    """
+    Buckets and sketches the screens hold over all their windows and panes.
+    """
+    keys = 0
+    sketches = 0
+
+    for screen in screens:
+        for history in screen.histories:
+            if history.sketch is None:
+                continue
+
+            sketches += 1
+
+            for window in history.sketch.windows:
+                keys += len(window.counts) + sum(len(pane) for pane in window.panes)
+
+    return keys, sketches
+
+
+def collect_cost(samples, windows, accuracy, seed, interface):
+    """
+    Seconds per sample the three screens take to collect, without and with sketches.
+    """
+    costs = []
+
+    for quantiles in (None, QuantileWindows(windows, accuracy)):
+        source = SyntheticSource(seed=seed, interfaces=(interface,))
+        screens = create_screens(interface, quantiles)
+        batch = [source.sample() for i in range(samples)]
+
+        start = timeit.default_timer()
+        for sample in batch:
+            for screen in screens:
+                screen.collect(sample)
+        costs.append((timeit.default_timer() - start) / samples)
+
+    return costs
+
+
+def add_cost(samples, windows, accuracy, seed):
+    """
+    Seconds one value takes to add to a sketch and to a sorted list of every value in the windows.
+    """
+    rng = random.Random(seed)
+    values = [(float(i), rng.expovariate(0.1)) for i in range(samples)]
+
+    sketch = QuantileSketch(windows, accuracy)
+    start = timeit.default_timer()
+    for timestamp, value in values:
+        sketch.add(value, timestamp)
+    sketch_cost = (timeit.default_timer() - start) / samples
+
+    start = timeit.default_timer()
+    query = 100
+    for i in range(query):
+        for index in range(len(windows)):
+            sketch.quantiles(index, PERCENTS)
+    query_cost = (timeit.default_timer() - start) / query / len(windows)
+
+    lists = [[] for window in windows]
+    start = timeit.default_timer()
+    for i, (timestamp, value) in enumerate(values):
+        for (length, label), ordered in zip(windows, lists):
+            bisect.insort(ordered, value)
+
+            if i >= length:
+                del ordered[bisect.bisect_left(ordered, values[i - int(length)][1])]
+    sorted_cost = (timeit.default_timer() - start) / samples
+
+    return sketch_cost, query_cost, sorted_cost, sum(len(ordered) for ordered in lists)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--samples', type=int, default=20000, help='samples collected, one per second')
+    parser.add_argument('--check', type=int, default=997, help='samples between comparisons with exact values')
+    parser.add_argument('--window', action='append', type=int,
+                        help='window lengths in seconds, 600 and 3600 by default')
+    parser.add_argument('--accuracy', type=float, default=0.01, help='relative accuracy of the sketches')
+    parser.add_argument('--seed', type=int, default=1, help='seed of the synthetic samples')
+    parser.add_argument('--interface', default='wlan0', help='network interface name to simulate')
+    args = parser.parse_args()
+
+    windows = [(length, '%ss' % length) for length in args.window or (600, 3600)]
+    streams, screens = accuracy_check(args.samples, args.check, windows, args.accuracy, args.seed, args.interface)
+    failures = []
+
+    print 'Largest relative error against the samples the sketch holds, and against the exact window'
+    print '%-14s %-7s %8s %8s %8s %8s   %8s %8s %8s %8s' % (('stream', 'window') + tuple('p%s' % p for p in PERCENTS) +
+                                                            ('max',) + tuple('p%s' % p for p in PERCENTS) + ('max',))
+    for stream in streams:
+        for index, (length, label) in enumerate(windows):
+            errors = stream.sketch_errors[index]
+            print '%-14s %-7s %8.4f %8.4f %8.4f %8.4f   %8.4f %8.4f %8.4f %8.4f' % (
+                (stream.name, label) + tuple(errors) + tuple(stream.window_errors[index]))
+
+            # A float's rounding on top of the accuracy, the maximum is exact
+            if max(errors[:-1]) > args.accuracy + 1e-9 or errors[-1] > 0:
+                failures.append('%s %s is off by %.4f' % (stream.name, label, max(errors)))
+
+    keys, sketches = buckets(screens)
+    print '%s sketches hold %s buckets, %.0f per window' % (sketches, keys, float(keys) / sketches / len(windows))
+
+    without, with_sketches = collect_cost(min(args.samples, 5000), windows, args.accuracy, args.seed, args.interface)
+    print 'Collecting a sample: %.1fus without sketches, %.1fus with them' % (without * 1e6, with_sketches * 1e6)
+
+    sketch_cost, query_cost, sorted_cost, kept = add_cost(min(args.samples, 20000), windows, args.accuracy, args.seed)
+    print 'Adding a value: %.2fus to a sketch, %.2fus to sorted lists of the windows (%s values kept)' % (
+        sketch_cost * 1e6, sorted_cost * 1e6, kept)
+    print 'Reading p50/p95/p99/max of a window: %.1fus' % (query_cost * 1e6)
+
+    for failure in failures:
+        print 'FAIL %s' % failure
+
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
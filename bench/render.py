@@ -0,0 +1,210 @@
+#!/usr/bin/python
+"""
+Renders every sub-screen of every screen on luma's dummy device and reports the cost per frame.
+
+Each frame takes a new synthetic sample (see synthetic.py) and renders the sub-screen the way the
+monitor does, once with full redraws and once in scrolling mode. For every sub-screen it reports the
+render time, the objects allocated, the bytes that would have gone over the bus and how much of the
+text was pasted from the text cache rather than rasterized again. Results can be written as JSON and
+compared with an earlier run to spot regressions.
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import sys
+import time
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lib'))
+
+import PIL
+from luma.core.device import dummy
+
+from display import CountingSerial
+from display import DiffingDisplay
+from glyphs import text_cache
+from screens import CpuScreen
+from screens import MemoryScreen
+from screens import NetworkScreen
+from synthetic import SyntheticSource
+
+MODES = (('full', False), ('scrolling', True))
+
+
+def create_screens(interface, scrolling):
+    return [
+        CpuScreen(scrolling),
+        NetworkScreen(interface, scrolling, ip='192.168.1.20'),
+        MemoryScreen(scrolling)
+    ]
+
+
+def measure(screen, source, display, serial, frames):
+    """
+    Renders frames of the screen's current sub-screen, each after a new sample.
+    """
+    times = []
+    objects = 0
+    serial.reset()
+    hits, misses = text_cache.hits, text_cache.misses
+
+    gc.collect()
+    gc.disable()
+
+    try:
+        for i in range(frames):
+            screen.collect(source.sample())
+
+            # With the collector off the generation 0 count goes up by one for every container object
+            # allocated and down for every one freed
+            before = gc.get_count()[0]
+            start = timeit.default_timer()
+            screen.render(display)
+            times.append(timeit.default_timer() - start)
+            objects += gc.get_count()[0] - before
+    finally:
+        gc.enable()
+
+    garbage = gc.collect()
+    times.sort()
+    hits, misses = text_cache.hits - hits, text_cache.misses - misses
+
+    return {
+        'ms_per_frame': sum(times) / frames * 1000,
+        'ms_p50': times[frames // 2] * 1000,
+        'ms_p95': times[min(frames - 1, int(frames * 0.95))] * 1000,
+        'objects_per_frame': float(objects) / frames,
+        'garbage_per_frame': float(garbage) / frames,
+        'bus_bytes_per_frame': float(serial.command_bytes + serial.data_bytes) / frames,
+        'data_bytes_per_frame': float(serial.data_bytes) / frames,
+        'transactions_per_frame': float(serial.transactions + serial.commands) / frames,
+        'text_hit_rate': float(hits) / (hits + misses) if hits + misses else 1.0
+    }
+
+
+def benchmark(frames, warmup, seed, interface):
+    results = []
+
+    for mode, scrolling in MODES:
+        source = SyntheticSource(seed=seed, interfaces=(interface,))
+        screens = create_screens(interface, scrolling)
+
+        # Fill the histories so every frame draws full charts
+        for i in range(warmup):
+            sample = source.sample()
+
+            for screen in screens:
+                screen.collect(sample)
+
+        for screen in screens:
+            for index, config in enumerate(screen.screen_config):
+                serial = CountingSerial()
+                display = DiffingDisplay(dummy(mode='1'), serial=serial)
+                screen.screen_index = index
+
+                # The first frame sends the whole screen, leave it out like the monitor's steady state
+                screen.render(display)
+
+                result = {
+                    'screen': screen.name,
+                    'mode': mode,
+                    'index': index,
+                    'sub_screen': config.name,
+                    'renderer': config.renderer.__class__.__name__
+                }
+                result.update(measure(screen, source, display, serial, frames))
+                results.append(result)
+
+    return results
+
+
+def metadata(args):
+    return {
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'machine': platform.machine(),
+        'pil': getattr(PIL, '__version__', getattr(PIL, 'PILLOW_VERSION', None)),
+        'frames': args.frames,
+        'warmup': args.warmup,
+        'seed': args.seed,
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S')
+    }
+
+
+def result_key(result):
+    return result['screen'], result['mode'], result['index']
+
+
+def compare(baseline, results, threshold):
+    """
+    Lists the sub-screens whose time, allocations or bus traffic grew by more than threshold.
+    """
+    previous = dict((result_key(result), result) for result in baseline['results'])
+    regressions = []
+
+    for result in results:
+        old = previous.get(result_key(result))
+
+        if old is None:
+            continue
+
+        for field in ('ms_p50', 'objects_per_frame', 'bus_bytes_per_frame'):
+            # The median and a small absolute slack keep timer noise from flagging
+            if result[field] > old[field] * (1 + threshold) + 0.05:
+                regressions.append('%s %s #%s %s: %s: %.2f -> %.2f' % (result['screen'], result['mode'], result['index'],
+                                                                      result['sub_screen'], field, old[field],
+                                                                      result[field]))
+
+    return regressions
+
+
+def print_results(results):
+    print '%-16s %-9s %-2s %-11s %-16s %8s %8s %8s %9s %6s' % ('screen', 'mode', '#', 'sub-screen', 'renderer',
+                                                               'ms/frame', 'ms p95', 'objs', 'bus B', 'text%')
+
+    for result in results:
+        print '%-16s %-9s %-2s %-11s %-16s %8.3f %8.3f %8.1f %9.1f %6.1f' % (
+            result['screen'], result['mode'], result['index'], result['sub_screen'], result['renderer'],
+            result['ms_per_frame'], result['ms_p95'], result['objects_per_frame'], result['bus_bytes_per_frame'],
+            result.get('text_hit_rate', 1.0) * 100)
+
+    hits, misses = text_cache.hits, text_cache.misses
+    print 'Text cache: %s hits, %s misses, %.1f%% of text drawn from the cache' % (
+        hits, misses, hits * 100.0 / (hits + misses) if hits + misses else 100.0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--frames', type=int, default=200, help='frames rendered per sub-screen and mode')
+    parser.add_argument('--warmup', type=int, default=4000, help='samples collected before measuring')
+    parser.add_argument('--seed', type=int, default=1, help='seed of the synthetic samples')
+    parser.add_argument('--interface', default='wlan0', help='network interface name to simulate')
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    parser.add_argument('--compare', metavar='BASELINE', help='JSON results of an earlier run to compare with')
+    parser.add_argument('--threshold', type=float, default=0.2, help='relative growth reported as a regression')
+    args = parser.parse_args()
+
+    results = benchmark(args.frames, args.warmup, args.seed, args.interface)
+    print_results(results)
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump({'metadata': metadata(args), 'results': results}, output, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as baseline:
+            regressions = compare(json.load(baseline), results, args.threshold)
+
+        for regression in regressions:
+            print 'REGRESSION %s' % regression
+
+        print 'Compared with %s: %s regressions' % (args.compare, len(regressions))
+        return 1 if regressions else 0
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,258 @@
+#!/usr/bin/python
+"""
+Replays a recorded trace against the CPU, network and memory screens and reports frames/s and render latency.
+
+A trace comes from the monitor with [sampler] trace set, from --record, which samples /proc
+directly for a number of seconds, or from --synthetic, which writes bursty synthetic samples (see
+synthetic.py). The replay runs on a virtual clock, --speed times faster than the recording, and
+renders the visible sub-screen on luma's dummy device after every sample, showing each sub-screen
+in turn. It reports the frames per second it sustained, the render latency percentiles and how far
+it fell behind the virtual clock, for every render mode and renderer. Before that it checks a trace
+round trips, survives a torn record at its end and rotates at its size limit. Results can be written
+as JSON and compared with an earlier run.
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lib'))
+
+from luma.core.device import dummy
+
+from display import CountingSerial
+from display import DiffingDisplay
+from procfs import ProcBackend
+from recording import TraceReader
+from recording import TraceReplay
+from recording import TraceWriter
+from screens import CpuScreen
+from screens import MemoryScreen
+from screens import NetworkScreen
+from synthetic import SyntheticSource
+
+MODES = (('full', False), ('scrolling', True))
+RENDERERS = ('pil', 'framebuffer')
+
+
+def close(a, b, tolerance):
+    if isinstance(a, dict):
+        return sorted(a) == sorted(b) and all(close(a[key], b[key], tolerance) for key in a)
+
+    if isinstance(a, (list, tuple)):
+        return len(a) == len(b) and all(close(x, y, tolerance) for x, y in zip(a, b))
+
+    return abs(a - b) <= tolerance
+
+
+def check(root):
+    """
+    Writes synthetic samples, tears the last record, appends more and reads everything back.
+    """
+    failures = []
+    path = os.path.join(root, 'check.bin')
+    source = SyntheticSource(seed=7)
+    samples = [source.sample() for i in range(50)]
+
+    writer = TraceWriter(path)
+    for sample in samples[:30]:
+        writer.write(sample)
+    writer.close()
+    record_size = writer.bytes // writer.records
+
+    # A recorder killed halfway through its last write
+    size = os.path.getsize(path)
+    with open(path, 'r+b') as trace:
+        trace.truncate(size - 100)
+
+    writer = TraceWriter(path)
+    for sample in samples[30:]:
+        writer.write(sample)
+    writer.close()
+
+    reader = TraceReader(path)
+    replayed = list(reader)
+    expected = samples[:29] + samples[30:]
+
+    if len(replayed) != len(expected) or reader.torn:
+        failures.append('read %s samples, expected %s, torn %s' % (len(replayed), len(expected), reader.torn))
+
+    for i, (sample, original) in enumerate(zip(replayed, expected)):
+        # Timestamps are kept in microseconds, times in hundredths of a second and percentages in tenths
+        for field, tolerance in (('timestamp', 5e-7), ('cpu_times', 0.005), ('cpu_percent', 0.05),
+                                 ('cpu_percent_percpu', 0.05), ('cpu_times_percpu', 0.005),
+                                 ('virtual_memory', 0.05), ('net_io', 0)):
+            if not close(getattr(sample, field), getattr(original, field), tolerance):
+                failures.append('sample %s: %s differs' % (i, field))
+
+    with open(path, 'ab') as trace:
+        trace.write(b'\x10\x00garbage')
+
+    reader = TraceReader(path)
+    if len(list(reader)) != len(expected) or not reader.torn:
+        failures.append('a torn record at the end was not detected')
+
+    # Reopening finds the garbage from the end of the file and cuts it off
+    writer = TraceWriter(path)
+    writer.close()
+
+    if os.path.getsize(path) != writer.size or len(list(reader)) != len(expected) or reader.torn:
+        failures.append('reopening the trace did not cut off the torn record')
+
+    # A limit of about ten samples moves every tenth sample on to a new trace
+    rotated = os.path.join(root, 'rotated.bin')
+    writer = TraceWriter(rotated, size_limit=10 * record_size)
+    for sample in samples:
+        writer.write(sample)
+    writer.close()
+
+    kept = list(TraceReader(rotated + '.1')) + list(TraceReader(rotated))
+    if writer.rotations < 4 or len(kept) < 10 or not close([sample.timestamp for sample in kept],
+                                                           [sample.timestamp for sample in samples[-len(kept):]], 5e-7):
+        failures.append('rotated %s times, kept %s samples' % (writer.rotations, len(kept)))
+
+    return failures
+
+
+def record(path, seconds, interval, interfaces):
+    backend = ProcBackend(interfaces=interfaces)
+    writer = TraceWriter(path)
+
+    for i in range(int(seconds / interval)):
+        writer.write(backend.sample())
+        time.sleep(interval)
+
+    writer.close()
+
+    return writer.records
+
+
+def synthesize(path, count, seed, interfaces):
+    source = SyntheticSource(seed=seed, interfaces=interfaces)
+    writer = TraceWriter(path)
+
+    for i in range(count):
+        writer.write(source.sample())
+
+    writer.close()
+
+    return writer.records
+
+
+def replay(path, speed, cycle_time, scrolling, renderer, interfaces):
+    reader = TraceReader(path)
+
+    if interfaces is None:
+        first = next(iter(reader), None)
+        interfaces = sorted(first.net_io) if first is not None else []
+
+    screens = [CpuScreen(scrolling)]
+    screens.extend(NetworkScreen(interface, scrolling, ip='192.168.1.20') for interface in interfaces)
+    screens.append(MemoryScreen(scrolling))
+
+    display = DiffingDisplay(dummy(mode='1'), serial=CountingSerial(), framebuffer=renderer == 'framebuffer')
+    result = TraceReplay(reader, screens, display, speed=speed, cycle_time=cycle_time).run()
+    result['torn'] = reader.torn
+
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('trace', nargs='?', help='trace file to replay, or to write with --record or --synthetic')
+    parser.add_argument('--record', type=float, metavar='SECONDS', help='record /proc for this long first')
+    parser.add_argument('--interval', type=float, default=1.0, help='seconds between recorded samples')
+    parser.add_argument('--synthetic', type=int, metavar='SAMPLES', help='write this many synthetic samples first')
+    parser.add_argument('--seed', type=int, default=1, help='seed of the synthetic samples')
+    parser.add_argument('--interface', action='append', help='interfaces to record and show, all of them by default')
+    parser.add_argument('--speed', type=float, default=100, help='times faster than recorded, 0 as fast as possible')
+    parser.add_argument('--cycle', type=float, default=10, help='recorded seconds each sub-screen is shown')
+    parser.add_argument('--mode', choices=[mode for mode, scrolling in MODES], action='append', help='render modes')
+    parser.add_argument('--renderer', choices=RENDERERS, action='append', help='renderers to replay with')
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    parser.add_argument('--compare', metavar='BASELINE', help='JSON results of an earlier run to compare with')
+    parser.add_argument('--threshold', type=float, default=0.2, help='relative growth reported as a regression')
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp(prefix='pi-monitor-trace-')
+
+    try:
+        failures = check(root)
+
+        for failure in failures[:20]:
+            print 'FAIL %s' % failure
+
+        print 'Trace check: %s' % ('failed' if failures else 'ok')
+
+        path = args.trace or os.path.join(root, 'synthetic.bin')
+
+        if args.record:
+            print 'Recorded %s samples' % record(path, args.record, args.interval, args.interface)
+        elif args.synthetic or not args.trace:
+            print 'Wrote %s synthetic samples' % synthesize(path, args.synthetic or 3000, args.seed,
+                                                            tuple(args.interface or ('wlan0', 'lo')))
+
+        size = os.path.getsize(path)
+        count = sum(1 for sample in TraceReader(path))
+        print 'Trace of %s bytes, %.0f bytes per sample, replayed at %gx' % (size, float(size) / max(count, 1),
+                                                                            args.speed)
+        print '%-9s %-11s %7s %8s %8s %8s %8s %8s %9s' % ('mode', 'renderer', 'frames', 'fps', 'p50 ms', 'p95 ms',
+                                                          'p99 ms', 'max ms', 'lag ms')
+
+        results = []
+        for mode, scrolling in MODES:
+            if args.mode and mode not in args.mode:
+                continue
+
+            for renderer in args.renderer or RENDERERS:
+                result = replay(path, args.speed, args.cycle, scrolling, renderer, args.interface)
+                result.update({'mode': mode, 'renderer': renderer})
+                results.append(result)
+
+                print '%-9s %-11s %7s %8.1f %8.3f %8.3f %8.3f %8.3f %9.1f' % (mode, renderer, result['frames'],
+                                                                              result['fps'], result['render_p50_ms'],
+                                                                              result['render_p95_ms'],
+                                                                              result['render_p99_ms'],
+                                                                              result['render_max_ms'],
+                                                                              result['lag_max_ms'])
+    finally:
+        shutil.rmtree(root)
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump({'metadata': {'python': platform.python_version(), 'machine': platform.machine(),
+                                    'speed': args.speed, 'cycle': args.cycle,
+                                    'time': time.strftime('%Y-%m-%dT%H:%M:%S')},
+                       'results': results}, output, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as baseline:
+            previous = dict(((result['mode'], result['renderer']), result) for result in json.load(baseline)['results'])
+
+        for result in results:
+            old = previous.get((result['mode'], result['renderer']))
+
+            if old is None:
+                continue
+
+            # Fewer frames per second or a longer tail, with a small absolute slack against timer noise
+            if result['fps'] < old['fps'] * (1 - args.threshold):
+                failures.append('%s %s: fps %.1f -> %.1f' % (result['mode'], result['renderer'], old['fps'],
+                                                             result['fps']))
+
+            if result['render_p99_ms'] > old['render_p99_ms'] * (1 + args.threshold) + 0.05:
+                failures.append('%s %s: p99 %.3fms -> %.3fms' % (result['mode'], result['renderer'],
+                                                                 old['render_p99_ms'], result['render_p99_ms']))
+
+        for failure in failures:
+            print 'REGRESSION %s' % failure
+
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,120 @@
+#!/usr/bin/python
+"""
+Checks the /proc collector backend against psutil and compares their sampling cost per tick.
+
+The check runs both backends over the captured /proc snapshots in fixtures/, the benchmark samples
+the live /proc of the machine it runs on.
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lib'))
+
+import psutil
+
+from procfs import ProcBackend
+from sampler import PsutilBackend
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+FIXTURE_FILES = ('stat', 'meminfo', os.path.join('net', 'dev'))
+
+
+def install_fixture(name, root):
+    for path in FIXTURE_FILES:
+        # Rewrite in place so the backend's open file handles see the new content
+        with open(os.path.join(FIXTURES, name, path), 'rb') as source:
+            with open(os.path.join(root, path), 'wb') as target:
+                target.write(source.read())
+
+
+def compare(label, expected, actual, failures):
+    if expected != actual:
+        failures.append('%s: psutil=%s proc=%s' % (label, expected, actual))
+
+
+def check_fixtures():
+    root = tempfile.mkdtemp(prefix='pi-monitor-proc-')
+    os.mkdir(os.path.join(root, 'net'))
+    failures = []
+
+    try:
+        install_fixture('proc-1', root)
+
+        psutil.PROCFS_PATH = root
+        psutil.cpu_percent(interval=None)
+        psutil.cpu_percent(interval=None, percpu=True)
+        backend = ProcBackend(root=root)
+
+        install_fixture('proc-2', root)
+
+        cpu_times, percent, percpu_percent, percpu_times = backend.cpu_times()
+        memory = backend.virtual_memory()
+        counters = backend.net_io_counters()
+
+        expected_times = psutil.cpu_times(percpu=False)
+        for field in cpu_times._fields:
+            compare('cpu_times.%s' % field, round(getattr(expected_times, field), 6), round(getattr(cpu_times, field), 6),
+                    failures)
+
+        for i, (expected, times) in enumerate(zip(psutil.cpu_times(percpu=True), percpu_times)):
+            for field in times._fields:
+                compare('cpu_times(percpu)[%s].%s' % (i, field), round(getattr(expected, field), 6),
+                        round(getattr(times, field), 6), failures)
+
+        compare('cpu_percent', psutil.cpu_percent(interval=None), percent, failures)
+        compare('cpu_percent(percpu)', psutil.cpu_percent(interval=None, percpu=True), percpu_percent, failures)
+
+        expected_memory = psutil.virtual_memory()
+        for field in memory._fields:
+            compare('virtual_memory.%s' % field, getattr(expected_memory, field), getattr(memory, field), failures)
+
+        expected_counters = psutil.net_io_counters(pernic=True)
+        compare('net_io_counters', sorted(expected_counters.keys()), sorted(counters.keys()), failures)
+
+        for name, counter in counters.items():
+            for field in counter._fields:
+                compare('net_io_counters[%s].%s' % (name, field), getattr(expected_counters[name], field),
+                        getattr(counter, field), failures)
+
+        backend.close()
+    finally:
+        psutil.PROCFS_PATH = '/proc'
+        shutil.rmtree(root)
+
+    return failures
+
+
+def benchmark(ticks):
+    results = []
+
+    for name, backend in (('psutil', PsutilBackend()), ('proc', ProcBackend())):
+        seconds = min(timeit.repeat(backend.sample, number=ticks, repeat=3))
+        results.append((name, seconds / ticks * 1e6))
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--ticks', type=int, default=1000, help='samples taken per backend')
+    args = parser.parse_args()
+
+    failures = check_fixtures()
+
+    for failure in failures:
+        print 'MISMATCH %s' % failure
+
+    print 'Fixture check: %s' % ('failed' if failures else 'ok')
+
+    for name, micros in benchmark(args.ticks):
+        print '%-8s %8.1f us/tick' % (name, micros)
+
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
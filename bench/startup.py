@@ -0,0 +1,159 @@
+#!/usr/bin/python
+"""
+Measures how long the monitor takes from process start to its first frame, and its memory use then.
+
+Every run is a fresh interpreter going through the monitor's startup with the default screens: the
+imports, the display (luma's dummy device standing in for the OLED), the screens and the sampler
+with the proc backend, the first samples and the first frame. Times are measured from the start of
+the process as the kernel recorded it, so they include the interpreter's own startup. The GPIO setup
+is the only part left out. Results can be written as JSON and compared with an earlier run.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+
+PHASES = ('imports', 'display', 'screens', 'samples', 'frame')
+BUDGET = 2.0
+
+
+def age():
+    """
+    Seconds since this process started.
+    """
+    with open('/proc/self/stat') as stat:
+        start = int(stat.read().rsplit(')', 1)[1].split()[19])
+
+    with open('/proc/uptime') as uptime:
+        return float(uptime.read().split()[0]) - start / float(os.sysconf('SC_CLK_TCK'))
+
+
+def rss():
+    with open('/proc/self/status') as status:
+        for line in status:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) * 1024
+
+    return 0
+
+
+def child(interface):
+    """
+    One startup, in the order the monitor goes through it, reports the time each phase ended at.
+    """
+    phases = {}
+
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lib'))
+
+    from luma.core.device import dummy
+    from luma.oled.device import sh1106
+
+    from display import DiffingDisplay
+    from metrics import PerformanceCounters
+    from procfs import ProcBackend
+    from sampler import Sampler
+    from screens import CpuScreen
+    from screens import DiagnosticsScreen
+    from screens import MemoryScreen
+    from screens import NetworkScreen
+    from screens import ProcessScreen
+
+    phases['imports'] = age()
+
+    device = DiffingDisplay(dummy(width=128, height=64, mode='1'), driver=sh1106.__name__.lower())
+    phases['display'] = age()
+
+    counters = PerformanceCounters()
+    sampler = Sampler(backend=ProcBackend(interfaces=[interface]), counters=counters)
+    screens = [CpuScreen(scrolling=True), NetworkScreen(interface, scrolling=True), MemoryScreen(scrolling=True),
+               ProcessScreen(), DiagnosticsScreen(counters, scrolling=True)]
+
+    for screen in screens:
+        sampler.register(screen, interval=2 if isinstance(screen, ProcessScreen) else 1)
+
+    screens[0].show()
+
+    phases['screens'] = age()
+
+    sampler.start()
+    sampler.ready.wait()
+    phases['samples'] = age()
+
+    screens[0].render(device)
+    phases['frame'] = age()
+
+    print json.dumps({'phases': phases, 'rss': rss(), 'modules': len(sys.modules)})
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+def benchmark(runs, interface):
+    results = []
+
+    for i in range(runs):
+        output = subprocess.check_output([sys.executable, os.path.abspath(__file__), '--child', '--interface',
+                                          interface])
+        results.append(json.loads(output.strip().split('\n')[-1]))
+
+    summary = dict(('%s_s' % phase, median([result['phases'][phase] for result in results])) for phase in PHASES)
+    summary['rss_bytes'] = median([result['rss'] for result in results])
+    summary['modules'] = median([result['modules'] for result in results])
+
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--runs', type=int, default=5, help='startups measured, the medians are reported')
+    parser.add_argument('--interface', default='lo', help='network interface of the network screen')
+    parser.add_argument('--budget', type=float, default=BUDGET, help='seconds allowed until the first frame')
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    parser.add_argument('--compare', metavar='BASELINE', help='JSON results of an earlier run to compare with')
+    parser.add_argument('--threshold', type=float, default=0.2, help='relative growth reported as a regression')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.interface)
+        return 0
+
+    summary = benchmark(args.runs, args.interface)
+
+    print 'Median of %s startups, seconds since the process started:' % args.runs
+    for phase in PHASES:
+        print '  %-8s %6.3f' % (phase, summary['%s_s' % phase])
+    print 'RSS at the first frame %.1f MiB, %s modules loaded' % (summary['rss_bytes'] / 1048576.0, summary['modules'])
+
+    failures = []
+
+    if summary['frame_s'] > args.budget:
+        failures.append('first frame after %.3fs, the budget is %.3fs' % (summary['frame_s'], args.budget))
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump({'metadata': {'python': platform.python_version(), 'machine': platform.machine(),
+                                    'runs': args.runs},
+                       'summary': summary}, output, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as baseline:
+            previous = json.load(baseline)['summary']
+
+        for field in ('frame_s', 'rss_bytes'):
+            # A small absolute slack keeps timer noise from flagging
+            if summary[field] > previous[field] * (1 + args.threshold) + 0.05:
+                failures.append('%s: %s -> %s' % (field, previous[field], summary[field]))
+
+    for failure in failures:
+        print 'REGRESSION %s' % failure
+
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,96 @@
+#!/usr/bin/python
+"""
+Kills a history writer mid-flush over and over and checks the ring file always reloads a whole save.
+
+Every save of the writer fills all buffers with the save's sequence number, so a reload that mixes
+values from two saves, or from a save that was cut short, shows up as more than one distinct value.
+"""
+import argparse
+import os
+import random
+import shutil
+import signal
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lib'))
+
+from history import History
+from store import RingFile
+
+
+def writer(path):
+    history = History(62)
+    ring = RingFile(path, history)
+    ring.load()
+
+    while True:
+        value = float(ring.sequence + 1)
+
+        for buffer in ring.buffers:
+            buffer.load([value] * buffer.capacity, 0, buffer.capacity)
+
+        ring.save(time.time())
+
+
+def check(path):
+    history = History(62)
+    ring = RingFile(path, history)
+    saved_at = ring.load()
+
+    values = set()
+    for buffer in ring.buffers:
+        values.update(buffer)
+
+    ring.close()
+
+    if saved_at is None:
+        return None, values
+
+    return ring.sequence, values
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--rounds', type=int, default=200, help='number of times the writer is killed')
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp(prefix='pi-monitor-store-')
+    path = os.path.join(root, 'crash.ring')
+    failures = 0
+    last = 0
+
+    try:
+        for i in range(args.rounds):
+            pid = os.fork()
+
+            if pid == 0:
+                try:
+                    writer(path)
+                finally:
+                    os._exit(0)
+
+            time.sleep(random.uniform(0.001, 0.02))
+            os.kill(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+
+            sequence, values = check(path)
+
+            if sequence is None:
+                continue
+
+            if len(values) != 1 or values != set([float(sequence)]) or sequence < last:
+                failures += 1
+                print 'Round %s: sequence %s reloaded values %s' % (i, sequence, sorted(values)[:4])
+
+            last = sequence
+    finally:
+        shutil.rmtree(root)
+
+    print '%s rounds, %s inconsistent reloads, last sequence %s' % (args.rounds, failures, last)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
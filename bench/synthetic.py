@@ -0,0 +1,91 @@
+"""
+Synthetic but realistic samples for driving the screens without real counters.
+
+CPU load alternates between idle stretches and bursts, network traffic is bursty with an occasional
+error or drop, and memory use drifts slowly with the page cache. The sequence is deterministic for
+a given seed.
+"""
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lib'))
+
+from procfs import scputimes
+from procfs import snetio
+from procfs import svmem
+from sampler import Sample
+
+TOTAL_MEMORY = 948 * 1024 * 1024
+
+
+class SyntheticSource:
+    def __init__(self, seed=1, cores=4, interfaces=('wlan0', 'lo', 'eth0'), interval=1.0):
+        self.random = random.Random(seed)
+        self.cores = cores
+        self.interfaces = interfaces
+        self.interval = interval
+        self.timestamp = 0.0
+        self.cpu_times = [0.0] * 10
+        self.percpu_times = [[0.0] * 10 for _ in range(cores)]
+        self.counters = dict((name, [0] * 8) for name in interfaces)
+        self.load = 0.1
+        self.used = TOTAL_MEMORY * 0.3
+        self.cached = TOTAL_MEMORY * 0.2
+
+    def next_load(self):
+        if self.random.random() < 0.05:
+            # Start or stop a burst
+            self.load = self.random.uniform(0.6, 1.0) if self.load < 0.5 else self.random.uniform(0.02, 0.15)
+
+        return min(max(self.load + self.random.gauss(0, 0.05), 0.0), 1.0)
+
+    def sample(self):
+        r = self.random
+        elapsed = self.interval * r.uniform(0.98, 1.05)
+        self.timestamp += elapsed
+
+        load = self.next_load()
+        percpu = [round(min(max(load + r.gauss(0, 0.1), 0.0), 1.0) * 100, 1) for _ in range(self.cores)]
+
+        # user, nice, system, idle, iowait, irq, softirq, steal, guest, guest_nice
+        shares = (0.7, 0.01, 0.2, 0, 0.05, 0.0, 0.04, 0.0, 0.0, 0.0)
+        for times, percent in zip(self.percpu_times, percpu):
+            busy = elapsed * percent / 100
+
+            for i, share in enumerate(shares):
+                times[i] += busy * share
+                self.cpu_times[i] += busy * share
+
+            times[3] += elapsed - busy
+            self.cpu_times[3] += elapsed - busy
+
+        counters = {}
+        for name in self.interfaces:
+            values = self.counters[name]
+            received = 0 if name == 'lo' and r.random() < 0.5 else int(r.expovariate(1.0 / 40000) * load * 4)
+            sent = int(received * r.uniform(0.1, 0.4))
+
+            # bytes_sent, bytes_recv, packets_sent, packets_recv, errin, errout, dropin, dropout
+            values[0] += sent
+            values[1] += received
+            values[2] += sent // 600
+            values[3] += received // 900
+            values[4] += 1 if r.random() < 0.01 else 0
+            values[5] += 1 if r.random() < 0.005 else 0
+            values[6] += 1 if r.random() < 0.02 else 0
+            values[7] += 1 if r.random() < 0.002 else 0
+            counters[name] = snetio(*values)
+
+        self.used = min(max(self.used + r.gauss(0, TOTAL_MEMORY * 0.002), TOTAL_MEMORY * 0.1), TOTAL_MEMORY * 0.8)
+        self.cached = min(max(self.cached + r.gauss(0, TOTAL_MEMORY * 0.001), 0), TOTAL_MEMORY - self.used)
+        used = int(self.used)
+        cached = int(self.cached)
+        free = TOTAL_MEMORY - used - cached
+        available = free + cached
+
+        memory = svmem(TOTAL_MEMORY, available, round((TOTAL_MEMORY - available) * 100.0 / TOTAL_MEMORY, 1), used,
+                       free, int(used * 0.6), int(cached * 0.5), cached // 5, cached, used // 40)
+
+        return Sample(self.timestamp, scputimes(*self.cpu_times), round(sum(percpu) / self.cores, 1), percpu, memory,
+                      counters, [scputimes(*times) for times in self.percpu_times])
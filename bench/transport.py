@@ -0,0 +1,218 @@
+#!/usr/bin/python
+"""
+Sends rendered frames through every bus transport onto a recording fake bus and reports the transfers they take.
+
+Every sub-screen of the CPU, network and memory screens is rendered after each synthetic sample, in
+scrolling mode with the FrameBuffer renderer, and sent over luma's own I2C interface, the I2C
+transport with SMBus blocks and with batched I2C_RDWR messages, and the SPI transport, at a few
+block sizes and clocks. The fake bus keeps every transfer, the transfers are played into a model of
+the controller's RAM, which has to end up holding exactly the frames sent. For every configuration
+it reports the bytes and transfers per frame and the time they would take on the wire, with
+--overhead seconds per transfer for the kernel and the bus start and stop.
+"""
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lib'))
+
+from luma.core.device import dummy
+from luma.core.serial import i2c
+
+from display import DiffingDisplay
+from screens import CpuScreen
+from screens import MemoryScreen
+from screens import NetworkScreen
+from synthetic import SyntheticSource
+from transport import I2C_COMMAND
+from transport import I2cTransport
+from transport import RecordingBus
+from transport import SpiTransport
+
+# (name, bus, clock, block size), luma is luma's I2C interface sending each page write as it comes
+CONFIGURATIONS = (
+    ('luma', 'i2c', 100000, 32),
+    ('luma', 'i2c', 400000, 32),
+    ('smbus', 'i2c', 400000, 32),
+    ('i2c_rdwr', 'i2c', 100000, 4096),
+    ('i2c_rdwr', 'i2c', 400000, 4096),
+    ('i2c_rdwr', 'i2c', 1000000, 4096),
+    ('i2c_rdwr', 'i2c', 400000, 64),
+    ('spi', 'spi', 8000000, 4096),
+    ('spi', 'spi', 8000000, 64),
+    ('spi', 'spi', 32000000, 4096)
+)
+
+
+class Panel:
+    """
+    The RAM of an SSD1306 or SH1106, written by the commands and data played into it.
+    """
+
+    def __init__(self, driver, width=128, pages=8):
+        self.driver = driver
+        self.width = width
+        self.pages = pages
+        self.columns = 132 if driver == 'sh1106' else width
+        self.ram = bytearray(self.columns * pages)
+        self.column = 0
+        self.page = 0
+        self.column_range = (0, self.columns - 1)
+        self.page_range = (0, pages - 1)
+
+    def commands(self, data):
+        i = 0
+
+        while i < len(data):
+            command = data[i]
+
+            if self.driver == 'sh1106':
+                if command & 0xF0 == 0xB0:
+                    self.page = command & 0x0F
+                elif command & 0xF0 == 0x00:
+                    self.column = (self.column & 0xF0) | command
+                elif command & 0xF0 == 0x10:
+                    self.column = (self.column & 0x0F) | (command & 0x0F) << 4
+            elif command == 0x21:
+                self.column_range = (data[i + 1], data[i + 2])
+                self.column = data[i + 1]
+                i += 2
+            elif command == 0x22:
+                self.page_range = (data[i + 1], data[i + 2])
+                self.page = data[i + 1]
+                i += 2
+
+            i += 1
+
+    def data(self, data):
+        for byte in data:
+            self.ram[self.page * self.columns + self.column] = byte
+
+            if self.driver == 'sh1106':
+                # The SH1106 has no column range, it stays on its page
+                self.column = min(self.column + 1, self.columns - 1)
+            elif self.column < self.column_range[1]:
+                self.column += 1
+            else:
+                # Horizontal addressing moves on to the next page of the range
+                self.column = self.column_range[0]
+                self.page = self.page + 1 if self.page < self.page_range[1] else self.page_range[0]
+
+    def play(self, transfers):
+        for messages in transfers:
+            for command, data in messages:
+                if command is None:
+                    # On I2C the control byte starting the message tells
+                    command = data[0] == I2C_COMMAND
+                    data = data[1:]
+
+                if command:
+                    self.commands(data)
+                else:
+                    self.data(data)
+
+    def visible(self):
+        offset = 2 if self.driver == 'sh1106' else 0
+        frame = bytearray()
+
+        for page in range(self.pages):
+            frame += self.ram[page * self.columns + offset:page * self.columns + offset + self.width]
+
+        return frame
+
+
+def create_transport(name, clock, block_size, overhead):
+    bus = RecordingBus(clock=clock, overhead=overhead)
+
+    if name == 'luma':
+        return bus, i2c(bus=bus, address=0x3C)
+
+    if name == 'spi':
+        return bus, SpiTransport(clock=clock, block_size=block_size, gpio=bus, bus=bus)
+
+    return bus, I2cTransport(address=0x3C, clock=clock, block_size=block_size, bus=bus)
+
+
+def run(name, clock, block_size, driver, frames, warmup, seed, interface, overhead):
+    source = SyntheticSource(seed=seed, interfaces=(interface,))
+    screens = [CpuScreen(True), NetworkScreen(interface, True, ip='192.168.1.20'), MemoryScreen(True)]
+
+    for i in range(warmup):
+        sample = source.sample()
+
+        for screen in screens:
+            screen.collect(sample)
+
+    bus, serial = create_transport(name, clock, block_size, overhead)
+    display = DiffingDisplay(dummy(mode='1'), driver=driver, serial=serial, framebuffer=True)
+    panel = Panel(driver)
+    result = {'frames': 0, 'bytes': 0, 'transfers': 0, 'time': 0.0, 'mismatches': 0, 'full': None}
+
+    for screen in screens:
+        for index in range(len(screen.screen_config)):
+            screen.screen_index = index
+            display.invalidate()
+
+            for i in range(frames + 1):
+                sample = source.sample()
+
+                for s in screens:
+                    s.collect(sample)
+
+                bus.reset()
+                screen.render(display)
+                panel.play(bus.transfers)
+
+                if panel.visible() != display.frame:
+                    result['mismatches'] += 1
+
+                # The first frame of a sub-screen goes out whole, the rest only their changes
+                if i == 0:
+                    if result['full'] is None:
+                        result['full'] = (sum(len(data) for messages in bus.transfers for command, data in messages),
+                                          len(bus.transfers), bus.time)
+                    continue
+
+                result['frames'] += 1
+                result['bytes'] += sum(len(data) for messages in bus.transfers for command, data in messages)
+                result['transfers'] += len(bus.transfers)
+                result['time'] += bus.time
+
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--frames', type=int, default=50, help='frames sent per sub-screen')
+    parser.add_argument('--warmup', type=int, default=100, help='samples collected before sending')
+    parser.add_argument('--seed', type=int, default=1, help='seed of the synthetic samples')
+    parser.add_argument('--interface', default='wlan0', help='network interface name to simulate')
+    parser.add_argument('--driver', choices=('sh1106', 'ssd1306'), action='append', help='display controllers')
+    parser.add_argument('--overhead', type=float, default=0.0001, help='seconds per transfer besides its bytes')
+    args = parser.parse_args()
+
+    mismatched = 0
+
+    print '%-8s %-9s %9s %6s %10s %10s %10s %10s %10s' % ('driver', 'transport', 'clock', 'block', 'B/frame',
+                                                           'xfer/frame', 'ms/frame', 'full xfer', 'full ms')
+    for driver in args.driver or ('sh1106', 'ssd1306'):
+        for name, bus, clock, block_size in CONFIGURATIONS:
+            result = run(name, clock, block_size, driver, args.frames, args.warmup, args.seed, args.interface,
+                         args.overhead)
+            frames = float(result['frames'])
+            full_bytes, full_transfers, full_time = result['full']
+            mismatched += result['mismatches']
+
+            print '%-8s %-9s %9s %6s %10.1f %10.1f %10.3f %10s %10.3f' % (driver, name, clock, block_size,
+                                                                          result['bytes'] / frames,
+                                                                          result['transfers'] / frames,
+                                                                          result['time'] / frames * 1000,
+                                                                          full_transfers, full_time * 1000)
+
+    print 'Panel RAM: %s' % ('%s frames differ' % mismatched if mismatched else 'every frame arrived intact')
+
+    return 1 if mismatched else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,157 @@
+from monotonic import monotonic
+
+from history import named_histories
+
+
+class AlertRule:
+    """
+    A threshold on one history: the rule fires once the value has been above (or below) threshold
+    for duration seconds, and clears once it is back below (or above) clear. A clear level short of
+    the threshold keeps a value hovering around it from firing the rule over and over.
+
+    With a window the value is the average over the last window seconds, otherwise it is the newest
+    sample. Samples leaving the window are never subtracted from its sum, the rounding errors would
+    pile up (a window of zeros averaging -1e-17). The older part of the window keeps with each
+    sample the sum from it to the newest sample of that part, the newer part keeps a running sum,
+    and when the older part runs out the newer part is summed into it afresh. Each sample is added
+    twice at most, so a sample costs the same no matter how long the window or the rule has been
+    running.
+    """
+
+    def __init__(self, name, screen, index, history, threshold, above=True, duration=0, clear=None, window=0):
+        self.name = name
+        self.screen = screen
+        self.index = index
+        self.history = history
+        self.threshold = threshold
+        self.above = above
+        self.duration = duration
+        self.clear = clear if clear is not None else threshold
+        self.window = window
+        self.older = []
+        self.newer = []
+        self.newer_total = 0.0
+        self.appended = history.raw.appended
+        self.since = None
+        self.active = False
+        self.value = None
+
+    def average(self, value, timestamp):
+        self.newer.append((timestamp, value))
+        self.newer_total += value
+
+        while True:
+            if not self.older:
+                # Sums of the older samples are taken afresh, newest to oldest, each sample once
+                total = 0.0
+
+                for sample in reversed(self.newer):
+                    total += sample[1]
+                    self.older.append((sample[0], total))
+
+                self.newer = []
+                self.newer_total = 0.0
+
+            if self.older[-1][0] > timestamp - self.window:
+                break
+
+            self.older.pop()
+
+        return (self.older[-1][1] + self.newer_total) / (len(self.older) + len(self.newer))
+
+    def update(self, timestamp):
+        """
+        Takes the history's newest sample, returns True when the rule fired, False when it cleared and
+        None when nothing changed.
+        """
+        raw = self.history.raw
+
+        # Screens collect their first sample without appending anything, rates need two
+        if raw.appended == self.appended:
+            return None
+
+        self.appended = raw.appended
+        value = raw.newest()
+
+        if self.window > 0:
+            value = self.average(value, timestamp)
+
+        self.value = value
+
+        if self.active:
+            if value < self.clear if self.above else value > self.clear:
+                self.active = False
+                self.since = None
+                return False
+
+            return None
+
+        if not (value > self.threshold if self.above else value < self.threshold):
+            self.since = None
+            return None
+
+        if self.since is None:
+            self.since = timestamp
+
+        if timestamp - self.since >= self.duration:
+            self.active = True
+            return True
+
+        return None
+
+    def describe(self):
+        return '%s %s %s %g' % (self.name, '%g' % self.value if self.value is not None else '-',
+                                '>' if self.above else '<', self.threshold)
+
+
+def find_history(screens, metric):
+    """
+    The screen, sub-screen index and history a metric names, as screen.measure with the series after
+    it where a measure has several (network-wlan0.errors.in). None when no screen has it.
+    """
+    for screen in screens:
+        if not metric.startswith(screen.name + '.'):
+            continue
+
+        for name, history in named_histories(screen.name, getattr(screen, 'measures', {})):
+            if metric not in (name, name[:-len('.values')] if name.endswith('.values') else None):
+                continue
+
+            # Interface names may have dots of their own (network-eth0.100), the measure follows the screen's name
+            measure = name[len(screen.name) + 1:].split('.')[0]
+            indexes = [i for i, config in enumerate(screen.screen_config) if config.measure == measure]
+
+            if indexes:
+                return screen, indexes[0], history
+
+    return None
+
+
+class AlertEngine:
+    """
+    Evaluates every rule on the screen it watches each time that screen collects a sample, so a
+    sample costs a few comparisons per rule on the screen that collected it and nothing for the
+    others. Rules that fire or clear are handed to the listener with their new state.
+    """
+
+    def __init__(self, rules, listener, clock=monotonic):
+        self.rules = {}
+        self.listener = listener
+        self.clock = clock
+
+        for rule in rules:
+            self.rules.setdefault(rule.screen, []).append(rule)
+
+    def handle_sample(self, screen):
+        rules = self.rules.get(screen)
+
+        if not rules:
+            return
+
+        now = self.clock()
+
+        for rule in rules:
+            fired = rule.update(now)
+
+            if fired is not None:
+                self.listener(rule, fired)
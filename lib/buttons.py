@@ -0,0 +1,146 @@
+import collections
+import os
+import select
+import threading
+
+from monotonic import monotonic
+
+from utils import wake_up
+from utils import wakeup_pipe
+
+CLICK = 'click'
+LONG_PRESS = 'long'
+
+
+class Button:
+    def __init__(self, pin, long_press):
+        self.pin = pin
+        self.long_press = long_press
+        self.pressed = False
+        self.changed = None
+        self.settled = True
+        self.deadline = None
+
+
+class ButtonInput:
+    """
+    Turns GPIO edges into click and long press events, handled in order by a single consumer thread.
+
+    edge() only queues the edge, so the GPIO callback thread never waits on the monitor. Each pin is
+    debounced on its own: edges within debounce_time of the last accepted one are bounce and ignored,
+    and once that window closes the pin is read again so a release lost in the bounce is still seen.
+    What that read finds is not an edge of its own and opens no new window, the next press is taken
+    debounce_time after the last real edge.
+    Buttons in long_pins report a click when released, or a long press as soon as they have been held
+    for long_press_time. Other buttons report a click as soon as they go down.
+
+    Timeouts are handled by the consumer's wait, there is no timer thread per press. The buttons are
+    active low, read(pin) returns the level of a pin.
+    """
+
+    def __init__(self, pins, read, debounce_time, long_press_time, long_pins=(), clock=monotonic):
+        self.read = read
+        self.debounce_time = debounce_time
+        self.long_press_time = long_press_time
+        self.clock = clock
+        self.buttons = dict((pin, Button(pin, pin in long_pins)) for pin in pins)
+        self.edges = collections.deque()
+        self.thread = None
+
+        # select() on a pipe sleeps until an edge arrives or the next timeout, see Sampler
+        self.wakeup_read, self.wakeup_write = wakeup_pipe()
+
+    def edge(self, pin, level, timestamp=None):
+        """
+        Queues an edge seen on a pin, called from the GPIO callback thread.
+        """
+        self.edges.append((pin, level, timestamp if timestamp is not None else self.clock()))
+        wake_up(self.wakeup_write)
+
+    def accept(self, button, pressed, now, events):
+        button.pressed = pressed
+
+        if not button.long_press:
+            if pressed:
+                events.append((CLICK, button.pin))
+        elif pressed:
+            button.deadline = now + self.long_press_time
+        elif button.deadline is not None:
+            # Released before it became a long press
+            button.deadline = None
+            events.append((CLICK, button.pin))
+
+    def expire(self, button, now, events):
+        if button.deadline is not None and now >= button.deadline:
+            button.deadline = None
+            events.append((LONG_PRESS, button.pin))
+
+    def process(self, now):
+        """
+        Handles the queued edges and every timeout up to now, returns the resulting events in order.
+        """
+        events = []
+
+        while self.edges:
+            pin, level, timestamp = self.edges.popleft()
+            button = self.buttons.get(pin)
+
+            if button is None:
+                continue
+
+            self.expire(button, timestamp, events)
+
+            if button.changed is not None and timestamp - button.changed < self.debounce_time:
+                continue
+
+            if button.pressed != (not level):
+                button.changed = timestamp
+                button.settled = False
+                self.accept(button, not level, timestamp, events)
+
+        for button in self.buttons.values():
+            if not button.settled and now >= button.changed + self.debounce_time:
+                button.settled = True
+                pressed = not self.read(button.pin)
+
+                # The pin settled on the other level, an edge was lost in the bounce
+                if button.pressed != pressed:
+                    self.accept(button, pressed, button.changed + self.debounce_time, events)
+
+            self.expire(button, now, events)
+
+        return events
+
+    def next_timeout(self):
+        timeouts = []
+
+        for button in self.buttons.values():
+            if not button.settled:
+                timeouts.append(button.changed + self.debounce_time)
+
+            if button.deadline is not None:
+                timeouts.append(button.deadline)
+
+        return min(timeouts) if timeouts else None
+
+    def run(self, handler):
+        while True:
+            timeout = self.next_timeout()
+
+            if timeout is not None:
+                timeout = max(0, timeout - self.clock())
+
+            readable, writable, exceptional = select.select([self.wakeup_read], [], [], timeout)
+
+            if readable:
+                os.read(self.wakeup_read, 4096)
+
+            events = self.process(self.clock())
+
+            if events:
+                handler(events)
+
+    def start(self, handler):
+        self.thread = threading.Thread(target=self.run, args=(handler,))
+        self.thread.daemon = True
+        self.thread.start()
@@ -0,0 +1,160 @@
+from monotonic import monotonic
+from PIL import Image
+
+from framebuffer import FrameBuffer
+from framebuffer import REVERSE_BITS
+from transport import Transport
+
+
+class DiffingDisplay:
+    """
+    Wraps an SSD1306/SH1106 device and only sends the parts of a frame that changed.
+
+    The last frame sent is kept in the controller's native layout (one byte per column per 8-row
+    page). Each new frame is compared with it page by page and, for every page that changed, only
+    the span of columns between the first and last changed byte is written over the bus.
+
+    The wrapper behaves like a luma device, so it can be handed to luma.core.render.canvas. With
+    framebuffer set screens draw into a FrameBuffer, which already is in the controller's layout and
+    is sent without converting it. The device's preprocessing, its rotation, is not applied to those.
+
+    The writes of a frame go to the serial interface together, so a Transport can batch them.
+    """
+
+    def __init__(self, device, driver='ssd1306', serial=None, framebuffer=False):
+        self.device = device
+        self.driver = driver
+        self.serial = serial if serial is not None else device
+        self.mode = device.mode
+        self.size = device.size
+        self.width = device.width
+        self.height = device.height
+        self.pages = device.height // 8
+        self.framebuffer = framebuffer
+        self.frame = None
+        self.write_time = 0.0
+        self.write_bytes = 0
+        self.write_transactions = 0
+
+    def to_pages(self, image):
+        image = self.device.preprocess(image)
+
+        if image.mode != '1':
+            image = image.convert('1')
+
+        # Transposing makes each column a row of packed bytes, one byte per page, top row in the MSB
+        columns = bytearray(image.transpose(Image.TRANSPOSE).tobytes()).translate(REVERSE_BITS)
+
+        frame = bytearray(len(columns))
+        for page in range(self.pages):
+            frame[page * self.width:(page + 1) * self.width] = columns[page::self.pages]
+
+        return frame
+
+    def display(self, image):
+        if isinstance(image, FrameBuffer):
+            frame = image.buffer
+        else:
+            frame = self.to_pages(image)
+
+        previous = self.frame
+        writes = []
+
+        for page in range(self.pages):
+            offset = page * self.width
+            first = 0
+            last = self.width - 1
+
+            if previous is not None:
+                if frame[offset:offset + self.width] == previous[offset:offset + self.width]:
+                    continue
+
+                while frame[offset + first] == previous[offset + first]:
+                    first += 1
+
+                while frame[offset + last] == previous[offset + last]:
+                    last -= 1
+
+            writes.append((self.address(page, first, last), frame[offset + first:offset + last + 1]))
+
+        start = monotonic()
+        self.write_bytes, self.write_transactions = self.send(writes)
+
+        self.frame = frame
+        # What this frame cost on the bus, read by the monitor's performance counters
+        self.write_time = monotonic() - start
+
+    def address(self, page, first, last):
+        """
+        The commands pointing the controller's RAM at the columns first to last of a page.
+        """
+        if self.driver == 'sh1106':
+            # The SH1106 has 132 columns of RAM, the visible 128 start at column 2
+            column = first + 2
+            return 0xB0 + page, column & 0x0F, 0x10 | (column >> 4)
+
+        column = getattr(self.device, '_colstart', 0)
+        return 0x21, column + first, column + last, 0x22, page, page
+
+    def send(self, writes):
+        """
+        Sends the page writes of a frame, returns the bytes and transactions they took. A transport
+        packs them into as few transfers as its bus allows, any other serial interface gets each
+        write's commands and data in turn.
+        """
+        if isinstance(self.serial, Transport):
+            sent, transactions = self.serial.bytes, self.serial.transactions
+            self.serial.write(writes)
+
+            return self.serial.bytes - sent, self.serial.transactions - transactions
+
+        for commands, data in writes:
+            self.serial.command(*commands)
+            self.serial.data(list(data))
+
+        return sum(len(commands) + len(data) for commands, data in writes), 2 * len(writes)
+
+    def invalidate(self):
+        self.frame = None
+
+    def clear(self):
+        self.display(Image.new(self.mode, self.size))
+
+    def show(self):
+        self.device.show()
+
+    def hide(self):
+        self.device.hide()
+
+    def cleanup(self):
+        self.device.cleanup()
+        self.frame = None
+
+
+class CountingSerial:
+    """
+    Serial interface stand-in that records what would have been sent over the bus.
+    """
+
+    def __init__(self):
+        self.commands = 0
+        self.command_bytes = 0
+        self.transactions = 0
+        self.data_bytes = 0
+
+    def command(self, *cmd):
+        self.commands += 1
+        self.command_bytes += len(cmd)
+
+    def data(self, data):
+        self.transactions += 1
+        self.data_bytes += len(data)
+
+    def cleanup(self):
+        pass
+
+    def reset(self):
+        self.commands = 0
+        self.command_bytes = 0
+        self.transactions = 0
+        self.data_bytes = 0
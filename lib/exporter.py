@@ -0,0 +1,183 @@
+import threading
+
+from BaseHTTPServer import BaseHTTPRequestHandler
+from BaseHTTPServer import HTTPServer
+from SocketServer import ThreadingMixIn
+
+PREFIX = 'pi_monitor_'
+
+# Type and help text of every metric the screens export
+METRICS = {
+    'cpu_percent': ('gauge', 'CPU utilization in percent.'),
+    'cpu_seconds_total': ('counter', 'Seconds the CPUs spent in each mode.'),
+    'cpu_core_percent': ('gauge', 'Utilization of each CPU core in percent.'),
+    'memory_percent': ('gauge', 'Memory in use in percent.'),
+    'memory_bytes': ('gauge', 'Memory by field in bytes.'),
+    'network_bytes_total': ('counter', 'Bytes received and transmitted per interface.'),
+    'network_packets_total': ('counter', 'Packets received and transmitted per interface.'),
+    'network_errors_total': ('counter', 'Errors while receiving and transmitting per interface.'),
+    'network_dropped_total': ('counter', 'Packets dropped while receiving and transmitting per interface.')
+}
+
+PROMETHEUS = 'text/plain; version=0.0.4; charset=utf-8'
+OPENMETRICS = 'application/openmetrics-text; version=1.0.0; charset=utf-8'
+
+
+def format_value(value):
+    if not isinstance(value, float):
+        # str() and not repr(), a long would get an L suffix
+        return str(value)
+
+    if value == int(value) and abs(value) < 1e15:
+        return str(int(value))
+
+    return repr(value)
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+
+    return '{%s}' % ','.join('%s="%s"' % (name, value.replace('\\', '\\\\').replace('"', '\\"'))
+                             for name, value in labels)
+
+
+def serialize(metrics, openmetrics=False):
+    """
+    Formats (metric, labels, value) tuples in the Prometheus text format, or OpenMetrics if asked.
+    """
+    families = {}
+    order = []
+
+    for name, labels, value in metrics:
+        if name not in families:
+            families[name] = []
+            order.append(name)
+
+        families[name].append((labels, value))
+
+    lines = []
+    for name in order:
+        kind, description = METRICS[name]
+        family = PREFIX + name
+
+        # OpenMetrics names a counter family without its _total suffix
+        if openmetrics and kind == 'counter' and family.endswith('_total'):
+            family = family[:-len('_total')]
+
+        lines.append('# HELP %s %s' % (family, description))
+        lines.append('# TYPE %s %s' % (family, kind))
+
+        for labels, value in families[name]:
+            lines.append('%s%s %s' % (PREFIX + name, format_labels(labels), format_value(value)))
+
+    if openmetrics:
+        lines.append('# EOF')
+
+    return '\n'.join(lines) + '\n'
+
+
+class MetricsCache:
+    """
+    The serialized metrics of a list of screens, rebuilt at most once per sampling tick.
+
+    The body is built from the screens' buffers on the first scrape after any screen has collected
+    a new sample, every other scrape is served the cached bytes. The versions of the screens'
+    sequence counters tell whether the cached body is still current.
+    """
+
+    def __init__(self, screens):
+        self.screens = screens
+        self.lock = threading.Lock()
+        self.versions = None
+        self.bodies = {}
+        self.builds = 0
+
+    def collect(self):
+        metrics = []
+        versions = []
+
+        for screen in self.screens:
+            while True:
+                version = screen.sequence.begin_read()
+                exported = screen.export()
+
+                if screen.sequence.validate(version):
+                    break
+
+            metrics.extend(exported)
+            versions.append(version)
+
+        return metrics, tuple(versions)
+
+    def body(self, openmetrics=False):
+        versions = tuple(screen.sequence.begin_read() for screen in self.screens)
+
+        self.lock.acquire()
+
+        try:
+            if versions != self.versions:
+                self.bodies = {}
+
+            body = self.bodies.get(openmetrics)
+
+            if body is None:
+                metrics, versions = self.collect()
+
+                # A sample landed since the check above, bodies of the other format are now stale
+                if versions != self.versions:
+                    self.bodies = {}
+
+                self.versions = versions
+                body = self.bodies[openmetrics] = serialize(metrics, openmetrics)
+                self.builds += 1
+
+            return body
+        finally:
+            self.lock.release()
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    # Keep-alive lets a scraper reuse its connection, buffering sends headers and body in one write
+    protocol_version = 'HTTP/1.1'
+    wbufsize = -1
+
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/metrics', '/'):
+            self.send_error(404)
+            return
+
+        openmetrics = 'application/openmetrics-text' in self.headers.get('Accept', '')
+        body = self.server.cache.body(openmetrics)
+
+        self.send_response(200)
+        self.send_header('Content-Type', OPENMETRICS if openmetrics else PROMETHEUS)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MetricsServer(ThreadingMixIn, HTTPServer):
+    """
+    A small HTTP server exposing the screens' latest values in the Prometheus text format.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, screens, address='127.0.0.1', port=9101):
+        HTTPServer.__init__(self, (address, port), MetricsHandler)
+        self.cache = MetricsCache(screens)
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever, args=())
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,333 @@
+import bisect
+import collections
+import errno
+import os
+import random
+import select
+import socket
+import struct
+import threading
+
+from monotonic import monotonic
+
+from ringbuffer import RingBuffer
+from utils import wake_up
+from utils import wakeup_pipe
+
+MAGIC = b'PM'
+VERSION = 1
+
+# magic, version, core count, session, sequence, name length, then the name itself
+HEADER = struct.Struct('!2sBBHIB')
+# CPU and memory in hundredths of a percent, received and transmitted bytes per second
+BODY = struct.Struct('!HHff')
+# Then one byte per core, in whole percent
+
+MAX_NAME = 64
+MAX_CORES = 64
+MAX_DATAGRAM = HEADER.size + MAX_NAME + BODY.size + MAX_CORES
+
+Report = collections.namedtuple('Report', ['cpu', 'memory', 'receive', 'transmit', 'cores'])
+
+
+def percent(value, scale):
+    return int(round(min(max(value, 0.0), 100.0) * scale))
+
+
+def encode(name, session, sequence, report):
+    """
+    Packs a report into a datagram, about 35 bytes for a four core node with a short name.
+    """
+    name = name[:MAX_NAME]
+    cores = report.cores[:MAX_CORES]
+
+    return b''.join((HEADER.pack(MAGIC, VERSION, len(cores), session, sequence & 0xffffffff, len(name)),
+                     name,
+                     BODY.pack(percent(report.cpu, 100), percent(report.memory, 100), report.receive, report.transmit),
+                     struct.pack('!%sB' % len(cores), *[percent(core, 1) for core in cores])))
+
+
+def decode(data):
+    """
+    Unpacks a datagram into (name, session, sequence, report), raises ValueError when it is not one.
+    """
+    if len(data) < HEADER.size:
+        raise ValueError('datagram too short')
+
+    magic, version, count, session, sequence, length = HEADER.unpack_from(data)
+
+    if magic != MAGIC or version != VERSION:
+        raise ValueError('not a pi-monitor datagram')
+
+    if len(data) != HEADER.size + length + BODY.size + count:
+        raise ValueError('datagram length does not match its header')
+
+    offset = HEADER.size + length
+    cpu, memory, receive, transmit = BODY.unpack_from(data, offset)
+    cores = struct.unpack_from('!%sB' % count, data, offset + BODY.size)
+
+    return data[HEADER.size:offset], session, sequence, Report(cpu / 100.0, memory / 100.0, receive, transmit, cores)
+
+
+class FleetSender:
+    """
+    Sends this node's CPU, memory and network use to a fleet receiver, one datagram per CPU sample.
+    The CPU screen should be registered with the sampler last, so the datagram carries the memory
+    and network values of the same sample.
+
+    The datagrams carry a sequence number, so the receiver can tell how many were lost, and a random
+    session id that tells it the sender restarted and numbers from zero again. Sending never blocks
+    the sampler, a datagram the kernel cannot take right away is dropped and counted.
+    """
+
+    def __init__(self, address, port, name, cpu=None, memory=None, networks=()):
+        self.address = (address, port)
+        self.name = name
+        self.cpu = cpu
+        self.memory = memory
+        self.networks = networks
+        self.session = random.getrandbits(16)
+        self.sequence = 0
+        self.errors = 0
+
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.setblocking(False)
+
+    def report(self):
+        return Report(self.cpu.measures['percent'].raw.newest(),
+                      self.memory.measures['percent'].raw.newest() if self.memory is not None else 0.0,
+                      sum(network.measures['bytes']['in'].raw.newest() for network in self.networks),
+                      sum(network.measures['bytes']['out'].raw.newest() for network in self.networks),
+                      [core.raw.newest() for core in self.cpu.measures['cores']])
+
+    def handle_sample(self, screen):
+        # Rates need two samples, the first one has nothing to report yet
+        if screen is self.cpu and len(screen.measures['percent'].raw):
+            self.send(self.report())
+
+    def send(self, report):
+        try:
+            self.socket.sendto(encode(self.name, self.session, self.sequence, report), self.address)
+        except socket.error:
+            self.errors += 1
+
+        self.sequence = (self.sequence + 1) & 0xffffffff
+
+    def close(self):
+        self.socket.close()
+
+
+class FleetNode:
+    """
+    One node of the fleet, the receiver thread keeps its latest report and how many of its datagrams
+    arrived or were lost, update() turns the reports into the ring buffers the screen shows.
+    """
+
+    def __init__(self, name, capacity):
+        self.name = name
+        self.session = None
+        self.sequence = None
+        self.received = 0
+        self.lost = 0
+        self.late = 0
+        self.report = None
+        self.seen = None
+        self.up = False
+        self.measures = {
+            'cpu': RingBuffer(capacity),
+            'memory': RingBuffer(capacity)
+        }
+
+
+class FleetReceiver:
+    """
+    Takes in the datagrams of hundreds of senders on a single non-blocking UDP socket.
+
+    The receiver thread sleeps in select() and, once the socket is readable, drains every datagram
+    queued on it before it sleeps again, so a burst costs one wakeup. It only decodes datagrams and
+    keeps each node's latest report, the ring buffers are appended to by update(), called by the
+    fleet screen when it collects, so they have a single writer and an even time base no matter how
+    often the nodes send.
+
+    A node whose sequence jumps ahead lost the datagrams in between, one that goes back was
+    reordered or duplicated and is ignored. A node is down when it did not report for timeout seconds.
+
+    The names come from whoever sends to the port, so at most max_nodes are kept, datagrams from
+    further names are counted and dropped. A node that did not report for expire seconds is taken
+    off the screen by update() and handed back to the receiver thread, which forgets it unless it
+    reported again in the meantime, so its slot goes to the next new name.
+    """
+
+    def __init__(self, address='0.0.0.0', port=9102, capacity=31, timeout=10, buffer_size=None, max_nodes=256,
+                 expire=600, clock=monotonic):
+        self.capacity = capacity
+        self.timeout = timeout
+        self.max_nodes = max_nodes
+        self.expire = expire
+        self.clock = clock
+        self.known = {}
+        self.added = []
+        self.expired = []
+        self.nodes = []
+        self.names = []
+        self.datagrams = 0
+        self.malformed = 0
+        self.rejected = 0
+        self.lock = threading.Lock()
+        self.thread = None
+        self.running = False
+
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        if buffer_size:
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, buffer_size)
+        self.socket.bind((address, port))
+        self.socket.setblocking(False)
+
+        self.wakeup_read, self.wakeup_write = wakeup_pipe()
+
+    def handle(self, data, now):
+        try:
+            name, session, sequence, report = decode(data)
+        except (ValueError, struct.error):
+            self.malformed += 1
+            return
+
+        node = self.known.get(name)
+
+        if node is None:
+            if len(self.known) >= self.max_nodes:
+                self.rejected += 1
+                return
+
+            node = self.known[name] = FleetNode(name, self.capacity)
+
+            # The screen's thread picks new nodes up on its next update
+            self.lock.acquire()
+
+            try:
+                self.added.append(node)
+            finally:
+                self.lock.release()
+
+        self.datagrams += 1
+
+        if node.session != session:
+            # A new node, or one that restarted and numbers its datagrams from zero again
+            node.session = session
+        else:
+            gap = (sequence - node.sequence) & 0xffffffff
+
+            if gap == 0 or gap >= 0x80000000:
+                node.late += 1
+                return
+
+            node.lost += gap - 1
+
+        node.sequence = sequence
+        node.received += 1
+
+        # The report is what tells update() the node has been seen, it goes last
+        node.seen = now
+        node.report = report
+
+    def forget(self, now):
+        """
+        Drops the nodes update() expired, or puts those that reported since back on the screen.
+        """
+        self.lock.acquire()
+
+        try:
+            expired, self.expired = self.expired, []
+
+            for node in expired:
+                if now - node.seen > self.expire:
+                    del self.known[node.name]
+                else:
+                    self.added.append(node)
+        finally:
+            self.lock.release()
+
+    def receive(self):
+        """
+        Handles every datagram waiting on the socket.
+        """
+        now = self.clock()
+
+        if self.expired:
+            self.forget(now)
+
+        while True:
+            try:
+                data = self.socket.recv(MAX_DATAGRAM + 1)
+            except socket.error as e:
+                if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    return
+
+                raise
+
+            self.handle(data, now)
+
+    def update(self, now=None):
+        """
+        Appends every node's latest report to its ring buffers, called from the fleet screen's thread.
+        """
+        now = now if now is not None else self.clock()
+
+        self.lock.acquire()
+
+        try:
+            added, self.added = self.added, []
+        finally:
+            self.lock.release()
+
+        for node in added:
+            index = bisect.bisect(self.names, node.name)
+            self.names.insert(index, node.name)
+            self.nodes.insert(index, node)
+
+        if self.expire > 0:
+            expired = set(node for node in self.nodes if node.report is not None and now - node.seen > self.expire)
+
+            if expired:
+                self.nodes = [node for node in self.nodes if node not in expired]
+                self.names = [node.name for node in self.nodes]
+
+                self.lock.acquire()
+
+                try:
+                    self.expired.extend(expired)
+                finally:
+                    self.lock.release()
+
+        for node in self.nodes:
+            report = node.report
+            node.up = report is not None and now - node.seen <= self.timeout
+
+            if node.up:
+                node.measures['cpu'].append(report.cpu)
+                node.measures['memory'].append(report.memory)
+
+    def run(self):
+        while self.running:
+            readable, writable, exceptional = select.select([self.socket, self.wakeup_read], [], [])
+
+            if self.wakeup_read in readable:
+                os.read(self.wakeup_read, 64)
+
+            if self.socket in readable:
+                self.receive()
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.run, args=())
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        wake_up(self.wakeup_write)
+
+        if self.thread is not None:
+            self.thread.join()
+
+        self.socket.close()
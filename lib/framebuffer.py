@@ -0,0 +1,344 @@
+import binascii
+import threading
+
+from PIL import Image
+
+NONE = 0xFF
+
+# Reverses the bit order of a byte, PIL packs pixels MSB first while the controllers want the top row in the LSB
+REVERSE_BITS = bytearray([int('{0:08b}'.format(i)[::-1], 2) for i in range(256)])
+
+# Translate tables setting or clearing the rows of a page in a mask, built as masks are first used
+SET_TABLES = {}
+CLEAR_TABLES = {}
+BAR_TABLES = {}
+
+# Text bitmaps in page layout, by bitmap and row offset within a page
+GLYPHS = {}
+GLYPH_CAPACITY = 256
+# Every display's render thread shares GLYPHS: lookups are single dict reads, adding and clearing take this lock
+GLYPHS_LOCK = threading.Lock()
+
+
+def set_table(mask):
+    table = SET_TABLES.get(mask)
+
+    if table is None:
+        table = SET_TABLES[mask] = bytes(bytearray(i | mask for i in range(256)))
+
+    return table
+
+
+def clear_table(mask):
+    table = CLEAR_TABLES.get(mask)
+
+    if table is None:
+        table = CLEAR_TABLES[mask] = bytes(bytearray(i & ~mask & 0xFF for i in range(256)))
+
+    return table
+
+
+def bar_table(page, base, up):
+    """
+    Maps the far end row of a bar growing up or down from base to the bits the bar sets in a page.
+    """
+    key = (page, base, up)
+    table = BAR_TABLES.get(key)
+
+    if table is None:
+        table = bytearray(256)
+
+        for end in range(NONE):
+            top, bottom = (end, base) if up else (base, end)
+
+            for row in range(max(top, page * 8), min(bottom, page * 8 + 7) + 1):
+                table[end] |= 1 << (row - page * 8)
+
+        table = BAR_TABLES[key] = bytes(table)
+
+    return table
+
+
+def page_mask(top, bottom):
+    """
+    The bits of rows top to bottom, both within the same page and counted from its first row.
+    """
+    return (0xFF << top) & (0xFF >> (7 - bottom))
+
+
+def or_bytes(a, b):
+    """
+    ORs two byte strings of the same length in one go, through Python's arbitrary precision integers.
+    """
+    return binascii.unhexlify('%0*x' % (len(a) * 2, int(binascii.hexlify(a), 16) | int(binascii.hexlify(b), 16)))
+
+
+def or_into(buffer, start, data):
+    """
+    ORs data into buffer at start, copying it straight in where the buffer is still blank.
+    """
+    if data.count(b'\x00') == len(data):
+        return
+
+    end = start + len(data)
+    current = bytes(buffer[start:end])
+
+    if current.count(b'\x00') == len(current):
+        buffer[start:end] = data
+    else:
+        buffer[start:end] = or_bytes(current, data)
+
+
+def is_white(fill):
+    return fill not in (None, 0, 'black', '#000000')
+
+
+def glyph(bitmap, shift):
+    """
+    A 1-bit PIL image as rows of page bytes, for drawing it shift rows below the top of a page.
+    """
+    key = (id(bitmap), shift)
+    entry = GLYPHS.get(key)
+
+    # The entry keeps the bitmap alive, so its id can not be reused by another one while it is cached
+    if entry is None or entry[0] is not bitmap:
+        width, height = bitmap.size
+        pages = (shift + height + 7) // 8
+
+        image = Image.new('1', (width, pages * 8))
+        image.paste(bitmap, (0, shift))
+
+        # Transposed, each column is a row of packed bytes, one byte per page
+        columns = bytes(bytearray(image.transpose(Image.TRANSPOSE).tobytes()).translate(REVERSE_BITS))
+        entry = (bitmap, [columns[page::pages] for page in range(pages)])
+
+        GLYPHS_LOCK.acquire()
+
+        try:
+            # The text cache already keeps the bitmaps in use, starting over now and then is cheap
+            if len(GLYPHS) >= GLYPH_CAPACITY:
+                GLYPHS.clear()
+
+            GLYPHS[key] = entry
+        finally:
+            GLYPHS_LOCK.release()
+
+    return entry[1]
+
+
+def points(xy):
+    """
+    Flattens [(x0, y0), (x1, y1)] or (x0, y0, x1, y1), the two forms ImageDraw takes.
+    """
+    if len(xy) == 2:
+        return xy[0][0], xy[0][1], xy[1][0], xy[1][1]
+
+    return tuple(xy)
+
+
+class FrameBuffer:
+    """
+    A 1-bit frame drawn straight into the SSD1306/SH1106 page layout: one byte per column for every
+    8-row page, the top row in the least significant bit.
+
+    It takes the ImageDraw calls the renderers make (rectangle, horizontal and vertical lines, point
+    and bitmap) and sets exactly the pixels PIL would, so the display sends the buffer as it is
+    instead of converting an image. Fills work a page at a time, a page a shape fully covers is a
+    slice assignment and a partly covered one goes through bytes.translate(). bars() draws all the
+    bars of a chart at once, as one translate and one OR per page.
+    """
+
+    def __init__(self, width=128, height=64):
+        self.width = width
+        self.height = height
+        self.size = (width, height)
+        self.mode = '1'
+        self.pages = height // 8
+        self.buffer = bytearray(width * self.pages)
+
+    def fill(self, x0, y0, x1, y1, white):
+        # PIL truncates coordinates given as floats
+        x0 = max(int(x0), 0)
+        y0 = max(int(y0), 0)
+        x1 = min(int(x1), self.width - 1)
+        y1 = min(int(y1), self.height - 1)
+
+        if x0 > x1 or y0 > y1:
+            return
+
+        buffer = self.buffer
+        first = y0 >> 3
+        last = y1 >> 3
+
+        for page in range(first, last + 1):
+            mask = page_mask(y0 & 7 if page == first else 0, y1 & 7 if page == last else 7)
+            start = page * self.width + x0
+            end = page * self.width + x1 + 1
+
+            if mask == 0xFF:
+                buffer[start:end] = (b'\xff' if white else b'\x00') * (end - start)
+            else:
+                buffer[start:end] = buffer[start:end].translate(set_table(mask) if white else clear_table(mask))
+
+    def rectangle(self, xy, fill=None, outline=None):
+        x0, y0, x1, y1 = points(xy)
+        x0, x1 = min(x0, x1), max(x0, x1)
+        y0, y1 = min(y0, y1), max(y0, y1)
+
+        if fill is not None:
+            self.fill(x0, y0, x1, y1, is_white(fill))
+
+        if outline is not None and (fill is None or is_white(outline) != is_white(fill)):
+            white = is_white(outline)
+            self.fill(x0, y0, x1, y0, white)
+            self.fill(x0, y1, x1, y1, white)
+            self.fill(x0, y0, x0, y1, white)
+            self.fill(x1, y0, x1, y1, white)
+
+    def line(self, xy, fill=None, width=1):
+        x0, y0, x1, y1 = points(xy)
+
+        if width != 1 or (x0 != x1 and y0 != y1):
+            raise NotImplementedError('only horizontal and vertical lines one pixel wide')
+
+        self.fill(min(x0, x1), min(y0, y1), max(x0, x1), max(y0, y1), is_white(fill))
+
+    def point(self, xy, fill=None):
+        self.fill(xy[0], xy[1], xy[0], xy[1], is_white(fill))
+
+    def bitmap(self, xy, bitmap, fill=None):
+        """
+        Sets the pixels set in a 1-bit PIL image, or in another FrameBuffer of the same size at (0, 0).
+        """
+        if isinstance(bitmap, FrameBuffer):
+            for start in range(0, len(self.buffer), self.width):
+                or_into(self.buffer, start, bytes(bitmap.buffer[start:start + self.width]))
+            return
+
+        x, y = xy
+        first = y >> 3
+        width = bitmap.size[0]
+        left = max(0, -x)
+        right = min(width, self.width - x)
+
+        if left >= right:
+            return
+
+        for i, row in enumerate(glyph(bitmap, y & 7)):
+            page = first + i
+
+            if 0 <= page < self.pages:
+                or_into(self.buffer, page * self.width + x + left, row[left:right])
+
+    def bars(self, x_start, x_step, base, heights, width=3, up=True):
+        """
+        Draws a bar of each height, growing up or down from row base over the columns x - width + 1 to
+        x, the first at x_start and each next one x_step further. Renderers used to draw every bar as a
+        rectangle of its own.
+
+        Each column gets the row its bar ends at, then every page the bars reach is one translate of
+        those rows into the page's bits and one OR into the buffer.
+        """
+        if not len(heights):
+            return
+
+        limit = self.height - 1
+        negative = min(heights) < 0
+
+        # Bars pointing the wrong way end at the base here, they are drawn on their own
+        if negative:
+            ends = bytearray(min(max(base - height, 0), base) if up else max(min(base + height, limit), base)
+                             for height in heights)
+        elif up:
+            ends = bytearray(base - height if height <= base else 0 for height in heights)
+        else:
+            ends = bytearray(base + height if base + height <= limit else limit for height in heights)
+
+        if abs(x_step) >= width and not negative:
+            columns = self.spread(x_start, x_step, width, ends)
+        else:
+            columns = self.place(x_start, x_step, base, heights, width, up, ends)
+
+        top = min(min(ends), base)
+        bottom = max(max(ends), base)
+        columns = bytes(columns)
+
+        for page in range(top >> 3, (bottom >> 3) + 1):
+            or_into(self.buffer, page * self.width, columns.translate(bar_table(page, base, up)))
+
+    def spread(self, x_start, x_step, width, ends):
+        """
+        Lays bars that do not overlap out over the columns with one slice assignment per column of a bar.
+        """
+        step = abs(x_step)
+        span = bytearray(b'\xff') * (len(ends) * step)
+
+        # The span starts at the leftmost column of the bars, so those going left are reversed
+        if x_step > 0:
+            origin = x_start - step + 1
+        else:
+            origin = x_start - len(ends) * step + 1
+            ends = ends[::-1]
+
+        for column in range(width):
+            span[step - width + column::step] = ends
+
+        columns = bytearray(b'\xff') * self.width
+        first = max(origin, 0)
+        last = min(origin + len(span), self.width)
+
+        if first < last:
+            columns[first:last] = span[first - origin:last - origin]
+
+        return columns
+
+    def place(self, x_start, x_step, base, heights, width, up, ends):
+        """
+        Lays bars out one at a time, for bars that overlap or point the wrong way.
+        """
+        columns = bytearray(b'\xff') * self.width
+        x = x_start
+
+        for height, end in zip(heights, ends):
+            if height < 0:
+                # Drawn as the rectangle it would have been, ending on the other side of the base
+                end = base - height if up else base + height
+                self.fill(x - width + 1, min(base, end), x, max(base, end), True)
+            else:
+                for column in range(max(x - width + 1, 0), min(x, self.width - 1) + 1):
+                    if columns[column] == NONE:
+                        columns[column] = end
+                    else:
+                        columns[column] = min(columns[column], end) if up else max(columns[column], end)
+
+            x += x_step
+
+        return columns
+
+    def scroll(self, box, dx):
+        """
+        Moves the box's contents dx columns sideways, clearing the columns they leave behind.
+        """
+        left, top, right, bottom = box
+        count = right - left + 1
+        blank = b'\x00' * abs(dx)
+
+        for page in range(top >> 3, (bottom >> 3) + 1):
+            mask = page_mask(max(top - page * 8, 0), min(bottom - page * 8, 7))
+            start = page * self.width + left
+            end = start + count
+            current = bytes(self.buffer[start:end])
+
+            if dx < 0:
+                moved = current[-dx:] + blank
+            else:
+                moved = blank + current[:count - dx]
+
+            if mask != 0xFF:
+                # Rows of the page outside the box stay where they are
+                moved = or_bytes(moved.translate(clear_table(~mask & 0xFF)), current.translate(clear_table(mask)))
+
+            self.buffer[start:end] = moved
+
+    def clear(self):
+        self.buffer[:] = bytearray(len(self.buffer))
@@ -0,0 +1,79 @@
+import threading
+
+from collections import OrderedDict
+
+from PIL import Image
+from PIL import ImageDraw
+from PIL import ImageFont
+
+
+class TextCache:
+    """
+    A bounded LRU cache of pre-rendered 1-bit text bitmaps, keyed by string and font.
+
+    Headers and labels are mostly the same from one frame to the next, so rather than having PIL
+    rasterize them every frame the bitmaps are rendered once and pasted into the frame. The hit and
+    miss counters show whether the cache is paying for itself. Every display's render thread draws
+    through the one cache, the OrderedDict is not safe to share without the lock.
+    """
+
+    def __init__(self, capacity=64, font=None):
+        self.capacity = capacity
+        self.font = font if font is not None else ImageFont.load_default()
+        self.bitmaps = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, text, font=None):
+        if font is None:
+            font = self.font
+
+        key = (text, font)
+        self.lock.acquire()
+
+        try:
+            bitmap = self.bitmaps.pop(key, None)
+
+            if bitmap is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+                bitmap = self.rasterize(text, font)
+
+                if len(self.bitmaps) >= self.capacity:
+                    self.bitmaps.popitem(last=False)
+
+            self.bitmaps[key] = bitmap
+            return bitmap
+        finally:
+            self.lock.release()
+
+    def rasterize(self, text, font):
+        width, height = font.getsize(text)
+        bitmap = Image.new('1', (max(width, 1), max(height, 1)))
+
+        ImageDraw.Draw(bitmap).text((0, 0), text, fill=1, font=font)
+        return bitmap
+
+    def text(self, draw, xy, text, font=None):
+        """
+        Pastes the bitmap for text at xy and returns its measured (width, height).
+        """
+        bitmap = self.get(text, font)
+
+        draw.bitmap(xy, bitmap, fill="white")
+        return bitmap.size
+
+    def clear(self):
+        self.lock.acquire()
+
+        try:
+            self.bitmaps.clear()
+            self.hits = 0
+            self.misses = 0
+        finally:
+            self.lock.release()
+
+
+text_cache = TextCache()
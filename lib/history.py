@@ -0,0 +1,170 @@
+import math
+
+from ringbuffer import RingBuffer
+
+# Resolution in seconds and header label of each time scale, the first one holds the raw samples
+TIERS = (
+    (1, '1s'),
+    (10, '10s'),
+    (60, '1m'),
+    (600, '10m')
+)
+
+
+class Tier(object):
+    """
+    One time scale of a History: min/avg/max buffers plus the bucket currently being aggregated.
+    """
+
+    __slots__ = ('resolution', 'label', 'minimum', 'average', 'maximum', 'start', 'total', 'count', 'low', 'high')
+
+    def __init__(self, capacity, resolution, label):
+        self.resolution = resolution
+        self.label = label
+        self.minimum = RingBuffer(capacity)
+        self.average = RingBuffer(capacity)
+        self.maximum = RingBuffer(capacity)
+        self.start = None
+        self.total = 0.0
+        self.count = 0
+        self.low = None
+        self.high = None
+
+    def add(self, value, timestamp):
+        if self.start is not None and timestamp - self.start >= self.resolution:
+            self.flush()
+
+        if self.start is None:
+            self.start = timestamp
+
+        self.total += value
+        self.count += 1
+
+        if self.low is None or value < self.low:
+            self.low = value
+
+        if self.high is None or value > self.high:
+            self.high = value
+
+    def flush(self):
+        self.minimum.append(self.low)
+        self.average.append(self.total / self.count)
+        self.maximum.append(self.high)
+
+        self.start = None
+        self.total = 0.0
+        self.count = 0
+        self.low = None
+        self.high = None
+
+
+class History(object):
+    """
+    A bounded, multi-resolution history of one measure.
+
+    Raw samples are kept in a ring buffer and are also folded into coarser tiers (see TIERS) as they
+    arrive, each tier keeping the min, average and max of its buckets in ring buffers of the same
+    capacity. Memory use is fixed no matter how long the daemon runs.
+
+    A History reads like the RingBuffer of its selected tier's averages, so renderers and headers do
+    not need to know which time scale is shown.
+
+    With a QuantileSketch every raw sample also goes into it, for quantiles over windows far longer
+    than the ring buffers hold.
+    """
+
+    __slots__ = ('capacity', 'raw', 'tiers', 'labels', 'tier', 'sketch')
+
+    def __init__(self, capacity, tiers=TIERS, sketch=None):
+        self.capacity = capacity
+        self.raw = RingBuffer(capacity)
+        self.tiers = [Tier(capacity, resolution, label) for resolution, label in tiers[1:]]
+        self.labels = [label for resolution, label in tiers]
+        self.tier = 0
+        self.sketch = sketch
+
+    def append(self, value, timestamp):
+        self.raw.append(value)
+
+        for tier in self.tiers:
+            tier.add(value, timestamp)
+
+        if self.sketch is not None:
+            self.sketch.add(value, timestamp)
+
+    def buffers(self):
+        """
+        Every ring buffer of the history, raw samples first and then min/avg/max of each tier.
+        """
+        buffers = [self.raw]
+
+        for tier in self.tiers:
+            buffers.extend((tier.minimum, tier.average, tier.maximum))
+
+        return buffers
+
+    def resolutions(self, interval):
+        """
+        Seconds between the values of each buffer of buffers() when a sample is appended every interval
+        seconds. A tier's bucket closes with the first sample its resolution or more after it opened.
+        """
+        resolutions = [interval]
+
+        for tier in self.tiers:
+            resolution = math.ceil(round(float(tier.resolution) / interval, 6)) * interval
+            resolutions.extend((resolution, resolution, resolution))
+
+        return resolutions
+
+    def view(self, kind='average'):
+        if self.tier == 0:
+            return self.raw
+
+        return getattr(self.tiers[self.tier - 1], kind)
+
+    def label(self):
+        return self.labels[self.tier]
+
+    @property
+    def appended(self):
+        return self.view().appended
+
+    def __len__(self):
+        return len(self.view())
+
+    def __iter__(self):
+        return iter(self.view())
+
+    def __reversed__(self):
+        return reversed(self.view())
+
+    def __getitem__(self, index):
+        return self.view()[index]
+
+    def maximum(self):
+        return self.view().maximum()
+
+    def minimum(self):
+        return self.view().minimum()
+
+    def newest(self):
+        return self.view().newest()
+
+    def heights(self, scale, max_count, count=None):
+        return self.view().heights(scale, max_count, count)
+
+
+def named_histories(prefix, node):
+    """
+    Walks a screen's measures and yields a stable dotted name for every History in it.
+    """
+    if isinstance(node, History):
+        yield prefix, node
+    elif isinstance(node, dict):
+        for key in sorted(node.keys()):
+            for item in named_histories('%s.%s' % (prefix, key), node[key]):
+                yield item
+    elif isinstance(node, (list, tuple)):
+        for i, child in enumerate(node):
+            for item in named_histories('%s.%s' % (prefix, i), child):
+                yield item
@@ -0,0 +1,92 @@
+import threading
+
+from ringbuffer import RingBuffer
+
+# Metrics the monitor keeps about itself, times are in milliseconds
+RENDER_TIME = 'render'
+BUS_TIME = 'bus'
+BUS_BYTES = 'bus_bytes'
+BUS_TRANSACTIONS = 'bus_transactions'
+SAMPLER_JITTER = 'jitter'
+LOCK_WAIT = 'lock'
+PROCESS_CPU = 'cpu'
+PROCESS_RSS = 'rss'
+
+
+class Metric:
+    """
+    A rolling window of the most recent values of one measurement.
+
+    Besides the window, the metric tracks the highest value recorded since it was last drained, so a
+    chart sampled once per tick still shows the worst frame of that tick.
+    """
+
+    def __init__(self, capacity):
+        self.window = RingBuffer(capacity)
+        self.peak = None
+
+    def record(self, value):
+        self.window.append(value)
+
+        if self.peak is None or value > self.peak:
+            self.peak = value
+
+    def drain(self):
+        peak = self.peak
+        self.peak = None
+
+        return peak
+
+    def percentiles(self, percents):
+        """
+        Nearest-rank percentiles of the window, all zero while it is empty.
+        """
+        values = sorted(self.window)
+
+        if not values:
+            return [0.0] * len(percents)
+
+        return [values[min(len(values) - 1, int(len(values) * percent / 100.0))] for percent in percents]
+
+
+class PerformanceCounters:
+    """
+    The monitor's measurements of its own overhead, recorded from the render, sampler and GPIO threads.
+    """
+
+    def __init__(self, window=300):
+        self.window = window
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def metric(self, name):
+        metric = self.metrics.get(name)
+
+        if metric is None:
+            metric = self.metrics[name] = Metric(self.window)
+
+        return metric
+
+    def record(self, name, value):
+        self.lock.acquire()
+
+        try:
+            self.metric(name).record(value)
+        finally:
+            self.lock.release()
+
+    def drain(self, name):
+        self.lock.acquire()
+
+        try:
+            return self.metric(name).drain()
+        finally:
+            self.lock.release()
+
+    def percentiles(self, name, percents=(50, 95, 99)):
+        self.lock.acquire()
+
+        try:
+            return self.metric(name).percentiles(percents)
+        finally:
+            self.lock.release()
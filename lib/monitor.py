@@ -3,107 +3,262 @@ import atexit
 import os
 import RPi.GPIO as GPIO
 import signal
+import socket
 import sys
-import threading
-import time
 
 from ConfigParser import ConfigParser
 
 from luma.oled.device import sh1106
 from luma.oled.device import ssd1306
-from luma.core.serial import i2c
-
+from monotonic import monotonic
+
+from alerts import AlertEngine
+from alerts import AlertRule
+from alerts import find_history
+from buttons import ButtonInput
+from buttons import CLICK
+from buttons import LONG_PRESS
+from display import DiffingDisplay
+from metrics import PerformanceCounters
+from processes import SelfStat
+from procfs import ProcBackend
+from quantiles import QuantileWindows
+from rates import AdaptiveRate
+from rates import FixedRate
+from rates import IdleRate
+from sampler import PsutilBackend
+from sampler import Sampler
 from screens import CpuScreen
+from screens import DiagnosticsScreen
+from screens import FleetScreen
 from screens import NetworkScreen
 from screens import MemoryScreen
+from screens import ProcessScreen
+from store import HistoryStore
+from transport import I2cTransport
+from transport import SpiTransport
+from transport import i2c_clock
+from utils import bytes_to_human
+from utils import human_to_bytes
+from utils import human_to_seconds
+from worker import DisplayWorker
+
+# Every screen the monitor has, in the order a display shows them when its screens are not configured
+SCREENS = ('cpu', 'network', 'memory', 'processes', 'diagnostics', 'fleet')
 
 
 class RpiMonitor:
     def __init__(self):
-        self.device = None
+        self.displays = []
         self.screens = []
-        self.screen_index = 0
-        self.threads = []
-        self.lock = threading.Lock()
-        self.timestamp = None
-        self.timer = None
+        self.sampler = None
+        self.alerts = None
+        self.store = None
+        self.counters = None
+        self.exporter = None
+        self.sender = None
+        self.receiver = None
+        self.idle = False
+        self.last_activity = monotonic()
+        self.buttons = None
+        self.stat = SelfStat()
+        self.startup = []
         self.config = ConfigParser()
 
+        self.startup_phase('imports')
         self.init()
         self.SCREEN_NEXT_PIN = self.config.getint('buttons', 'pin_next')
         self.SCREEN_PREV_PIN = self.config.getint('buttons', 'pin_previous')
         self.SCREEN_UP_PIN = self.config.getint('buttons', 'pin_up')
         self.SCREEN_DOWN_PIN = self.config.getint('buttons', 'pin_down')
         self.SCREEN_RESET_PIN = self.config.getint('buttons', 'pin_reset')
+        self.SCREEN_ZOOM_PIN = None
+        if self.config.has_option('buttons', 'pin_zoom'):
+            self.SCREEN_ZOOM_PIN = self.config.getint('buttons', 'pin_zoom')
         self.BUTTON_RESET_TIMEOUT = self.config.getfloat('buttons', 'reset_timeout')
         self.BUTTON_DEBOUNCE_TIME = self.config.getfloat('buttons', 'debounce_time')
+        self.IDLE_TIMEOUT = self.config.getfloat('display', 'idle_timeout') * 60
+        self.IDLE_INTERVAL = self.config.getfloat('display', 'idle_interval')
 
-    def register(self, screen, index=None):
+        pins = [self.SCREEN_NEXT_PIN, self.SCREEN_PREV_PIN, self.SCREEN_UP_PIN, self.SCREEN_DOWN_PIN,
+                self.SCREEN_RESET_PIN]
+        if self.SCREEN_ZOOM_PIN is not None:
+            pins.append(self.SCREEN_ZOOM_PIN)
 
-        thread = threading.Thread(target=screen.collect, args=())
-        thread.daemon = True
-        thread.start()
+        # Holding reset resets every screen, holding up or down zooms in or out of the time scale and holding
+        # next switches the header to the quantiles
+        self.buttons = ButtonInput(pins, GPIO.input, self.BUTTON_DEBOUNCE_TIME, self.BUTTON_RESET_TIMEOUT,
+                                   long_pins=(self.SCREEN_RESET_PIN, self.SCREEN_UP_PIN, self.SCREEN_DOWN_PIN,
+                                              self.SCREEN_NEXT_PIN))
+
+    def register(self, screen, index=None, interval=None):
+        self.sampler.register(screen, index, interval)
 
         if index is not None:
             self.screens.insert(index, screen)
-            self.threads.insert(index, thread)
         else:
             self.screens.append(screen)
-            self.threads.append(thread)
 
-    def handle_screen_change(self, channel):
-        time_now = time.time()
+    @property
+    def display(self):
+        # The buttons control the first display
+        return self.displays[0]
+
+    def handle_edge(self, channel):
+        self.buttons.edge(channel, GPIO.input(channel))
+
+    def handle_buttons(self, events):
+        """
+        Applies a batch of button events on the input thread, then asks for one render for all of them.
+        """
+        display = self.display
+        screen_index = display.screen_index
+
+        for kind, channel in events:
+            if self.wake():
+                # The press only turns the displays back on
+                continue
+
+            display.lock.acquire()
+
+            try:
+                if channel == self.SCREEN_RESET_PIN:
+                    self.handle_screen_reset(kind)
+                else:
+                    self.handle_screen_change(channel, kind)
+            finally:
+                display.lock.release()
+
+        if display.screen_index != screen_index:
+            display.visible_screen().show()
+
+            # The newly visible screen may sample at a different rate
+            self.sampler.reschedule()
+
+        display.request_render()
+
+    def handle_screen_change(self, channel, kind=CLICK):
+        display = self.display
+        screens = display.screens
+
+        if channel == self.SCREEN_NEXT_PIN and kind == LONG_PRESS:
+            display.visible_screen().next_header()
+        elif channel == self.SCREEN_NEXT_PIN:
+            display.screen_index = display.screen_index + 1 if display.screen_index + 1 < len(screens) else 0
+        elif channel == self.SCREEN_PREV_PIN:
+            display.screen_index = display.screen_index - 1 if display.screen_index - 1 >= 0 else len(screens) - 1
+        elif channel == self.SCREEN_UP_PIN and kind == LONG_PRESS:
+            display.visible_screen().next_scale()
+        elif channel == self.SCREEN_UP_PIN:
+            display.visible_screen().next_screen()
+        elif channel == self.SCREEN_DOWN_PIN and kind == LONG_PRESS:
+            display.visible_screen().previous_scale()
+        elif channel == self.SCREEN_DOWN_PIN:
+            display.visible_screen().previous_screen()
+        elif channel == self.SCREEN_ZOOM_PIN:
+            display.visible_screen().next_scale()
+
+    def handle_screen_reset(self, kind=CLICK):
+        display = self.display
+
+        if kind == LONG_PRESS:
+            display.screen_index = 0
 
-        if (time_now - self.timestamp) > self.BUTTON_DEBOUNCE_TIME:
-            if channel == self.SCREEN_NEXT_PIN:
-                self.screen_index = self.screen_index + 1 if self.screen_index + 1 < len(self.screens) else 0
-            elif channel == self.SCREEN_PREV_PIN:
-                self.screen_index = self.screen_index - 1 if self.screen_index - 1 >= 0 else len(self.screens) - 1
-            elif channel == self.SCREEN_UP_PIN:
-                self.screens[self.screen_index].next_screen()
-            elif channel == self.SCREEN_DOWN_PIN:
-                self.screens[self.screen_index].previous_screen()
+            # Reset all screens to their default display
+            for screen in display.screens:
+                screen.reset_screen()
+        else:
+            display.visible_screen().reset_screen()
 
-            if channel in (self.SCREEN_NEXT_PIN, self.SCREEN_PREV_PIN, self.SCREEN_UP_PIN, self.SCREEN_DOWN_PIN):
-                self.render()
+    def wake(self):
+        """
+        Records button activity and turns blanked displays back on, returns whether they were blanked.
+        """
+        self.last_activity = monotonic()
 
-            self.timestamp = time_now
+        if not self.idle:
+            return False
 
-    def handle_screen_reset_timer_callback(self):
-        if self.timer:
-            self.timer.cancel()
-            self.timer = None
-            self.screen_index = 0
+        self.idle = False
 
-            # Reset all screens to their default display
-            for screen in self.screens:
-                screen.reset_screen()
+        for display in self.displays:
+            display.set_idle(False)
+
+        self.sampler.reschedule()
+
+        return True
+
+    def check_idle(self):
+        if self.IDLE_TIMEOUT <= 0 or self.idle or monotonic() - self.last_activity < self.IDLE_TIMEOUT:
+            return
+
+        self.idle = True
+
+        for display in self.displays:
+            display.set_idle(True)
 
-            self.render()
+        self.sampler.reschedule()
 
-    def handle_screen_reset(self, channel):
-        if GPIO.input(self.SCREEN_RESET_PIN) and self.timer:
-            self.timer.cancel()
-            self.timer = None
+    def is_idle(self):
+        return self.idle
 
-            self.screens[self.screen_index].reset_screen()
-            self.render()
+    def visible_screens(self):
+        return [display.visible_screen() for display in self.displays]
 
-        elif not GPIO.input(self.SCREEN_RESET_PIN) and not self.timer:
-            self.timer = threading.Timer(self.BUTTON_RESET_TIMEOUT, self.handle_screen_reset_timer_callback)
-            self.timer.start()
+    def collector_interval(self, name):
+        return self.config.getfloat('sampler', 'interval_%s' % name)
 
-    def render(self):
-        self.lock.acquire()
+    def handle_sample(self, screen):
+        self.check_idle()
 
-        try:
-            self.screens[self.screen_index].render(self.device)
-        finally:
-            self.lock.release()
+        if self.idle:
+            return
+
+        cycled = False
+
+        for display in self.displays:
+            cycled = display.handle_sample(screen) or cycled
+
+        if cycled:
+            # The newly visible screens may sample at a different rate
+            self.sampler.reschedule()
+
+    def handle_alert(self, rule, fired):
+        """
+        Marks the rule's sub-screen while the rule is firing and brings it to the front when it fires.
+        """
+        screen = rule.screen
+        screen.alerts[rule.index] = screen.alerts.get(rule.index, 0) + (1 if fired else -1)
+
+        if not fired:
+            print 'Alert cleared: %s' % rule.describe()
+            return
+
+        print 'Alert fired: %s' % rule.describe()
+
+        # An alert is meant to be seen, it turns blanked displays back on
+        self.wake()
+
+        for display in self.displays:
+            if screen in display.screens:
+                display.show_alert(screen, rule.index)
 
     def shutdown_hook(self):
-        self.device.clear()
-        self.device.cleanup()
+        if self.exporter is not None:
+            self.exporter.stop()
+
+        if self.sender is not None:
+            self.sender.close()
+
+        if self.receiver is not None:
+            self.receiver.stop()
+
+        if self.store is not None:
+            self.store.close()
+
+        for display in self.displays:
+            display.device.clear()
+            display.device.cleanup()
 
         GPIO.cleanup()
 
@@ -126,41 +281,384 @@ class RpiMonitor:
             print 'Loading config: %s' % path
             self.config.read(path)
 
+    def create_sampler(self, interfaces, policy):
+        if 'proc' == self.config.get('sampler', 'backend'):
+            backend = ProcBackend(interfaces=interfaces)
+        else:
+            backend = PsutilBackend()
+
+        if self.config.has_option('sampler', 'trace'):
+            # Only imported when recording
+            from recording import RecordingBackend
+            from recording import TraceWriter
+
+            print 'Recording samples to %s' % self.config.get('sampler', 'trace')
+            backend = RecordingBackend(backend, TraceWriter(self.config.get('sampler', 'trace'),
+                                                            human_to_bytes(self.config.get('sampler', 'trace_size'))))
+
+        return Sampler(backend=backend, counters=self.counters, policy=policy)
+
+    def display_sections(self):
+        """
+        [display] is the first display, every [display:NAME] section adds another one.
+        """
+        return ['display'] + [section for section in self.config.sections() if section.startswith('display:')]
+
+    def display_option(self, section, option):
+        # Further displays take what they do not set from [display]
+        if self.config.has_option(section, option):
+            return self.config.get(section, option)
+
+        return self.config.get('display', option)
+
+    def create_transport(self, section):
+        clock = int(self.display_option(section, 'bus_clock'))
+        block_size = int(self.display_option(section, 'block_size'))
+
+        if 'spi' == self.display_option(section, 'bus'):
+            return SpiTransport(port=int(self.display_option(section, 'port')),
+                                device=int(self.display_option(section, 'spi_device')),
+                                clock=clock,
+                                block_size=block_size,
+                                gpio=GPIO,
+                                dc_pin=int(self.display_option(section, 'dc_pin')),
+                                reset_pin=int(self.display_option(section, 'reset_pin')))
+
+        port = int(self.display_option(section, 'port'))
+        actual = i2c_clock(port)
+
+        # The adapter's clock comes from the device tree, it can only be pointed out here
+        if actual is not None and actual != clock:
+            print '[%s] expects an I2C clock of %s Hz, bus %s runs at %s Hz (dtparam=i2c_arm_baudrate)' % \
+                (section, clock, port, actual)
+
+        return I2cTransport(port=port,
+                            address=int(self.display_option(section, 'address'), 16),
+                            clock=clock,
+                            block_size=block_size)
+
+    def create_device(self, section):
+        serial = self.create_transport(section)
+        driver = self.display_option(section, 'driver')
+
+        if 'sh1106' == driver:
+            device = sh1106(serial)
+        else:
+            device = ssd1306(serial)
+
+        # Only the pages that changed between frames are written over the bus, a frame at a time
+        return DiffingDisplay(device, driver=driver, serial=serial,
+                              framebuffer='framebuffer' == self.display_option(section, 'renderer'))
+
+    def screen_names(self, sections):
+        """
+        The screens each display shows. A screen keeps the sub-screen, time scale and chart it shows, so
+        it is on one display only. A display without a screens option shows every screen no other
+        display lists.
+        """
+        enabled = ['cpu', 'network', 'memory']
+
+        if self.config.getboolean('processes', 'enabled'):
+            enabled.append('processes')
+
+        if self.config.getboolean('diagnostics', 'enabled'):
+            enabled.append('diagnostics')
+
+        if 'receiver' == self.config.get('fleet', 'mode'):
+            enabled.append('fleet')
+
+        listed = {}
+        names = []
+
+        for section in sections:
+            if not self.config.has_option(section, 'screens'):
+                names.append(None)
+                continue
+
+            names.append([])
+
+            for name in [item.strip() for item in self.config.get(section, 'screens').split(',') if item.strip()]:
+                if name not in SCREENS:
+                    raise ValueError('[%s] lists an unknown screen %s' % (section, name))
+
+                if name in listed:
+                    raise ValueError('%s is on [%s] and [%s], a screen can only be on one display' %
+                                     (name, listed[name], section))
+
+                listed[name] = section
+
+                if name not in enabled:
+                    print 'Screen %s is not enabled, leaving it off [%s]' % (name, section)
+                    continue
+
+                names[-1].append(name)
+
+        rest = [name for name in SCREENS if name in enabled and name not in listed]
+
+        return [rest if screens is None else screens for screens in names]
+
+    def create_quantiles(self):
+        windows = [item.strip() for item in self.config.get('quantiles', 'windows').split(',') if item.strip()]
+
+        if not windows:
+            return None
+
+        return QuantileWindows([(human_to_seconds(window), window) for window in windows],
+                               self.config.getfloat('quantiles', 'accuracy'))
+
+    def alert_sections(self):
+        return [section for section in self.config.sections() if section.startswith('alert:')]
+
+    def create_alerts(self, sections):
+        """
+        A rule for every [alert:NAME] section, watching a history of one of the screens shown.
+        """
+        rules = []
+
+        for section in sections:
+            metric = self.config.get(section, 'metric')
+            found = find_history(self.screens, metric)
+
+            if found is None:
+                raise ValueError('[%s] watches %s, no screen shown has it' % (section, metric))
+
+            if self.config.has_option(section, 'above') == self.config.has_option(section, 'below'):
+                raise ValueError('[%s] needs either above or below' % section)
+
+            above = self.config.has_option(section, 'above')
+            screen, index, history = found
+            clear = None
+            duration = 0
+            window = 0
+
+            if self.config.has_option(section, 'clear'):
+                clear = self.config.getfloat(section, 'clear')
+
+            if self.config.has_option(section, 'for'):
+                duration = human_to_seconds(self.config.get(section, 'for'))
+
+            if self.config.has_option(section, 'window'):
+                window = human_to_seconds(self.config.get(section, 'window'))
+
+            rules.append(AlertRule(section[len('alert:'):], screen, index, history,
+                                   self.config.getfloat(section, 'above' if above else 'below'), above=above,
+                                   duration=duration, clear=clear, window=window))
+
+        return rules
+
+    def create_screens(self, name, scrolling, interfaces, quantiles):
+        if 'cpu' == name:
+            screens = [CpuScreen(scrolling=scrolling, quantiles=quantiles)]
+        elif 'network' == name:
+            screens = [NetworkScreen(iface, scrolling=scrolling, quantiles=quantiles) for iface in interfaces]
+        elif 'memory' == name:
+            screens = [MemoryScreen(scrolling=scrolling, quantiles=quantiles)]
+        elif 'processes' == name:
+            screens = [ProcessScreen(count=self.config.getint('processes', 'count'))]
+        elif 'diagnostics' == name:
+            screens = [DiagnosticsScreen(self.counters, scrolling=scrolling)]
+        else:
+            screens = [FleetScreen(self.receiver, scrolling=scrolling,
+                                   cycle_time=self.config.getfloat('fleet', 'cycle_time'))]
+
+        for screen in screens:
+            self.register(screen, interval=self.collector_interval(name))
+
+        return screens
+
+    def startup_phase(self, phase):
+        self.startup.append((phase, self.stat.age()))
+
+    def startup_report(self):
+        """
+        Prints when each startup phase ended, in seconds since the process started, and the memory in use.
+        """
+        cpu_time, rss = self.stat.usage()
+
+        print 'Startup: %s after start, RSS %s' % (', '.join('%s %.2fs' % phase for phase in self.startup),
+                                                   bytes_to_human(rss))
+
+    def start_exporter(self):
+        # Only imported when enabled, it pulls in the HTTP server modules
+        from exporter import MetricsServer
+
+        print 'Serving metrics on %s:%s' % (self.config.get('exporter', 'address'),
+                                            self.config.getint('exporter', 'port'))
+        self.exporter = MetricsServer(self.screens,
+                                      self.config.get('exporter', 'address'),
+                                      self.config.getint('exporter', 'port'))
+        self.exporter.start()
+
+    def run_sender(self):
+        """
+        Runs without a display or buttons, sending this node's samples to a fleet receiver.
+        """
+        from fleet import FleetSender
+
+        interfaces = [item.strip() for item in self.config.get('network', 'iface').split(',')]
+
+        self.counters = PerformanceCounters(self.config.getint('diagnostics', 'window'))
+
+        # Nothing is shown, every collector keeps its configured interval
+        self.sampler = self.create_sampler(interfaces, FixedRate())
+
+        networks = []
+        for iface in interfaces:
+            networks.append(NetworkScreen(iface))
+            self.register(networks[-1], interval=self.collector_interval('network'))
+
+        memory = MemoryScreen()
+        self.register(memory, interval=self.collector_interval('memory'))
+
+        # The datagram goes out when the CPU screen collects, the others have collected the same sample by then
+        cpu = CpuScreen()
+        self.register(cpu, interval=self.collector_interval('cpu'))
+
+        if self.config.has_option('fleet', 'name'):
+            name = self.config.get('fleet', 'name')
+        else:
+            name = socket.gethostname()
+
+        print 'Sending to fleet receiver %s:%s as %s' % (self.config.get('fleet', 'address'),
+                                                         self.config.getint('fleet', 'port'), name)
+        self.sender = FleetSender(self.config.get('fleet', 'address'), self.config.getint('fleet', 'port'), name,
+                                  cpu=cpu, memory=memory, networks=networks)
+        self.sampler.add_listener(self.sender.handle_sample)
+
+        if self.config.getboolean('exporter', 'enabled'):
+            self.start_exporter()
+
+        signal.signal(signal.SIGTERM, lambda num, frame: sys.exit(0))
+        atexit.register(self.shutdown_hook)
+
+        self.sampler.start()
+
+        while True:
+            signal.pause()
+
     def run(self):
+        if 'sender' == self.config.get('fleet', 'mode'):
+            self.run_sender()
+            return
+
         print 'Setting up GPIO'
         GPIO.setmode(GPIO.BCM)
 
-        self.setup_gpio_pin(self.SCREEN_NEXT_PIN, self.handle_screen_change)
-        self.setup_gpio_pin(self.SCREEN_PREV_PIN, self.handle_screen_change)
-        self.setup_gpio_pin(self.SCREEN_UP_PIN, self.handle_screen_change)
-        self.setup_gpio_pin(self.SCREEN_DOWN_PIN, self.handle_screen_change)
-        self.setup_gpio_pin(self.SCREEN_RESET_PIN, self.handle_screen_reset)
+        self.setup_gpio_pin(self.SCREEN_NEXT_PIN, self.handle_edge)
+        self.setup_gpio_pin(self.SCREEN_PREV_PIN, self.handle_edge)
+        self.setup_gpio_pin(self.SCREEN_UP_PIN, self.handle_edge)
+        self.setup_gpio_pin(self.SCREEN_DOWN_PIN, self.handle_edge)
+        self.setup_gpio_pin(self.SCREEN_RESET_PIN, self.handle_edge)
+
+        if self.SCREEN_ZOOM_PIN is not None:
+            self.setup_gpio_pin(self.SCREEN_ZOOM_PIN, self.handle_edge)
+
+        print 'Setting up displays'
+        sections = self.display_sections()
+        devices = [self.create_device(section) for section in sections]
+        self.startup_phase('display')
+
+        interfaces = [item.strip() for item in self.config.get('network', 'iface').split(',')]
+
+        self.counters = PerformanceCounters(self.config.getint('diagnostics', 'window'))
+
+        if 'adaptive' == self.config.get('sampler', 'mode'):
+            policy = AdaptiveRate(self.visible_screens,
+                                  self.config.getfloat('sampler', 'fast_interval'),
+                                  self.config.getfloat('sampler', 'slow_interval'),
+                                  self.config.getfloat('sampler', 'change_threshold'),
+                                  self.config.getfloat('sampler', 'flat_time'))
+        else:
+            policy = FixedRate()
+
+        if self.IDLE_TIMEOUT > 0 and self.IDLE_INTERVAL > 0:
+            policy = IdleRate(policy, self.IDLE_INTERVAL, self.is_idle)
+
+        self.sampler = self.create_sampler(interfaces, policy)
+
+        if 'receiver' == self.config.get('fleet', 'mode'):
+            from fleet import FleetReceiver
 
-        print 'Setting up display'
-        serial = i2c(port=self.config.getint('display', 'port'), address=int(self.config.get('display', 'address'), 16))
+            print 'Receiving fleet reports on %s:%s' % (self.config.get('fleet', 'address'),
+                                                        self.config.getint('fleet', 'port'))
+            self.receiver = FleetReceiver(self.config.get('fleet', 'address'),
+                                          self.config.getint('fleet', 'port'),
+                                          timeout=self.config.getfloat('fleet', 'timeout'),
+                                          buffer_size=human_to_bytes(self.config.get('fleet', 'buffer_size')),
+                                          max_nodes=self.config.getint('fleet', 'max_nodes'),
+                                          expire=self.config.getfloat('fleet', 'expire_time'))
 
-        self.device = ssd1306(serial)
+        quantiles = self.create_quantiles()
 
-        if 'sh1106' == self.config.get('display', 'driver'):
-            self.device = sh1106(serial)
+        # One set of collectors feeds every display, each screen is registered with the sampler once
+        for section, device, names in zip(sections, devices, self.screen_names(sections)):
+            scrolling = 'scrolling' == self.display_option(section, 'render_mode')
+            screens = []
 
-        self.register(CpuScreen())
+            for name in names:
+                screens.extend(self.create_screens(name, scrolling, interfaces, quantiles))
 
-        for iface in [item.strip() for item in self.config.get('network', 'iface').split(',')]:
-            self.register(NetworkScreen(iface))
+            if not screens:
+                raise ValueError('[%s] has no screens to show' % section)
 
-        self.register(MemoryScreen())
+            self.displays.append(DisplayWorker(section, device, screens, self.counters,
+                                               float(self.display_option(section, 'cycle_time'))))
+
+        if self.receiver is not None:
+            self.receiver.start()
+
+        if self.config.getboolean('history', 'enabled'):
+            self.store = HistoryStore(self.config.get('history', 'path'),
+                                      human_to_bytes(self.config.get('history', 'size_budget')),
+                                      human_to_bytes(self.config.get('history', 'write_budget')),
+                                      self.config.getfloat('history', 'flush_interval'))
+
+            for screen in self.screens:
+                self.store.attach(screen)
+
+            self.sampler.add_listener(self.store.handle_sample)
+
+        rules = self.create_alerts(self.alert_sections())
+
+        if rules:
+            self.alerts = AlertEngine(rules, self.handle_alert)
+            print 'Watching %s alert rules' % len(rules)
+
+            # Rules are evaluated before the displays are told about the sample, so a rule firing on
+            # it brings its screen to the front right away
+            self.sampler.add_listener(self.alerts.handle_sample)
+
+        for display in self.displays:
+            display.visible_screen().show()
+
+        self.startup_phase('screens')
+
+        self.sampler.add_listener(self.handle_sample)
+        self.sampler.start()
+        self.sampler.ready.wait()
+        self.startup_phase('samples')
+
+        # The first frames go out before anything the displays do not need is started
+        for display in self.displays:
+            display.render()
+
+        self.startup_phase('first frame')
+        self.startup_report()
+
+        if self.config.getboolean('exporter', 'enabled'):
+            self.start_exporter()
 
         signal.signal(signal.SIGTERM, lambda num, frame: sys.exit(0))
         atexit.register(self.shutdown_hook)
 
-        self.timestamp = time.time()
+        for display in self.displays:
+            display.start()
 
-        while True:
-            screen = self.screens[self.screen_index]
-            self.render()
-            time.sleep(screen.sleep_interval())
+        # Presses queued since the pins were set up are handled from here on
+        self.buttons.start(self.handle_buttons)
 
+        while True:
+            signal.pause()
 
 if __name__ == '__main__':
     try:
@@ -0,0 +1,132 @@
+import heapq
+import os
+
+from procfs import CLOCK_TICKS
+from procfs import ProcFile
+
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+
+
+class Process:
+    def __init__(self, pid, name, start):
+        self.pid = pid
+        self.name = name
+        self.start = start
+        self.ticks = None
+        self.cpu = 0.0
+        self.rss = 0
+
+
+class ProcessScanner:
+    """
+    Keeps the CPU and memory use of every process up to date by re-reading /proc/<pid>/stat.
+
+    A refresh lists /proc for the current PIDs, forgets the ones that exited and reads a single stat
+    file per process. What does not change over a process's life, its name and start time, is parsed
+    once and cached per PID, the start time also tells a reused PID from the process that had it
+    before. CPU use is the percentage of one core since the previous refresh, like top shows it.
+
+    The top count processes by CPU and by memory are picked during the same pass, each kept in a
+    bounded min-heap, so most processes cost a single comparison and nothing is sorted.
+    """
+
+    def __init__(self, root='/proc', count=5):
+        self.root = root
+        self.count = count
+        self.processes = {}
+        self.timestamp = None
+        self.top_cpu = []
+        self.top_rss = []
+
+    def read_stat(self, pid):
+        try:
+            fd = os.open(os.path.join(self.root, pid, 'stat'), os.O_RDONLY)
+        except OSError:
+            return None
+
+        try:
+            return os.read(fd, 1024)
+        except OSError:
+            return None
+        finally:
+            os.close(fd)
+
+    def refresh(self, timestamp):
+        elapsed = timestamp - self.timestamp if self.timestamp is not None else None
+        self.timestamp = timestamp
+
+        processes = {}
+        count = self.count
+        top_cpu = []
+        top_rss = []
+
+        for pid in os.listdir(self.root):
+            if not pid.isdigit():
+                continue
+
+            data = self.read_stat(pid)
+
+            # The process exited between the listing and the read
+            if not data:
+                continue
+
+            # The name is in parentheses and may itself contain spaces and parentheses
+            end = data.rfind(b')')
+            fields = data[end + 2:].split(b' ', 22)
+            start = fields[19]
+
+            process = self.processes.get(pid)
+
+            if process is None or process.start != start:
+                process = Process(pid, data[data.find(b'(') + 1:end], start)
+
+            ticks = int(fields[11]) + int(fields[12])
+
+            if process.ticks is not None and elapsed:
+                process.cpu = (ticks - process.ticks) / CLOCK_TICKS / elapsed * 100
+
+            process.ticks = ticks
+            process.rss = int(fields[21]) * PAGE_SIZE
+            processes[pid] = process
+
+            # The heaps hold the current top processes with the smallest of them first
+            if len(top_cpu) < count:
+                heapq.heappush(top_cpu, (process.cpu, pid, process))
+                heapq.heappush(top_rss, (process.rss, pid, process))
+            else:
+                if process.cpu > top_cpu[0][0]:
+                    heapq.heapreplace(top_cpu, (process.cpu, pid, process))
+
+                if process.rss > top_rss[0][0]:
+                    heapq.heapreplace(top_rss, (process.rss, pid, process))
+
+        self.processes = processes
+        self.top_cpu = [process for value, pid, process in sorted(top_cpu, reverse=True)]
+        self.top_rss = [process for value, pid, process in sorted(top_rss, reverse=True)]
+
+
+class SelfStat:
+    """
+    The monitor's own CPU time, memory use and age, from its /proc stat file kept open.
+    """
+
+    def __init__(self, root='/proc'):
+        self.stat = ProcFile(os.path.join(root, 'self', 'stat'), 1024)
+        self.uptime = ProcFile(os.path.join(root, 'uptime'), 128)
+
+    def fields(self):
+        data = self.stat.read()
+        return data[data.rfind(b')') + 2:].split(b' ', 22)
+
+    def usage(self):
+        """
+        CPU seconds used so far and resident memory in bytes.
+        """
+        fields = self.fields()
+        return (int(fields[11]) + int(fields[12])) / CLOCK_TICKS, int(fields[21]) * PAGE_SIZE
+
+    def age(self):
+        """
+        Seconds since the process started, interpreter startup included.
+        """
+        return float(self.uptime.read().split()[0]) - int(self.fields()[19]) / CLOCK_TICKS
@@ -0,0 +1,173 @@
+import io
+import os
+
+from collections import namedtuple
+
+from monotonic import monotonic
+
+from sampler import Sample
+
+CLOCK_TICKS = float(os.sysconf('SC_CLK_TCK'))
+
+# Field names match the psutil namedtuples so screens can not tell the backends apart
+scputimes = namedtuple('scputimes', 'user nice system idle iowait irq softirq steal guest guest_nice')
+svmem = namedtuple('svmem', 'total available percent used free active inactive buffers cached shared')
+snetio = namedtuple('snetio', 'bytes_sent bytes_recv packets_sent packets_recv errin errout dropin dropout')
+
+MEMINFO_FIELDS = (b'MemTotal', b'MemFree', b'MemAvailable', b'Buffers', b'Cached', b'SReclaimable', b'Shmem',
+                  b'Active', b'Inactive')
+
+
+class ProcFile:
+    """
+    A /proc file that is opened once and re-read from the start into a reusable buffer.
+    """
+
+    def __init__(self, path, size=4096):
+        self.path = path
+        self.file = io.FileIO(path, 'r')
+        self.buffer = bytearray(size)
+
+    def read(self):
+        while True:
+            self.file.seek(0)
+            length = self.file.readinto(self.buffer)
+
+            if length < len(self.buffer):
+                return bytes(self.buffer[:length])
+
+            # The file did not fit, grow the buffer and read it again
+            self.buffer = bytearray(len(self.buffer) * 2)
+
+    def close(self):
+        self.file.close()
+
+
+def cpu_percent(last, current):
+    """
+    Busy percentage between two scputimes, computed the way psutil does it on Linux.
+    """
+    deltas = [max(0, b - a) for a, b in zip(last, current)]
+    total = sum(deltas) - deltas[8] - deltas[9]
+    busy = total - deltas[3] - deltas[4]
+
+    if total <= 0:
+        return 0.0
+
+    return round(busy / total * 100, 1)
+
+
+def usage_percent(used, total):
+    try:
+        return round(float(used) / total * 100, 1)
+    except ZeroDivisionError:
+        return 0.0
+
+
+class ProcBackend:
+    """
+    Samples /proc/stat, /proc/meminfo and /proc/net/dev directly instead of going through psutil.
+
+    The files are kept open and each one is read once per tick, and only the fields the screens use
+    are parsed. Values are the same as the psutil backend, which re-opens and fully parses each file
+    for every call. Kernels older than 3.14 have no MemAvailable, there available memory falls back
+    to free + buffers + cached.
+    """
+
+    def __init__(self, root='/proc', interfaces=None):
+        self.interfaces = set(interfaces) if interfaces is not None else None
+        self.stat = ProcFile(os.path.join(root, 'stat'))
+        self.meminfo = ProcFile(os.path.join(root, 'meminfo'))
+        self.net_dev = ProcFile(os.path.join(root, 'net', 'dev'))
+
+        # Like psutil, the first percentages are measured from when the backend was created
+        self.last_cpu_times, self.last_percpu_times = self.read_cpu_times()
+
+    def read_cpu_times(self):
+        data = self.stat.read()
+
+        # Only the leading cpu lines are of interest, skip the interrupt counters that follow
+        end = data.find(b'\nintr')
+        lines = data[:end if end >= 0 else len(data)].split(b'\n')
+
+        times = []
+        for line in lines:
+            if not line.startswith(b'cpu'):
+                break
+
+            fields = line.split()
+            values = [int(value) / CLOCK_TICKS for value in fields[1:11]]
+            values.extend([0.0] * (10 - len(values)))
+            times.append(scputimes(*values))
+
+        return times[0], times[1:]
+
+    def cpu_times(self):
+        cpu_times, percpu_times = self.read_cpu_times()
+        percent = cpu_percent(self.last_cpu_times, cpu_times)
+        percpu_percent = [cpu_percent(last, current) for last, current in zip(self.last_percpu_times, percpu_times)]
+
+        self.last_cpu_times = cpu_times
+        self.last_percpu_times = percpu_times
+
+        return cpu_times, percent, percpu_percent, percpu_times
+
+    def virtual_memory(self):
+        mems = {}
+
+        for line in self.meminfo.read().split(b'\n'):
+            key, _, value = line.partition(b':')
+
+            if key in MEMINFO_FIELDS:
+                mems[key] = int(value.split()[0]) * 1024
+
+        total = mems[b'MemTotal']
+        free = mems[b'MemFree']
+        buffers = mems.get(b'Buffers', 0)
+        cached = mems.get(b'Cached', 0) + mems.get(b'SReclaimable', 0)
+
+        used = total - free - cached - buffers
+        if used < 0:
+            used = total - free
+
+        available = mems.get(b'MemAvailable', free + buffers + cached)
+        if available < 0:
+            available = 0
+        elif available > total:
+            available = free
+
+        return svmem(total, available, usage_percent(total - available, total), used, free,
+                     mems.get(b'Active', 0), mems.get(b'Inactive', 0), buffers, cached, mems.get(b'Shmem', 0))
+
+    def net_io_counters(self):
+        counters = {}
+
+        # The first two lines are column headers
+        for line in self.net_dev.read().split(b'\n')[2:]:
+            colon = line.rfind(b':')
+
+            if colon < 0:
+                continue
+
+            name = str(line[:colon].strip().decode('ascii'))
+
+            if self.interfaces is not None and name not in self.interfaces:
+                continue
+
+            fields = line[colon + 1:].split()
+            counters[name] = snetio(int(fields[8]), int(fields[0]), int(fields[9]), int(fields[1]),
+                                    int(fields[2]), int(fields[10]), int(fields[3]), int(fields[11]))
+
+        return counters
+
+    def sample(self):
+        timestamp = monotonic()
+        cpu_times, percent, percpu_percent, percpu_times = self.cpu_times()
+
+        return Sample(timestamp, cpu_times, percent, percpu_percent, self.virtual_memory(), self.net_io_counters(),
+                      percpu_times)
+
+    def close(self):
+        self.stat.close()
+        self.meminfo.close()
+        self.net_dev.close()
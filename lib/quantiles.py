@@ -0,0 +1,174 @@
+import math
+
+# Sliding windows quantiles are kept over by default, (seconds, header label)
+WINDOWS = (
+    (600, '10m'),
+    (3600, '1h'),
+    (86400, '24h')
+)
+# Panes a window is split into, the oldest is dropped as a whole so a window spans up to one pane more
+PANES = 4
+# Values closer to zero than this are counted as zero
+FLOOR = 1e-9
+# Keys of negative values sort below the key of zero, which sorts below the keys of positive values
+ZERO_KEY = -(1 << 40)
+NEGATIVE_KEY = -(1 << 41)
+
+
+class Window(object):
+    """
+    The bucket counts of one sliding window: a ring of panes, each counting the samples of its
+    stretch of time, and the running sum of all of them. When time moves past a pane the oldest
+    pane's counts are taken off the sum, so each sample costs two dict updates going in and one
+    coming out.
+    """
+
+    __slots__ = ('length', 'pane_length', 'counts', 'panes', 'highs', 'lows', 'pane', 'start')
+
+    def __init__(self, length, panes=PANES):
+        self.length = length
+        self.pane_length = float(length) / panes
+        self.counts = {}
+        self.panes = [{} for i in range(panes + 1)]
+        self.highs = [None] * (panes + 1)
+        self.lows = [None] * (panes + 1)
+        self.pane = 0
+        self.start = None
+
+    def advance(self, timestamp):
+        steps = int((timestamp - self.start) / self.pane_length)
+
+        # After a long gap every pane is stale, dropping each of them once is enough
+        for i in range(min(steps, len(self.panes))):
+            self.pane = self.pane + 1 if self.pane + 1 < len(self.panes) else 0
+            self.drop(self.pane)
+
+        self.start += steps * self.pane_length
+
+    def drop(self, index):
+        counts = self.counts
+
+        for key, count in self.panes[index].items():
+            left = counts[key] - count
+
+            if left:
+                counts[key] = left
+            else:
+                del counts[key]
+
+        self.panes[index] = {}
+        self.highs[index] = None
+        self.lows[index] = None
+
+    def add(self, key, value, timestamp):
+        if self.start is None:
+            self.start = timestamp
+        elif timestamp - self.start >= self.pane_length:
+            self.advance(timestamp)
+
+        pane = self.panes[self.pane]
+        pane[key] = pane.get(key, 0) + 1
+        self.counts[key] = self.counts.get(key, 0) + 1
+
+        high = self.highs[self.pane]
+        if high is None or value > high:
+            self.highs[self.pane] = value
+
+        low = self.lows[self.pane]
+        if low is None or value < low:
+            self.lows[self.pane] = value
+
+
+class QuantileSketch(object):
+    """
+    Streaming quantiles of one measure over sliding windows, in memory that does not grow with the
+    number of samples.
+
+    Values are counted in logarithmic buckets, bucket k holding (gamma^(k-1), gamma^k] with gamma =
+    (1 + accuracy) / (1 - accuracy), and a quantile is read back as the middle of its bucket, so it
+    is within accuracy of the exact value relative to it (the DDSketch scheme). Unlike P-square
+    estimators bucket counts can be taken off again, which is what lets old samples leave a window.
+    The maximum is exact. Adding a sample takes one logarithm and a few dict updates per window.
+    """
+
+    __slots__ = ('accuracy', 'gamma', 'multiplier', 'windows', 'labels')
+
+    def __init__(self, windows=WINDOWS, accuracy=0.01, panes=PANES):
+        self.accuracy = accuracy
+        self.gamma = (1 + accuracy) / (1 - accuracy)
+        self.multiplier = 1 / math.log(self.gamma)
+        self.windows = [Window(length, panes) for length, label in windows]
+        self.labels = [label for length, label in windows]
+
+    def key(self, value):
+        if value > FLOOR:
+            return int(math.ceil(math.log(value) * self.multiplier))
+
+        if value < -FLOOR:
+            return NEGATIVE_KEY - int(math.ceil(math.log(-value) * self.multiplier))
+
+        return ZERO_KEY
+
+    def value(self, key):
+        if key == ZERO_KEY:
+            return 0.0
+
+        if key > ZERO_KEY:
+            return 2 * self.gamma ** key / (self.gamma + 1)
+
+        return -2 * self.gamma ** (NEGATIVE_KEY - key) / (self.gamma + 1)
+
+    def add(self, value, timestamp):
+        key = self.key(value)
+
+        for window in self.windows:
+            window.add(key, value, timestamp)
+
+    def quantiles(self, index, percents=(50, 95, 99)):
+        """
+        Nearest-rank percentiles of window index, ascending percents, followed by its maximum. None
+        while the window is empty.
+        """
+        window = self.windows[index]
+
+        # Taken as lists in one go, the collector may be adding to the window meanwhile
+        items = sorted(window.counts.items())
+        highs = [high for high in list(window.highs) if high is not None]
+        lows = [low for low in list(window.lows) if low is not None]
+        count = sum(count for key, count in items)
+
+        if not count or not highs:
+            return None
+
+        high = max(highs)
+        low = min(lows)
+        ranks = [min(count - 1, int(count * percent / 100.0)) for percent in percents]
+        results = []
+        seen = 0
+
+        for key, count in items:
+            seen += count
+
+            # The middle of a bucket may lie beyond the values actually seen
+            while len(results) < len(ranks) and ranks[len(results)] < seen:
+                results.append(min(max(self.value(key), low), high))
+
+            if len(results) == len(ranks):
+                break
+
+        return results + [high]
+
+
+class QuantileWindows:
+    """
+    The windows and accuracy screens keep quantile sketches with, from [quantiles] in config.cfg.
+    """
+
+    def __init__(self, windows=WINDOWS, accuracy=0.01, panes=PANES):
+        self.windows = windows
+        self.accuracy = accuracy
+        self.panes = panes
+        self.labels = [label for length, label in windows]
+
+    def sketch(self):
+        return QuantileSketch(self.windows, self.accuracy, self.panes)
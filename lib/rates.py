@@ -0,0 +1,73 @@
+class FixedRate:
+    """
+    Collects every screen at the interval it was registered with.
+    """
+
+    def update(self, screen, now):
+        pass
+
+    def interval(self, screen, now):
+        return screen.interval
+
+
+class AdaptiveRate:
+    """
+    Speeds up the visible screens while their values change quickly and slows down the others.
+
+    visible returns the screens on show, one per display. A visible screen whose values moved by more
+    than threshold of their range in the last sample is collected every fast_interval seconds, and
+    stays fast for hold seconds after it calms down. Hidden screens, and visible ones that stayed flat
+    for flat_time seconds, drop to slow_interval. Anything else runs at its configured interval.
+    """
+
+    def __init__(self, visible, fast_interval=0.25, slow_interval=5, threshold=0.1, flat_time=60, hold=5):
+        self.visible = visible
+        self.fast_interval = fast_interval
+        self.slow_interval = slow_interval
+        self.threshold = threshold
+        self.flat_time = flat_time
+        self.hold = hold
+        self.changed = {}
+
+    def update(self, screen, now):
+        """
+        Looks at the sample the screen just collected.
+        """
+        if screen.change() >= self.threshold or screen not in self.changed:
+            self.changed[screen] = now
+
+    def interval(self, screen, now):
+        if screen not in self.visible():
+            return max(screen.interval, self.slow_interval)
+
+        quiet = now - self.changed.get(screen, now)
+
+        if quiet <= self.hold:
+            return min(screen.interval, self.fast_interval)
+
+        if quiet >= self.flat_time:
+            return max(screen.interval, self.slow_interval)
+
+        return screen.interval
+
+
+class IdleRate:
+    """
+    Slows every screen down to idle_interval while the display is blanked, otherwise defers to policy.
+    """
+
+    def __init__(self, policy, idle_interval, idle):
+        self.policy = policy
+        self.idle_interval = idle_interval
+        self.idle = idle
+
+    def update(self, screen, now):
+        self.policy.update(screen, now)
+
+    def interval(self, screen, now):
+        interval = self.policy.interval(screen, now)
+
+        if self.idle():
+            return max(interval, self.idle_interval)
+
+        return interval
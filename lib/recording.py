@@ -0,0 +1,489 @@
+import os
+import struct
+import time
+import zlib
+
+from monotonic import monotonic
+
+from procfs import scputimes
+from procfs import snetio
+from procfs import svmem
+from sampler import Sample
+from sampler import Sampler
+
+MAGIC = b'PMTR'
+VERSION = 3
+
+# magic, format version
+FILE_HEADER = struct.Struct('<4sH')
+# payload length, crc32 of the payload
+RECORD_HEADER = struct.Struct('<HI')
+# payload length again, so the last record can be found from the end of the file
+RECORD_TRAILER = struct.Struct('<H')
+MAX_RECORD = RECORD_HEADER.size + 0xffff + RECORD_TRAILER.size
+
+# A key record holds every value, a delta record the change of every value since the record before
+KEY = 0
+DELTA = 1
+# kind, timestamp, CPU percent, CPU times and memory, one byte each at the least
+MIN_PAYLOAD = 1 + 1 + 1 + len(scputimes._fields) + len(svmem._fields)
+
+
+def tenths(value):
+    return int(round(value * 10))
+
+
+def hundredths(values):
+    return [int(round(value * 100)) for value in values]
+
+
+def pack_varints(values, parts):
+    """
+    Appends each value as a zigzag varint: 7 bits a byte, the sign in the lowest bit, so small changes
+    either way take a byte or two.
+    """
+    for value in values:
+        value = value << 1 if value >= 0 else (-value << 1) - 1
+
+        while value >= 0x80:
+            parts.append(chr(value & 0x7f | 0x80))
+            value >>= 7
+
+        parts.append(chr(value))
+
+
+def unpack_varints(data, offset, count):
+    values = []
+
+    for i in range(count):
+        value = 0
+        shift = 0
+
+        while True:
+            byte = ord(data[offset])
+            offset += 1
+            value |= (byte & 0x7f) << shift
+            shift += 7
+
+            if byte < 0x80:
+                break
+
+        values.append(value >> 1 if not value & 1 else -((value + 1) >> 1))
+
+    return values, offset
+
+
+def flatten(sample):
+    """
+    A sample as its layout, the core count and interface names, and a list of integers: the timestamp
+    in microseconds, percentages in tenths and CPU times in hundredths of a second, as the kernel
+    counts them in ticks of 1/100s.
+    """
+    names = tuple(sorted(sample.net_io))
+    memory = sample.virtual_memory
+    values = [int(round(sample.timestamp * 1e6)), tenths(sample.cpu_percent)] + hundredths(sample.cpu_times)
+
+    for percent, times in zip(sample.cpu_percent_percpu, sample.cpu_times_percpu):
+        values.append(tenths(percent))
+        values.extend(hundredths(times))
+
+    values.extend((memory.total, memory.available, tenths(memory.percent), memory.used, memory.free, memory.active,
+                   memory.inactive, memory.buffers, memory.cached, memory.shared))
+
+    for name in names:
+        values.extend(sample.net_io[name])
+
+    return (len(sample.cpu_times_percpu), names), values
+
+
+def encode(sample, previous=None):
+    """
+    Packs a sample into a record's payload, as the change from previous, the (layout, values) the
+    record before was encoded from, when the cores and interfaces are the same. Returns the payload
+    and what the next record is encoded against. A sample of four cores and three interfaces takes
+    about 160 bytes as a key and 80 to 130 as a delta, down from 640 with a fixed field per value.
+    """
+    layout, values = flatten(sample)
+
+    if previous is not None and previous[0] == layout:
+        parts = [chr(DELTA)]
+        pack_varints([value - before for value, before in zip(values, previous[1])], parts)
+    else:
+        cores, names = layout
+        parts = [chr(KEY), chr(cores), chr(len(names))]
+
+        for name in names:
+            parts.append(chr(len(name)) + name)
+
+        pack_varints(values, parts)
+
+    return b''.join(parts), (layout, values)
+
+
+def decode(data, previous=None):
+    """
+    Unpacks a record's payload back into a Sample, with previous the (layout, values) of the record
+    before. Returns the sample and what the next record is decoded against, raises ValueError when
+    the payload does not add up.
+    """
+    try:
+        kind = ord(data[0])
+
+        if kind == DELTA:
+            if previous is None:
+                raise ValueError('delta record without a record before it')
+
+            layout = previous[0]
+            changes, offset = unpack_varints(data, 1, len(previous[1]))
+            values = [before + change for before, change in zip(previous[1], changes)]
+        elif kind == KEY:
+            cores, count = ord(data[1]), ord(data[2])
+            offset = 3
+            names = []
+
+            for i in range(count):
+                length = ord(data[offset])
+                names.append(data[offset + 1:offset + 1 + length])
+                offset += 1 + length
+
+            layout = (cores, tuple(names))
+            values, offset = unpack_varints(data, offset, 2 + len(scputimes._fields) * (1 + cores) + cores +
+                                            len(svmem._fields) + len(snetio._fields) * count)
+        else:
+            raise ValueError('unknown record kind %s' % kind)
+    except IndexError:
+        raise ValueError('truncated sample record')
+
+    if offset != len(data):
+        raise ValueError('sample record length does not match its contents')
+
+    cores, names = layout
+    fields = len(scputimes._fields)
+    cpu_times = scputimes(*[value / 100.0 for value in values[2:2 + fields]])
+    offset = 2 + fields
+
+    percpu_percent = []
+    percpu_times = []
+
+    for i in range(cores):
+        percpu_percent.append(values[offset] / 10.0)
+        percpu_times.append(scputimes(*[value / 100.0 for value in values[offset + 1:offset + 1 + fields]]))
+        offset += 1 + fields
+
+    memory = values[offset:offset + len(svmem._fields)]
+    memory[2] /= 10.0
+    offset += len(svmem._fields)
+
+    net_io = {}
+
+    for name in names:
+        net_io[name] = snetio(*values[offset:offset + len(snetio._fields)])
+        offset += len(snetio._fields)
+
+    sample = Sample(values[0] / 1e6, cpu_times, values[1] / 10.0, percpu_percent, svmem(*memory), net_io,
+                    percpu_times)
+
+    return sample, (layout, values)
+
+
+def pack_record(payload):
+    return b''.join((RECORD_HEADER.pack(len(payload), zlib.crc32(payload) & 0xffffffff), payload,
+                     RECORD_TRAILER.pack(len(payload))))
+
+
+def records(trace):
+    """
+    Yields the payload of every intact record read from a trace file, from where it is positioned on,
+    stopping at the first one that is torn or corrupt.
+    """
+    while True:
+        header = trace.read(RECORD_HEADER.size)
+
+        if len(header) != RECORD_HEADER.size:
+            return
+
+        length, crc = RECORD_HEADER.unpack(header)
+        payload = trace.read(length)
+
+        if len(payload) != length or zlib.crc32(payload) & 0xffffffff != crc or \
+                trace.read(RECORD_TRAILER.size) != RECORD_TRAILER.pack(length):
+            return
+
+        yield payload
+
+
+def last_record_end(trace, size, path):
+    """
+    Where the last intact record of a trace file ends. The last record is found from its trailer and
+    checked, a torn record after it is no longer than a record, so otherwise every end within the
+    last two records' worth of the file is tried.
+    """
+    start = max(FILE_HEADER.size, size - 2 * MAX_RECORD)
+    trace.seek(start)
+    tail = trace.read()
+
+    for end in range(len(tail), -1, -1):
+        if start + end == FILE_HEADER.size:
+            return FILE_HEADER.size
+
+        begin = end - RECORD_TRAILER.size - RECORD_HEADER.size
+
+        if begin < 0:
+            continue
+
+        length, = RECORD_TRAILER.unpack_from(tail, end - RECORD_TRAILER.size)
+        begin -= length
+
+        if begin < 0 or length < MIN_PAYLOAD:
+            continue
+
+        stored, crc = RECORD_HEADER.unpack_from(tail, begin)
+        payload = tail[begin + RECORD_HEADER.size:begin + RECORD_HEADER.size + length]
+
+        if stored == length and zlib.crc32(payload) & 0xffffffff == crc:
+            return start + end
+
+    raise ValueError('%s is corrupt before its last record' % path)
+
+
+def check_header(data, path):
+    if data != FILE_HEADER.pack(MAGIC, VERSION):
+        raise ValueError('%s is not a trace of this version' % path)
+
+
+class TraceWriter:
+    """
+    Appends samples to a trace file, one record with a length and a crc32 per sample. Each file
+    starts with a key record, the records after it hold the change since the one before.
+
+    Every record goes out in a single write() to a file opened for appending. A writer killed in the
+    middle of one leaves a torn record at the end, which is cut off when the file is opened for
+    appending again, so a trace can be recorded over several runs. Only the end of the file is read
+    for that, however long the trace.
+
+    With a size limit a trace that would grow past it is renamed to path.1, replacing the one before,
+    and a new trace is started, so the recording never takes more than twice the limit.
+    """
+
+    def __init__(self, path, size_limit=0):
+        self.path = path
+        self.size_limit = size_limit
+        self.records = 0
+        self.bytes = 0
+        self.errors = 0
+        self.rotations = 0
+        self.open()
+
+    def open(self):
+        self.fd = os.open(self.path, os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o644)
+        self.size = os.fstat(self.fd).st_size
+        # The records already in the file are not read back, the next one is a key record
+        self.previous = None
+
+        if not self.size:
+            os.write(self.fd, FILE_HEADER.pack(MAGIC, VERSION))
+            self.size = FILE_HEADER.size
+            return
+
+        with open(self.path, 'rb') as trace:
+            check_header(trace.read(FILE_HEADER.size), self.path)
+            end = last_record_end(trace, self.size, self.path)
+
+        if end < self.size:
+            os.ftruncate(self.fd, end)
+            self.size = end
+
+    def rotate(self):
+        os.close(self.fd)
+        os.rename(self.path, self.path + '.1')
+        self.open()
+        self.rotations += 1
+
+    def write(self, sample):
+        payload, previous = encode(sample, self.previous)
+        record = pack_record(payload)
+
+        try:
+            if self.size_limit and self.size > FILE_HEADER.size and self.size + len(record) > self.size_limit:
+                self.rotate()
+                payload, previous = encode(sample)
+                record = pack_record(payload)
+
+            os.write(self.fd, record)
+        except OSError:
+            # A full card must not stop the monitor, the sample is left out of the trace
+            self.errors += 1
+            return
+
+        self.previous = previous
+        self.records += 1
+        self.bytes += len(record)
+        self.size += len(record)
+
+    def close(self):
+        os.close(self.fd)
+
+
+class TraceReader:
+    """
+    The samples of a trace file, in the order they were recorded.
+
+    The timestamps come from the recording machine's monotonic clock, which starts over when it
+    reboots, so when they go back the samples after it are shifted to follow on a second later.
+
+    The records are read as they are iterated over, so a trace of any length takes the memory of one
+    sample, and every iteration reads the file afresh.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.torn = False
+
+        with open(path, 'rb') as trace:
+            check_header(trace.read(FILE_HEADER.size), path)
+
+    def __iter__(self):
+        shift = 0.0
+        last = None
+        previous = None
+
+        with open(self.path, 'rb') as trace:
+            trace.seek(FILE_HEADER.size)
+            end = FILE_HEADER.size
+
+            for payload in records(trace):
+                sample, previous = decode(payload, previous)
+                end = trace.tell()
+
+                if last is not None and sample.timestamp + shift <= last:
+                    shift = last + 1.0 - sample.timestamp
+
+                sample.timestamp += shift
+                last = sample.timestamp
+
+                yield sample
+
+            # Anything after the last intact record was cut short by the recorder stopping
+            self.torn = end < os.fstat(trace.fileno()).st_size
+
+
+class RecordingBackend:
+    """
+    Passes the samples of another backend through, writing each one to a trace on the way.
+    """
+
+    def __init__(self, backend, writer):
+        self.backend = backend
+        self.writer = writer
+
+    def sample(self):
+        sample = self.backend.sample()
+        self.writer.write(sample)
+
+        return sample
+
+
+class ReplayBackend:
+    """
+    Hands out the samples of a trace one per tick, next is the sample the following tick gets.
+    """
+
+    def __init__(self, samples):
+        self.samples = iter(samples)
+        self.next = next(self.samples, None)
+
+    def sample(self):
+        sample = self.next
+        self.next = next(self.samples, None)
+
+        return sample
+
+
+class TraceReplay:
+    """
+    Feeds a trace to screens on a virtual clock running speed times faster than the recording and
+    renders the visible sub-screen after every sample, the way the monitor renders when the visible
+    screen collects.
+
+    Each sample is due when the virtual clock reaches its timestamp. When the screens and the render
+    cannot keep up the replay falls behind instead of skipping samples, the lag says by how much. A
+    speed of 0 replays as fast as the screens go. With cycle_time set every sub-screen of every screen
+    is shown in turn for that many recorded seconds.
+    """
+
+    def __init__(self, samples, screens, display, speed=100.0, cycle_time=0, clock=monotonic, sleep=time.sleep):
+        self.backend = ReplayBackend(samples)
+        self.sampler = Sampler(backend=self.backend)
+        self.screens = screens
+        self.display = display
+        self.speed = speed
+        self.cycle_time = cycle_time
+        self.clock = clock
+        self.sleep = sleep
+        self.pages = [(screen, index) for screen in screens for index in range(len(screen.screen_config))]
+        self.page = 0
+        self.render_times = []
+        self.lags = []
+
+        for screen in screens:
+            self.sampler.register(screen)
+
+    def show(self, page):
+        self.page = page % len(self.pages)
+        screen, index = self.pages[self.page]
+        screen.screen_index = index
+        screen.show()
+
+    def run(self):
+        if self.backend.next is None:
+            return self.results(0.0, 0)
+
+        first = self.backend.next.timestamp
+        shown = first
+        samples = 0
+        self.show(0)
+
+        start = self.clock()
+
+        while self.backend.next is not None:
+            timestamp = self.backend.next.timestamp
+            now = self.clock()
+            due = start + (timestamp - first) / self.speed if self.speed > 0 else now
+
+            if due > now:
+                self.sleep(due - now)
+
+            self.lags.append(max(self.clock() - due, 0.0))
+            self.sampler.tick()
+            samples += 1
+
+            if self.cycle_time > 0 and timestamp - shown >= self.cycle_time:
+                shown = timestamp
+                self.show(self.page + 1)
+
+            screen, index = self.pages[self.page]
+            began = self.clock()
+            screen.render(self.display)
+            self.render_times.append(self.clock() - began)
+
+        return self.results(self.clock() - start, samples)
+
+    def results(self, seconds, samples):
+        times = sorted(self.render_times)
+        lags = sorted(self.lags)
+
+        def percentile(values, percent):
+            return values[min(len(values) - 1, int(len(values) * percent / 100.0))] * 1000 if values else 0.0
+
+        return {
+            'samples': samples,
+            'frames': len(times),
+            'seconds': seconds,
+            'fps': len(times) / seconds if seconds > 0 else 0.0,
+            'render_p50_ms': percentile(times, 50),
+            'render_p95_ms': percentile(times, 95),
+            'render_p99_ms': percentile(times, 99),
+            'render_max_ms': times[-1] * 1000 if times else 0.0,
+            'lag_p99_ms': percentile(lags, 99),
+            'lag_max_ms': lags[-1] * 1000 if lags else 0.0
+        }
@@ -1,7 +1,15 @@
 import math
 
+from PIL import Image
+from PIL import ImageDraw
+
+from framebuffer import FrameBuffer
+from glyphs import text_cache
+
+
+class RendererConfig(object):
+    __slots__ = ('renderer', 'measure', 'name', 'x_start', 'x_step')
 
-class RendererConfig:
     def __init__(self, renderer, measure, name, x_start=0, x_step=1):
         self.renderer = renderer
         self.measure = measure
@@ -10,11 +18,106 @@ class RendererConfig:
         self.x_step = x_step
 
 
+class ScrollingChart:
+    """
+    Off-screen bitmap holding the bars of a screen's time-series chart.
+
+    The chart is split into lanes, one per series, each owning a box of the bitmap. When new samples
+    arrive a lane is shifted by x_step pixels per sample and only the newest bars are drawn into the
+    vacated strip. Everything is redrawn when the key passed to begin() changes, which renderers use
+    for the sub-screen and the autoscale maximum.
+
+    With framebuffer set the bitmap is a FrameBuffer, for screens drawing into one.
+    """
+
+    def __init__(self, size, framebuffer=False):
+        if framebuffer:
+            self.image = self.draw = FrameBuffer(*size)
+        else:
+            self.image = Image.new('1', size)
+            self.draw = ImageDraw.Draw(self.image)
+        self.key = None
+        self.lanes = {}
+
+    def invalidate(self):
+        self.key = None
+
+    def begin(self, key):
+        if key != self.key:
+            self.key = key
+            self.lanes = {}
+            self.draw.rectangle([(0, 0), self.image.size], fill=0)
+
+    def pending(self, lane, box, series, x_step):
+        """
+        Brings a lane up to date with its series and returns how many of the newest values have to be
+        drawn.
+        """
+        last = self.lanes.get(lane)
+        self.lanes[lane] = series.appended
+
+        if last is None or series.appended - last >= len(series):
+            self.draw.rectangle(box, fill=0)
+            return len(series)
+
+        count = series.appended - last
+
+        if count > 0:
+            self.scroll(box, count * x_step)
+
+        return count
+
+    def scroll(self, box, dx):
+        if isinstance(self.image, FrameBuffer):
+            self.image.scroll(box, dx)
+            return
+
+        left, top, right, bottom = box
+
+        if dx < 0:
+            region = self.image.crop((left - dx, top, right + 1, bottom + 1))
+            self.image.paste(region, (left, top))
+            self.draw.rectangle([(right + 1 + dx, top), (right, bottom)], fill=0)
+        else:
+            region = self.image.crop((left, top, right + 1 - dx, bottom + 1))
+            self.image.paste(region, (left + dx, top))
+            self.draw.rectangle([(left, top), (left + dx - 1, bottom)], fill=0)
+
+    def paste(self, draw):
+        draw.bitmap((0, 0), self.image, fill="white")
+
+
+def bar_box(config, capacity, top, bottom, bar_width=2):
+    x_end = config.x_start + (capacity - 1) * config.x_step
+
+    return max(min(config.x_start, x_end) - bar_width, 0), top, max(config.x_start, x_end), bottom
+
+
+def draw_bars(target, x_start, x_step, base, heights, width=3, up=True):
+    """
+    Draws bars growing up or down from row base over the columns x - width + 1 to x, the first at
+    x_start and each next one x_step further. A FrameBuffer fills all of them at once.
+    """
+    if isinstance(target, FrameBuffer):
+        target.bars(x_start, x_step, base, heights, width, up)
+        return
+
+    x = x_start
+    for height in heights:
+        if width == 1:
+            target.line([(x, base), (x, base - height if up else base + height)], fill="white", width=1)
+        else:
+            target.rectangle([(x, base), (x - width + 1, base - height if up else base + height)], fill="white",
+                             outline=None)
+
+        x = x + x_step
+
+
 class Renderer:
     def __init__(self):
         pass
 
-    def render(self, draw, config, data):
+    def render(self, draw, config, data, chart=None):
         raise NotImplementedError
 
 
@@ -23,18 +126,18 @@ class BarRenderer(Renderer):
         Renderer.__init__(self)
 
     def render(self, draw, config, data, data_function=None, header_function=None, count_function=None,
-               render_max=True):
+               render_max=True, chart=None):
         if header_function is not None:
             header = header_function(config, data)
         else:
             header = config.name
 
-        draw.text((1, 0), header, fill="white")
+        text_cache.text(draw, (1, 0), header)
         draw.line([(0, 11), (128, 11)], fill="white", width=1)
         draw.line([(2, 63), (126, 63)], fill="white", width=1)
 
         if count_function is None:
-            max_count = float(max(max(data[config.measure]), 100))
+            max_count = float(max(data[config.measure].maximum(), 100))
         else:
             max_count = count_function(config, data)
 
@@ -43,16 +146,23 @@ class BarRenderer(Renderer):
         else:
             measures = data[config.measure]
 
-        x = config.x_start
-        for i, measure in reversed(list(enumerate(measures))):
-            height = math.ceil(50 * (measure / max_count))
-            draw.rectangle([(x, 63), (x - 2, 63 - height)], fill="white", outline=None)
-            x = x + config.x_step
+        target = draw
+        count = None
+
+        if chart is not None:
+            chart.begin((config, max_count))
+            target = chart.draw
+            count = chart.pending(0, bar_box(config, measures.capacity, 12, 63), measures, config.x_step)
+
+        draw_bars(target, config.x_start, config.x_step, 63, measures.heights(50, max_count, count))
+
+        if chart is not None:
+            chart.paste(draw)
 
         if render_max:
-            count = '%g' % max_count
-            draw.rectangle([(1, 12), (6 * len(count), 22)], fill="black", outline="black")
-            draw.text((1, 13), count, fill="white")
+            bitmap = text_cache.get('%g' % max_count)
+            draw.rectangle([(1, 12), (bitmap.size[0], 22)], fill="black", outline="black")
+            draw.bitmap((1, 13), bitmap, fill="white")
 
 
 class LabeledBarRenderer(Renderer):
@@ -63,7 +173,7 @@ class LabeledBarRenderer(Renderer):
         else:
             header = config.name
 
-        draw.text((1, 0), header, fill="white")
+        text_cache.text(draw, (1, 0), header)
         draw.line([(0, 11), (128, 11)], fill="white", width=1)
         draw.line([(0, 63 - 10), (128, 63 - 10)], fill="white", width=1)
 
@@ -87,16 +197,98 @@ class LabeledBarRenderer(Renderer):
             value = measures[key]
             width = bar_width / 2
             height = math.ceil(42 * (sum(value) / max_count))
-            midpoint = x - 1 + (6 * len(key)) / 2
-            draw.text((x, 63 - 10), key, fill="white")
+            key_width, key_height = text_cache.text(draw, (x, 63 - 10), key)
+            midpoint = x - 1 + key_width / 2
             draw.rectangle([(midpoint - width, 63 - 10), (midpoint + width, 63 - 10 - height)], fill="white",
                            outline=None)
             x = x + config.x_step
 
         if render_max:
-            count = '%g' % max_count
-            draw.rectangle([(1, 12), (6 * len(count), 22)], fill="black", outline="black")
-            draw.text((1, 13), count, fill="white")
+            bitmap = text_cache.get('%g' % max_count)
+            draw.rectangle([(1, 12), (bitmap.size[0], 22)], fill="black", outline="black")
+            draw.bitmap((1, 13), bitmap, fill="white")
+
+
+class ListRenderer(Renderer):
+    """
+    Draws rows of a label with its value right aligned and a bar under it showing its share of the top.
+
+    data[config.measure] holds (label, value, fraction) tuples, one per row.
+    """
+
+    def __init__(self, row_height=10):
+        Renderer.__init__(self)
+        self.row_height = row_height
+
+    def render(self, draw, config, data, header_function=None, chart=None):
+        if header_function is not None:
+            header = header_function(config, data)
+        else:
+            header = config.name
+
+        text_cache.text(draw, (1, 0), header)
+        draw.line([(0, 11), (128, 11)], fill="white", width=1)
+
+        y = 13
+        for label, value, fraction in data[config.measure]:
+            if y + self.row_height > 64:
+                break
+
+            text_cache.text(draw, (1, y - 1), label)
+
+            # Long labels run under the value, blank them out behind it
+            bitmap = text_cache.get(value)
+            x = 127 - bitmap.size[0]
+            draw.rectangle([(x - 3, y), (127, y + self.row_height - 2)], fill="black", outline="black")
+            draw.bitmap((x, y - 1), bitmap, fill="white")
+
+            draw.line([(1, y + self.row_height - 1), (1 + int(round(126 * fraction)), y + self.row_height - 1)],
+                      fill="white", width=1)
+            y += self.row_height
+
+
+class FleetRenderer(Renderer):
+    """
+    Draws one bar per node, scaled to 100. With more nodes than columns neighbouring nodes share a
+    column showing the highest of them, nodes that stopped reporting are a dot at the top.
+
+    data[config.measure] holds one value per node, None for the nodes that are down.
+    """
+
+    def __init__(self):
+        Renderer.__init__(self)
+
+    def render(self, draw, config, data, header_function=None, chart=None):
+        if header_function is not None:
+            header = header_function(config, data)
+        else:
+            header = config.name
+
+        text_cache.text(draw, (1, 0), header)
+        draw.line([(0, 11), (128, 11)], fill="white", width=1)
+        draw.line([(2, 63), (126, 63)], fill="white", width=1)
+
+        values = data[config.measure]
+        columns = min(len(values), 124)
+
+        for column in range(columns):
+            group = [value for value in values[column * len(values) // columns:(column + 1) * len(values) // columns]
+                     if value is not None]
+            left = 2 + column * 124 // columns
+            right = 2 + (column + 1) * 124 // columns - 1
+
+            # Leave a gap between bars when there is room for one
+            if right - left >= 2:
+                right -= 1
+
+            if not group:
+                draw.point((left, 13), fill="white")
+                continue
+
+            height = int(math.ceil(min(max(group), 100) / 2.0))
+
+            if height:
+                draw.rectangle([(left, 63 - height), (right, 63)], fill="white", outline=None)
 
 
 class UpDownRenderer(Renderer):
@@ -104,58 +296,85 @@ class UpDownRenderer(Renderer):
         Renderer.__init__(self)
 
     def render(self, draw, config, data, render_max=True, count_function=None, header_function=None, up_mesasure='in',
-               down_measure='out', min_value=1024):
+               down_measure='out', min_value=1024, chart=None):
         if header_function is not None:
             header = header_function(config, data)
         else:
             header = config.name
 
-        draw.text((1, 0), "%s" % header, fill="white")
+        text_cache.text(draw, (1, 0), "%s" % header)
         draw.line([(0, 11), (128, 11)], fill="white", width=1)
         draw.line([(2, 38), (126, 38)], fill="white", width=1)
 
         if count_function is not None:
             max_count = count_function(config, data)
         else:
-            max_count = float(max(max(data[config.measure][up_mesasure]), max(data[config.measure][down_measure]),
+            max_count = float(max(data[config.measure][up_mesasure].maximum(),
+                                  data[config.measure][down_measure].maximum(),
                                   min_value))
 
-        x = config.x_start
-        for i, measure in reversed(list(enumerate(data[config.measure][up_mesasure]))):
-            up_height = math.ceil(25 * float(measure / max_count))
-            draw.rectangle([(x, 38), (x - 2, 38 - up_height)], fill="white", outline=None)
+        up_measures = data[config.measure][up_mesasure]
+        down_measures = data[config.measure][down_measure]
+        target = draw
+        up_count = None
+        down_count = None
 
-            x = x + config.x_step
+        if chart is not None:
+            chart.begin((config, max_count))
+            target = chart.draw
+            up_count = chart.pending(0, bar_box(config, up_measures.capacity, 12, 38), up_measures, config.x_step)
+            down_count = chart.pending(1, bar_box(config, down_measures.capacity, 39, 63), down_measures,
+                                       config.x_step)
 
-        x = config.x_start
-        for i, measure in reversed(list(enumerate(data[config.measure][down_measure]))):
-            down_height = math.ceil(25 * float(measure / max_count))
-            draw.rectangle([(x, 38), (x - 2, 38 + down_height)], fill="white", outline=None)
+        draw_bars(target, config.x_start, config.x_step, 38, up_measures.heights(25, max_count, up_count))
+        draw_bars(target, config.x_start, config.x_step, 38, down_measures.heights(25, max_count, down_count), up=False)
 
-            x = x + config.x_step
+        if chart is not None:
+            chart.paste(draw)
 
         if render_max:
-            draw.rectangle([(1, 12), (6 * len(config.name), 22)], fill="black", outline="black")
-            draw.text((1, 13), config.name, fill="white")
+            bitmap = text_cache.get(config.name)
+            draw.rectangle([(1, 12), (bitmap.size[0], 22)], fill="black", outline="black")
+            draw.bitmap((1, 13), bitmap, fill="white")
 
 
 class QuadCpuRenderer(Renderer):
     def __init__(self):
         Renderer.__init__(self)
 
-    def render(self, draw, config, data):
+    def render(self, draw, config, data, chart=None):
         vertexes = [(0, 31), (65, 31), (0, 63), (65, 63)]
+        target = draw
+
+        if chart is not None:
+            chart.begin(config)
+            target = chart.draw
 
         for i, vertex in enumerate(vertexes):
             draw.line([(vertex[0] + 1, vertex[1]), (vertex[0] + 62, vertex[1])], fill="white", width=1)
 
-            x = vertex[0] + 62
-            for measure in reversed(list(data[config.measure][i])):
-                height = math.ceil(30 * measure / 100)
-                draw.line([(x, vertex[1]), (x, vertex[1] - height)], fill="white", width=1)
-                x = x - 1
+            measures = data[config.measure][i]
+            count = None
+
+            if chart is not None:
+                box = (vertex[0] + 1, vertex[1] - 30, vertex[0] + 62, vertex[1])
+                count = chart.pending(i, box, measures, -1)
+
+            draw_bars(target, vertex[0] + 62, -1, vertex[1], measures.heights(30, 100, count), width=1)
 
-            text = '%.2f%%' % data[config.measure][i][-1]
-            draw.rectangle([(vertex[0], vertex[1] - 31), (vertex[0] + (6 * len(text)), vertex[1] - 31 + 10)],
+        if chart is not None:
+            chart.paste(draw)
+
+        for i, vertex in enumerate(vertexes):
+            bitmap = text_cache.get('%.2f%%' % data[config.measure][i].newest())
+            draw.rectangle([(vertex[0], vertex[1] - 31), (vertex[0] + bitmap.size[0], vertex[1] - 31 + 10)],
                            fill="black", outline="black")
-            draw.text((vertex[0] + 1, vertex[1] - 31), text, fill="white")
+            draw.bitmap((vertex[0] + 1, vertex[1] - 31), bitmap, fill="white")
+
+
+# Renderers keep no state between frames, every screen shares these
+bar_renderer = BarRenderer()
+fleet_renderer = FleetRenderer()
+list_renderer = ListRenderer()
+quad_cpu_renderer = QuadCpuRenderer()
+up_down_renderer = UpDownRenderer()
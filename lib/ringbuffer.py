@@ -0,0 +1,133 @@
+import math
+
+from array import array
+
+
+class RingBuffer(object):
+    """
+    A fixed-capacity series of floats stored in a preallocated array.
+
+    The running maximum and minimum are kept up to date as values are appended, a rescan of the
+    window only happens when the value being evicted was the current extreme. Every screen holds
+    dozens of these, slots keep each one down to its array.
+    """
+
+    __slots__ = ('capacity', 'values', 'start', 'count', 'appended', 'max_value', 'min_value')
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.values = array('d', [0.0]) * capacity
+        self.start = 0
+        self.count = 0
+        self.appended = 0
+        self.max_value = None
+        self.min_value = None
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        for i in range(self.count):
+            yield self.values[(self.start + i) % self.capacity]
+
+    def __reversed__(self):
+        for i in range(self.count - 1, -1, -1):
+            yield self.values[(self.start + i) % self.capacity]
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self.count
+
+        if index < 0 or index >= self.count:
+            raise IndexError('ring buffer index out of range')
+
+        return self.values[(self.start + index) % self.capacity]
+
+    def __repr__(self):
+        return 'RingBuffer(%s, capacity=%s)' % (list(self), self.capacity)
+
+    def append(self, value):
+        value = float(value)
+        self.appended += 1
+
+        if self.count < self.capacity:
+            self.values[(self.start + self.count) % self.capacity] = value
+            self.count += 1
+            evicted = None
+        else:
+            evicted = self.values[self.start]
+            self.values[self.start] = value
+            self.start = (self.start + 1) % self.capacity
+
+        if evicted is not None and (evicted == self.max_value or evicted == self.min_value):
+            self.rescan()
+            return
+
+        if self.max_value is None or value > self.max_value:
+            self.max_value = value
+
+        if self.min_value is None or value < self.min_value:
+            self.min_value = value
+
+    def clear(self):
+        # Bump the append counter past a full window so anything tracking it sees every value as new
+        self.appended += self.capacity
+        self.start = 0
+        self.count = 0
+        self.max_value = None
+        self.min_value = None
+
+    def load(self, values, start, count):
+        """
+        Replaces the contents with a saved window, as produced by the values/start/count attributes.
+        """
+        self.values[:] = array('d', values)
+        self.start = start
+        self.count = count
+
+        # Everything is new to anyone tracking appends
+        self.appended += self.capacity
+        self.rescan()
+
+    def rescan(self):
+        if self.count == 0:
+            self.max_value = None
+            self.min_value = None
+        elif self.count < self.capacity:
+            window = self.values[:self.count]
+            self.max_value = max(window)
+            self.min_value = min(window)
+        else:
+            self.max_value = max(self.values)
+            self.min_value = min(self.values)
+
+    def maximum(self):
+        return self.max_value
+
+    def minimum(self):
+        return self.min_value
+
+    def newest(self):
+        # Headers read the newest value before the first sample of a time scale has landed
+        if self.count == 0:
+            return 0.0
+
+        return self[-1]
+
+    def heights(self, scale, max_count, count=None):
+        """
+        Scales the window to bar heights in one pass, newest value first, which is the order the
+        renderers walk the x axis in. When count is given only that many of the newest values are
+        scaled.
+        """
+        factor = scale / float(max_count)
+        ceil = math.ceil
+
+        if count is None or count > self.count:
+            count = self.count
+
+        values = self.values
+        capacity = self.capacity
+        newest = self.start + self.count - 1
+
+        return array('i', [int(ceil(values[(newest - i) % capacity] * factor)) for i in range(count)])
@@ -0,0 +1,270 @@
+import os
+import select
+import threading
+import traceback
+
+from monotonic import monotonic
+
+from metrics import SAMPLER_JITTER
+from rates import FixedRate
+from utils import wake_up
+from utils import wakeup_pipe
+
+
+class Sample:
+    """
+    A snapshot of the system counters taken once per tick and shared by every registered screen.
+
+    The timestamp is read from the monotonic clock when the snapshot was taken, so screens can turn
+    counter deltas into rates even when a tick runs late. The percentages cover the time since the
+    previous snapshot, screens collecting at their own rate work from the CPU times instead.
+    """
+
+    def __init__(self, timestamp, cpu_times, cpu_percent, cpu_percent_percpu, virtual_memory, net_io,
+                 cpu_times_percpu):
+        self.timestamp = timestamp
+        self.cpu_times = cpu_times
+        self.cpu_percent = cpu_percent
+        self.cpu_percent_percpu = cpu_percent_percpu
+        self.virtual_memory = virtual_memory
+        self.net_io = net_io
+        self.cpu_times_percpu = cpu_times_percpu
+
+
+class PsutilBackend:
+    """
+    Takes the snapshots through psutil, which is only imported when this backend is used.
+    """
+
+    def __init__(self):
+        import psutil
+        self.psutil = psutil
+
+    def sample(self):
+        psutil = self.psutil
+
+        return Sample(monotonic(),
+                      psutil.cpu_times(percpu=False),
+                      psutil.cpu_percent(interval=None),
+                      psutil.cpu_percent(interval=None, percpu=True),
+                      psutil.virtual_memory(),
+                      psutil.net_io_counters(pernic=True),
+                      psutil.cpu_times(percpu=True))
+
+
+class Sampler:
+    """
+    Takes snapshots of the system and hands them to the registered screens, each at its own rate.
+
+    Every screen is scheduled against the monotonic clock as previous slot + interval, so the time
+    spent sampling and collecting does not accumulate as drift. When a slot is missed entirely the
+    schedule skips ahead instead of firing a burst of catch-up samples. One snapshot is taken
+    whenever any screen is due and only the screens that are due collect it.
+
+    The rate policy (see rates.py) picks each screen's interval again after every sample it collects
+    and whenever reschedule() is called. A screen's second sample comes warmup seconds after its first
+    one, rates need both, so the first frame does not wait a whole interval.
+    """
+
+    def __init__(self, interval=1, backend=None, counters=None, policy=None, warmup=0.25):
+        self.interval = interval
+        self.warmup = warmup
+        self.backend = backend if backend is not None else PsutilBackend()
+        self.counters = counters
+        self.policy = policy if policy is not None else FixedRate()
+        self.screens = []
+        self.listeners = []
+        self.collects = {}
+        self.failing = set()
+        self.lock = threading.Lock()
+        self.thread = None
+        self.ticks = 0
+        self.ready = threading.Event()
+
+        # Timed waits on Python 2 poll in short sleeps, select() on a pipe really sleeps until the
+        # next screen is due or reschedule() writes to the pipe
+        self.wakeup_read, self.wakeup_write = wakeup_pipe()
+
+    def register(self, screen, index=None, interval=None):
+        self.lock.acquire()
+
+        try:
+            screen.interval = interval if interval is not None else self.interval
+            screen.active_interval = screen.interval
+            screen.next_collect = 0
+
+            if index is not None:
+                self.screens.insert(index, screen)
+            else:
+                self.screens.append(screen)
+        finally:
+            self.lock.release()
+
+    def add_listener(self, listener):
+        """
+        Registers a callable that is told about every screen that has collected a new sample.
+        """
+        self.listeners.append(listener)
+
+    def tick(self, screens=None):
+        sample = self.backend.sample()
+
+        if screens is None:
+            self.lock.acquire()
+
+            try:
+                screens = list(self.screens)
+            finally:
+                self.lock.release()
+
+        for screen in screens:
+            try:
+                # Slow work renderers do not read is done first, readers never wait on it
+                screen.prepare(sample)
+
+                # Publish the new sample to the renderers as one consistent update
+                screen.sequence.begin_write()
+
+                try:
+                    screen.collect(sample)
+                finally:
+                    screen.sequence.end_write()
+
+                collected = True
+            except Exception:
+                self.failed(screen, screen.name)
+                collected = False
+
+            # A screen that fails does not hold up the first frame of the others
+            self.collects[screen] = self.collects.get(screen, 0) + 1
+
+            if not collected:
+                continue
+
+            self.recovered(screen, screen.name)
+
+            for listener in self.listeners:
+                try:
+                    listener(screen)
+                    self.recovered((listener, screen), 'the %s listener' % screen.name)
+                except Exception:
+                    self.failed((listener, screen), 'the %s listener' % screen.name)
+
+        self.ticks += 1
+
+        # Rates need two snapshots, so screens only have something to show after their second sample
+        if min(self.collects.get(screen, 0) for screen in self.screens) >= 2:
+            self.ready.set()
+
+    def failed(self, key, description):
+        """
+        Logs what a snapshot, a screen's collect() or a listener raised, once until it works again, and
+        carries on with the rest. Every screen and listener runs on this one thread.
+        """
+        if key in self.failing:
+            return
+
+        self.failing.add(key)
+        print 'Sampling failed in %s, carrying on without it until it recovers' % description
+        traceback.print_exc()
+
+    def recovered(self, key, description):
+        if key in self.failing:
+            self.failing.discard(key)
+            print 'Sampling recovered in %s' % description
+
+    def due(self, now):
+        self.lock.acquire()
+
+        try:
+            return [screen for screen in self.screens if screen.next_collect <= now]
+        finally:
+            self.lock.release()
+
+    def schedule(self, screens, now):
+        self.lock.acquire()
+
+        try:
+            for screen in screens:
+                self.policy.update(screen, now)
+
+                # The second sample comes early, so every screen is ready soon
+                if self.collects.get(screen, 0) < 2:
+                    interval = min(screen.interval, self.warmup)
+                else:
+                    interval = self.policy.interval(screen, now)
+
+                screen.active_interval = interval
+                screen.next_collect += interval
+
+                if screen.next_collect <= now:
+                    missed = int((now - screen.next_collect) / interval) + 1
+                    screen.next_collect += missed * interval
+        finally:
+            self.lock.release()
+
+    def reschedule(self):
+        """
+        Asks the rate policy again for every screen, for when what is visible has changed.
+        """
+        now = monotonic()
+
+        self.lock.acquire()
+
+        try:
+            for screen in self.screens:
+                if self.collects.get(screen, 0) < 2:
+                    continue
+
+                interval = self.policy.interval(screen, now)
+
+                # A faster rate takes effect from the screen's previous slot, which may already be due
+                if interval < screen.active_interval:
+                    previous = screen.next_collect - screen.active_interval
+                    screen.next_collect = min(screen.next_collect, previous + interval)
+
+                screen.active_interval = interval
+        finally:
+            self.lock.release()
+
+        wake_up(self.wakeup_write)
+
+    def sleep(self, now):
+        self.lock.acquire()
+
+        try:
+            next_collect = min([screen.next_collect for screen in self.screens] or [now + self.interval])
+        finally:
+            self.lock.release()
+
+        if next_collect > now:
+            readable, writable, exceptional = select.select([self.wakeup_read], [], [], next_collect - now)
+
+            if readable:
+                os.read(self.wakeup_read, 64)
+
+    def run(self):
+        while True:
+            now = monotonic()
+            screens = self.due(now)
+
+            if screens:
+                if self.counters is not None and self.ticks >= 2:
+                    # How late the sample is taken against the schedule
+                    self.counters.record(SAMPLER_JITTER, (now - min(screen.next_collect for screen in screens)) * 1000)
+
+                try:
+                    self.tick(screens)
+                    self.recovered(self.backend, 'the snapshot')
+                except Exception:
+                    # The snapshot itself failed, the screens try again in their next slot
+                    self.failed(self.backend, 'the snapshot')
+
+                self.schedule(screens, monotonic())
+
+            self.sleep(monotonic())
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, args=())
+        self.thread.daemon = True
+        self.thread.start()
@@ -1,29 +1,185 @@
-import psutil
-import time
-
-from collections import deque
+import os
 
 from exceptions import NotImplementedError
 from exceptions import EnvironmentError
 
-from luma.core.render import canvas
+from PIL import Image
+from PIL import ImageDraw
 
-from renderers import BarRenderer
-from renderers import QuadCpuRenderer
+from framebuffer import FrameBuffer
+from processes import ProcessScanner
+from processes import SelfStat
 from renderers import RendererConfig
-from renderers import UpDownRenderer
+from renderers import ScrollingChart
+from renderers import bar_renderer
+from renderers import fleet_renderer
+from renderers import list_renderer
+from renderers import quad_cpu_renderer
+from renderers import up_down_renderer
+from history import History
+from history import TIERS
+from metrics import BUS_BYTES
+from metrics import BUS_TIME
+from metrics import BUS_TRANSACTIONS
+from metrics import LOCK_WAIT
+from metrics import PROCESS_CPU
+from metrics import PROCESS_RSS
+from metrics import RENDER_TIME
+from metrics import SAMPLER_JITTER
+from procfs import cpu_percent
+from sequence import SequenceCounter
 from utils import bytes_to_human
+from utils import interface_address
+from utils import number_to_human
+
+CPU_TIMES = ('user', 'system', 'idle', 'nice', 'iowait', 'irq', 'softirq', 'steal', 'guest', 'guest_nice')
+MEMORY_FIELDS = ('used', 'available', 'free', 'active', 'inactive', 'buffers', 'cached', 'shared')
+# Characters of the default font that fit in a header
+HEADER_CHARS = 21
+# Put in front of the header while an alert rule on the sub-screen shown is firing
+ALERT_MARKER = '!'
 
 
 class Screen:
 
-    def __init__(self):
-        pass
+    def __init__(self, scrolling=False, quantiles=None):
+        self.name = None
+        self.scrolling = scrolling
+        self.quantiles = quantiles
+        self.chart = None
+        self.screen_index = 0
+        self.scale_index = 0
+        self.header_index = 0
+        self.alerts = {}
+        self.histories = []
+        self.sequence = SequenceCounter()
+        self.interval = 1
+        self.active_interval = 1
+        self.next_collect = 0
+        self.shown = False
+
+    def history(self, capacity, quantiles=True):
+        sketch = self.quantiles.sketch() if quantiles and self.quantiles is not None else None
+        history = History(capacity, sketch=sketch)
+        self.histories.append(history)
+
+        return history
+
+    def set_scale(self, index):
+        self.scale_index = index
+
+        for history in self.histories:
+            history.tier = index
+
+        # The chart's bars belong to the previous time scale
+        if self.chart is not None:
+            self.chart.invalidate()
+
+    def next_scale(self):
+        self.set_scale(self.scale_index + 1 if self.scale_index + 1 < len(TIERS) else 0)
+
+    def previous_scale(self):
+        self.set_scale(self.scale_index - 1 if self.scale_index - 1 >= 0 else len(TIERS) - 1)
+
+    def scaled_header(self, header):
+        if self.scale_index != 0:
+            header = '%s %s' % (header, TIERS[self.scale_index][1])
+
+        return self.alert_header(header)
+
+    def alerting(self):
+        """
+        Whether an alert rule on the current sub-screen is firing.
+        """
+        return self.alerts.get(self.screen_index, 0) > 0
+
+    def alert_header(self, header):
+        return ALERT_MARKER + header if self.alerting() else header
+
+    def header_modes(self):
+        """
+        The quantile modes the header cycles through after the latest values, as (window index,
+        series) tuples. Screens showing more than one series on a sub-screen name the series.
+        """
+        if self.quantiles is None:
+            return []
+
+        return [(window, None) for window in range(len(self.quantiles.labels))]
+
+    def header_mode(self):
+        if self.header_index == 0:
+            return None
+
+        return self.header_modes()[self.header_index - 1]
+
+    def next_header(self):
+        self.header_index = self.header_index + 1 if self.header_index < len(self.header_modes()) else 0
+
+    def quantile_header(self, name, history, format=number_to_human):
+        """
+        In a quantile mode the name, the window and p50/p95/p99/max of the history over it, None while
+        the header shows the latest values. The name is left out when it does not fit.
+        """
+        mode = self.header_mode()
+
+        if mode is None or history.sketch is None:
+            return None
+
+        values = history.sketch.quantiles(mode[0])
+        header = '%s %s' % (self.quantiles.labels[mode[0]], '/'.join(format(value) for value in values)
+                            if values is not None else '-')
+
+        if len(self.alert_header(name)) + 1 + len(header) <= HEADER_CHARS:
+            header = '%s %s' % (name, header)
+
+        return self.alert_header(header)
+
+    def get_chart(self, display):
+        if not self.scrolling:
+            return None
+
+        if self.chart is None:
+            self.chart = ScrollingChart(display.size, framebuffer=getattr(display, 'framebuffer', False))
+
+        return self.chart
 
     def render(self, display):
+        """
+        Draws the current sub-screen and sends it to the display.
+
+        The collector publishes new samples through the screen's sequence counter, so the frame is
+        drawn straight from the live buffers and redrawn if a sample landed while it was being drawn.
+        """
+        while True:
+            version = self.sequence.begin_read()
+
+            if getattr(display, 'framebuffer', False):
+                image = FrameBuffer(display.width, display.height)
+                self.draw_frame(image, display)
+            else:
+                image = Image.new(display.mode, display.size)
+                self.draw_frame(ImageDraw.Draw(image), display)
+
+            if self.sequence.validate(version):
+                break
+
+            # The chart may hold a mix of bars from before and after the sample
+            if self.chart is not None:
+                self.chart.invalidate()
+
+        display.display(image)
+
+    def draw_frame(self, draw, display):
         raise NotImplementedError()
 
-    def collect(self):
+    def prepare(self, sample):
+        """
+        Work on a sample that renderers do not read, done before the sample is published so readers
+        do not wait on it. collect() then only stores the results.
+        """
+        pass
+
+    def collect(self, sample):
         raise NotImplementedError()
 
     def next_screen(self):
@@ -35,67 +191,99 @@ class Screen:
     def reset_screen(self):
         pass
 
-    def sleep_interval(self):
-        return 1
+    def show(self):
+        """
+        Called when the screen becomes visible, screens that keep no history only start working then.
+        """
+        self.shown = True
+
+    def change(self):
+        """
+        The largest change between the two newest raw samples of any history, relative to its range.
+        """
+        change = 0.0
+
+        for history in self.histories:
+            raw = history.raw
+
+            if len(raw) < 2:
+                continue
+
+            scale = max(abs(raw.maximum()), abs(raw.minimum()))
+
+            if scale > 0:
+                change = max(change, abs(raw[-1] - raw[-2]) / scale)
+
+        return change
+
+    def export(self):
+        """
+        The screen's latest values as (metric, labels, value) tuples for the metrics endpoint.
+        """
+        return []
 
 
 class CpuScreen(Screen):
 
-    def __init__(self):
-        Screen.__init__(self)
+    def __init__(self, scrolling=False, quantiles=None):
+        Screen.__init__(self, scrolling, quantiles)
 
+        self.name = 'cpu'
         self.measures = {
             'cores': [
-                deque(maxlen=62),
-                deque(maxlen=62),
-                deque(maxlen=62),
-                deque(maxlen=62)
+                self.history(62, quantiles=False),
+                self.history(62, quantiles=False),
+                self.history(62, quantiles=False),
+                self.history(62, quantiles=False)
             ],
-            'percent': deque(maxlen=31),
+            'percent': self.history(31),
             'user': {
-                'values': deque(maxlen=31), 'last': None
+                'values': self.history(31), 'last': None
             },
             'system': {
-                'values': deque(maxlen=31), 'last': None
+                'values': self.history(31), 'last': None
             },
             'idle': {
-                'values': deque(maxlen=31), 'last': None
+                'values': self.history(31), 'last': None
             },
             'nice': {
-                'values': deque(maxlen=31), 'last': None
+                'values': self.history(31), 'last': None
             },
             'iowait': {
-                'values': deque(maxlen=31), 'last': None
+                'values': self.history(31), 'last': None
             },
             'irq': {
-                'values': deque(maxlen=31), 'last': None
+                'values': self.history(31), 'last': None
             },
             'softirq': {
-                'values': deque(maxlen=31), 'last': None
+                'values': self.history(31), 'last': None
             },
             'steal': {
-                'values': deque(maxlen=31), 'last': None
+                'values': self.history(31), 'last': None
             },
             'guest': {
-                'values': deque(maxlen=31), 'last': None
+                'values': self.history(31), 'last': None
             },
             'guest_nice': {
-                'values': deque(maxlen=31), 'last': None
+                'values': self.history(31), 'last': None
             }
         }
+        self.timestamp = None
+        self.last_times = None
+        self.last_percpu_times = None
         self.screen_config = [
-            RendererConfig(QuadCpuRenderer(), 'cores', 'CPU'),
-            RendererConfig(BarRenderer(), 'percent', 'CPU', x_start=126, x_step=-4),
-            RendererConfig(BarRenderer(), 'user', 'User', x_start=126, x_step=-4),
-            RendererConfig(BarRenderer(), 'system', 'System', x_start=126, x_step=-4),
-            RendererConfig(BarRenderer(), 'idle', 'Idle', x_start=126, x_step=-4),
-            RendererConfig(BarRenderer(), 'nice', 'Nice', x_start=126, x_step=-4),
-            RendererConfig(BarRenderer(), 'iowait', 'IOWait', x_start=126, x_step=-4),
-            RendererConfig(BarRenderer(), 'irq', 'IRQ', x_start=126, x_step=-4),
-            RendererConfig(BarRenderer(), 'softirq', 'Soft IRQ', x_start=126, x_step=-4),
-            RendererConfig(BarRenderer(), 'steal', 'Steal',  x_start=126, x_step=-4),
-            RendererConfig(BarRenderer(), 'guest', 'Guest', x_start=126, x_step=-4),
-            RendererConfig(BarRenderer(), 'guest_nice', 'Guest Nice', x_start=126, x_step=-4)
+            RendererConfig(quad_cpu_renderer, 'cores', 'CPU'),
+            RendererConfig(bar_renderer, 'percent', 'CPU', x_start=126, x_step=-4),
+            RendererConfig(bar_renderer, 'user', 'User', x_start=126, x_step=-4),
+            RendererConfig(bar_renderer, 'system', 'System', x_start=126, x_step=-4),
+            RendererConfig(bar_renderer, 'idle', 'Idle', x_start=126, x_step=-4),
+            RendererConfig(bar_renderer, 'nice', 'Nice', x_start=126, x_step=-4),
+            RendererConfig(bar_renderer, 'iowait', 'IOWait', x_start=126, x_step=-4),
+            RendererConfig(bar_renderer, 'irq', 'IRQ', x_start=126, x_step=-4),
+            RendererConfig(bar_renderer, 'softirq', 'Soft IRQ', x_start=126, x_step=-4),
+            RendererConfig(bar_renderer, 'steal', 'Steal',  x_start=126, x_step=-4),
+            RendererConfig(bar_renderer, 'guest', 'Guest', x_start=126, x_step=-4),
+            RendererConfig(bar_renderer, 'guest_nice', 'Guest Nice', x_start=126, x_step=-4)
         ]
         self.screen_index = 0
 
@@ -107,129 +295,151 @@ class CpuScreen(Screen):
 
     def reset_screen(self):
         self.screen_index = 0
+        self.header_index = 0
+        self.set_scale(0)
 
     def get_header(self, config, data):
-        return '%s:%.2f' % (config.name, data[config.measure]['values'][-1])
+        return self.quantile_header(config.name, data[config.measure]['values']) or \
+            self.scaled_header('%s:%.2f' % (config.name, data[config.measure]['values'].newest()))
 
     def get_cpu_header(self, config, data):
-        return '%s:%s%%' % (config.name, data[config.measure][-1])
+        return self.quantile_header(config.name, data[config.measure]) or \
+            self.scaled_header('%s:%s%%' % (config.name, data[config.measure].newest()))
 
     def get_data_values(self, config, data):
         return data[config.measure]['values']
 
     def count_values(self, config, data):
-        return float(max(max(data[config.measure]['values']), 100))
+        return float(max(data[config.measure]['values'].maximum(), 100))
 
-    def render(self, display):
-
-        with canvas(display) as draw:
-            config = self.screen_config[self.screen_index]
+    def draw_frame(self, draw, display):
+        config = self.screen_config[self.screen_index]
+        chart = self.get_chart(display)
 
-            if self.screen_index == 0:
-                config.renderer.render(draw,
-                                       config,
-                                       self.measures)
-            elif self.screen_index == 1:
-                config.renderer.render(draw,
-                                       config,
-                                       self.measures,
-                                       header_function=self.get_cpu_header,
-                                       render_max=False)
-            elif self.screen_index in (2, 3, 4, 5, 6, 7, 8, 9, 10, 11):
-                config.renderer.render(draw,
-                                       config,
-                                       self.measures,
-                                       header_function=self.get_header,
-                                       data_function=self.get_data_values,
-                                       render_max=False,
-                                       count_function=self.count_values)
+        if self.screen_index == 0:
+            config.renderer.render(draw,
+                                   config,
+                                   self.measures,
+                                   chart=chart)
+        elif self.screen_index == 1:
+            config.renderer.render(draw,
+                                   config,
+                                   self.measures,
+                                   header_function=self.get_cpu_header,
+                                   render_max=False,
+                                   chart=chart)
+        elif self.screen_index in (2, 3, 4, 5, 6, 7, 8, 9, 10, 11):
+            config.renderer.render(draw,
+                                   config,
+                                   self.measures,
+                                   header_function=self.get_header,
+                                   data_function=self.get_data_values,
+                                   render_max=False,
+                                   count_function=self.count_values,
+                                   chart=chart)
 
     def collect_init(self, name, measure):
         self.measures[name]['last'] = measure
 
-    def collect_record(self, name, measure):
+    def collect_record(self, name, measure, elapsed):
         last = self.measures[name]['last']
 
-        self.measures[name]['values'].append(measure - last)
+        self.measures[name]['values'].append((measure - last) / elapsed, self.timestamp)
         self.measures[name]['last'] = measure
 
-    def collect(self):
+    def collect(self, sample):
+        usage = sample.cpu_times
 
-        usage = psutil.cpu_times(percpu=False)
+        if self.timestamp is None:
+            self.collect_init('user', usage.user)
+            self.collect_init('system', usage.system)
+            self.collect_init('idle', usage.idle)
+            self.collect_init('nice', usage.nice)
+            self.collect_init('iowait', usage.iowait)
+            self.collect_init('irq', usage.irq)
+            self.collect_init('softirq', usage.softirq)
+            self.collect_init('steal', usage.steal)
+            self.collect_init('guest', usage.guest)
+            self.collect_init('guest_nice', usage.guest_nice)
 
-        self.collect_init('user', usage.user)
-        self.collect_init('system', usage.system)
-        self.collect_init('idle', usage.idle)
-        self.collect_init('nice', usage.nice)
-        self.collect_init('iowait', usage.iowait)
-        self.collect_init('irq', usage.irq)
-        self.collect_init('softirq', usage.softirq)
-        self.collect_init('steal', usage.steal)
-        self.collect_init('guest', usage.guest)
-        self.collect_init('guest_nice', usage.guest_nice)
+            self.timestamp = sample.timestamp
+            self.last_times = usage
+            self.last_percpu_times = sample.cpu_times_percpu
+            return
 
-        while True:
-            # Record the CPU percent
-            self.measures['percent'].append(psutil.cpu_percent(interval=None))
+        elapsed = sample.timestamp - self.timestamp
+        self.timestamp = sample.timestamp
+
+        # Record the CPU percent, measured from the times since this screen's previous sample as other
+        # collectors may have sampled in between
+        self.measures['percent'].append(cpu_percent(self.last_times, usage), sample.timestamp)
+
+        # Record the CPU times, normalized to seconds per second in case the tick was late
+        self.collect_record('user', usage.user, elapsed)
+        self.collect_record('system', usage.system, elapsed)
+        self.collect_record('idle', usage.idle, elapsed)
+        self.collect_record('nice', usage.nice, elapsed)
+        self.collect_record('iowait', usage.iowait, elapsed)
+        self.collect_record('irq', usage.irq, elapsed)
+        self.collect_record('softirq', usage.softirq, elapsed)
+        self.collect_record('steal', usage.steal, elapsed)
+        self.collect_record('guest', usage.guest, elapsed)
+        self.collect_record('guest_nice', usage.guest_nice, elapsed)
+
+        # And the per-core measures
+        for i, (last, times) in enumerate(zip(self.last_percpu_times, sample.cpu_times_percpu)):
+            self.measures['cores'][i].append(cpu_percent(last, times), sample.timestamp)
 
-            # Record the CPU times
-            usage = psutil.cpu_times(percpu=False)
+        self.last_times = usage
+        self.last_percpu_times = sample.cpu_times_percpu
 
-            self.collect_record('user', usage.user)
-            self.collect_record('system', usage.system)
-            self.collect_record('idle', usage.idle)
-            self.collect_record('nice', usage.nice)
-            self.collect_record('iowait', usage.iowait)
-            self.collect_record('irq', usage.irq)
-            self.collect_record('softirq', usage.softirq)
-            self.collect_record('steal', usage.steal)
-            self.collect_record('guest', usage.guest)
-            self.collect_record('guest_nice', usage.guest_nice)
+    def export(self):
+        if self.timestamp is None:
+            return []
 
-            # And the per-core measures
-            cpu_measures = psutil.cpu_percent(interval=None, percpu=True)
+        metrics = [('cpu_percent', (), self.measures['percent'].raw.newest())]
 
-            for i, measure in enumerate(cpu_measures):
-                self.measures['cores'][i].append(measure)
+        for name in CPU_TIMES:
+            metrics.append(('cpu_seconds_total', (('mode', name),), self.measures[name]['last']))
 
-            time.sleep(1)
+        for i, core in enumerate(self.measures['cores']):
+            metrics.append(('cpu_core_percent', (('core', str(i)),), core.raw.newest()))
+
+        return metrics
 
 
 class NetworkScreen(Screen):
-    def __init__(self, interface):
-        Screen.__init__(self)
+    def __init__(self, interface, scrolling=False, ip=None, quantiles=None):
+        Screen.__init__(self, scrolling, quantiles)
 
+        self.name = 'network-%s' % interface
         self.interface = interface
-        self.ip = None
+        self.ip = ip
+        self.timestamp = None
         self.measures = {
             'bytes': {
-                'in': deque(maxlen=31), 'out': deque(maxlen=31), 'last_in': None, 'last_out': None
+                'in': self.history(31), 'out': self.history(31), 'last_in': None, 'last_out': None
             },
             'packets': {
-                'in': deque(maxlen=31), 'out': deque(maxlen=31), 'last_in': None, 'last_out': None
+                'in': self.history(31), 'out': self.history(31), 'last_in': None, 'last_out': None
             },
             'errors': {
-                'in': deque(maxlen=31), 'out': deque(maxlen=31), 'last_in': None, 'last_out': None
+                'in': self.history(31), 'out': self.history(31), 'last_in': None, 'last_out': None
             },
             'dropped': {
-                'in': deque(maxlen=31), 'out': deque(maxlen=31), 'last_in': None, 'last_out': None
+                'in': self.history(31), 'out': self.history(31), 'last_in': None, 'last_out': None
             }
         }
         self.screen_config = [
-            RendererConfig(UpDownRenderer(), 'bytes', 'Bytes', x_start=126, x_step=-4),
-            RendererConfig(UpDownRenderer(), 'packets', 'Packets', x_start=126, x_step=-4),
-            RendererConfig(UpDownRenderer(), 'errors', 'Errors', x_start=126, x_step=-4),
-            RendererConfig(UpDownRenderer(), 'dropped', 'Dropped', x_start=126, x_step=-4)
+            RendererConfig(up_down_renderer, 'bytes', 'Bytes', x_start=126, x_step=-4),
+            RendererConfig(up_down_renderer, 'packets', 'Packets', x_start=126, x_step=-4),
+            RendererConfig(up_down_renderer, 'errors', 'Errors', x_start=126, x_step=-4),
+            RendererConfig(up_down_renderer, 'dropped', 'Dropped', x_start=126, x_step=-4)
         ]
         self.screen_index = 0
 
-        interfaces = psutil.net_if_addrs()[self.interface]
-
-        for interface in interfaces:
-
-            if interface.family == 2:
-                self.ip = interface.address
-                break
+        if self.ip is None:
+            self.ip = interface_address(self.interface)
 
         if self.ip is None:
             raise EnvironmentError()
@@ -242,80 +452,121 @@ class NetworkScreen(Screen):
 
     def reset_screen(self):
         self.screen_index = 0
+        self.header_index = 0
+        self.set_scale(0)
+
+    def header_modes(self):
+        # Received and sent are charted together, each has modes of its own
+        return [(window, direction) for window, series in Screen.header_modes(self) for direction in ('in', 'out')]
 
     def get_header(self, config, data):
-        return "%s:%s" % (self.interface, self.ip)
+        mode = self.header_mode()
 
-    def render(self, display):
-        with canvas(display) as draw:
-            config = self.screen_config[self.screen_index]
-            config.renderer.render(draw,
-                                   config,
-                                   self.measures,
-                                   header_function=self.get_header,
-                                   min_value=10240)
+        if mode is not None:
+            format = number_to_human
+
+            if config.measure == 'bytes':
+                format = lambda value: bytes_to_human(int(value))
+
+            return self.quantile_header(mode[1], data[config.measure][mode[1]], format)
+
+        return self.scaled_header("%s:%s" % (self.interface, self.ip))
+
+    def draw_frame(self, draw, display):
+        config = self.screen_config[self.screen_index]
+        chart = self.get_chart(display)
+        config.renderer.render(draw,
+                               config,
+                               self.measures,
+                               header_function=self.get_header,
+                               min_value=10240,
+                               chart=chart)
 
     def collect_init(self, name, in_measure, out_measure):
         self.measures[name]['last_in'] = in_measure
         self.measures[name]['last_out'] = out_measure
 
-    def collect_record(self, name, in_measure, out_measure):
+    def collect_record(self, name, in_measure, out_measure, elapsed):
         last_in = self.measures[name]['last_in']
         last_out = self.measures[name]['last_out']
 
-        self.measures[name]['in'].append(in_measure - last_in)
-        self.measures[name]['out'].append(out_measure - last_out)
+        self.measures[name]['in'].append((in_measure - last_in) / elapsed, self.timestamp)
+        self.measures[name]['out'].append((out_measure - last_out) / elapsed, self.timestamp)
 
         self.measures[name]['last_in'] = in_measure
         self.measures[name]['last_out'] = out_measure
 
-    def collect(self):
+    def collect(self, sample):
+        usage = sample.net_io[self.interface]
 
-        usage = psutil.net_io_counters(pernic=True)
+        if self.timestamp is None:
+            self.collect_init('bytes', usage.bytes_recv, usage.bytes_sent)
+            self.collect_init('packets', usage.packets_recv, usage.packets_sent)
+            self.collect_init('errors', usage.errout, usage.errin)
+            self.collect_init('dropped', usage.dropout, usage.dropin)
 
-        self.collect_init('bytes', usage[self.interface].bytes_recv, usage[self.interface].bytes_sent)
-        self.collect_init('packets', usage[self.interface].packets_recv, usage[self.interface].packets_sent)
-        self.collect_init('errors', usage[self.interface].errout, usage[self.interface].errin)
-        self.collect_init('dropped', usage[self.interface].dropout, usage[self.interface].dropin)
+            self.timestamp = sample.timestamp
+            return
 
-        while True:
-            usage = psutil.net_io_counters(pernic=True)
+        # Counters are recorded per second so a late tick does not show up as a spike
+        elapsed = float(sample.timestamp - self.timestamp)
+        self.timestamp = sample.timestamp
+
+        self.collect_record('bytes', usage.bytes_recv, usage.bytes_sent, elapsed)
+        self.collect_record('packets', usage.packets_recv, usage.packets_sent, elapsed)
+        self.collect_record('errors', usage.errout, usage.errin, elapsed)
+        self.collect_record('dropped', usage.dropout, usage.dropin, elapsed)
+
+    def export(self):
+        if self.timestamp is None:
+            return []
+
+        metrics = []
+
+        for name in ('bytes', 'packets', 'errors', 'dropped'):
+            receive = self.measures[name]['last_in']
+            transmit = self.measures[name]['last_out']
+
+            # The error and drop counters are collected the other way around
+            if name in ('errors', 'dropped'):
+                receive, transmit = transmit, receive
 
-            self.collect_record('bytes', usage[self.interface].bytes_recv, usage[self.interface].bytes_sent)
-            self.collect_record('packets', usage[self.interface].packets_recv, usage[self.interface].packets_sent)
-            self.collect_record('errors', usage[self.interface].errout, usage[self.interface].errin)
-            self.collect_record('dropped', usage[self.interface].dropout, usage[self.interface].dropin)
+            metrics.append(('network_%s_total' % name, (('interface', self.interface), ('direction', 'receive')),
+                            receive))
+            metrics.append(('network_%s_total' % name, (('interface', self.interface), ('direction', 'transmit')),
+                            transmit))
 
-            time.sleep(1)
+        return metrics
 
 
 class MemoryScreen(Screen):
-    def __init__(self):
-        Screen.__init__(self)
+    def __init__(self, scrolling=False, quantiles=None):
+        Screen.__init__(self, scrolling, quantiles)
 
+        self.name = 'memory'
         self.used = 0
         self.total = 0
         self.measures = {
-            'percent': deque(maxlen=31),
-            'used': deque(maxlen=31),
-            'available': deque(maxlen=31),
-            'free': deque(maxlen=31),
-            'active': deque(maxlen=31),
-            'inactive': deque(maxlen=31),
-            'buffers': deque(maxlen=31),
-            'cached': deque(maxlen=31),
-            'shared': deque(maxlen=31)
+            'percent': self.history(31),
+            'used': self.history(31),
+            'available': self.history(31),
+            'free': self.history(31),
+            'active': self.history(31),
+            'inactive': self.history(31),
+            'buffers': self.history(31),
+            'cached': self.history(31),
+            'shared': self.history(31)
         }
         self.screen_config = [
-            RendererConfig(BarRenderer(), 'percent', 'Percent', x_start=126, x_step=-4),
-            RendererConfig(BarRenderer(), 'used', 'Used', x_start=126, x_step=-4),
-            RendererConfig(BarRenderer(), 'available', 'Available', x_start=126, x_step=-4),
-            RendererConfig(BarRenderer(), 'free', 'Free', x_start=126, x_step=-4),
-            RendererConfig(BarRenderer(), 'active', 'Active', x_start=126, x_step=-4),
-            RendererConfig(BarRenderer(), 'inactive', 'Inactive', x_start=126, x_step=-4),
-            RendererConfig(BarRenderer(), 'buffers', 'Buffers', x_start=126, x_step=-4),
-            RendererConfig(BarRenderer(), 'cached', 'Cached', x_start=126, x_step=-4),
-            RendererConfig(BarRenderer(), 'shared', 'Shared', x_start=126, x_step=-4),
+            RendererConfig(bar_renderer, 'percent', 'Percent', x_start=126, x_step=-4),
+            RendererConfig(bar_renderer, 'used', 'Used', x_start=126, x_step=-4),
+            RendererConfig(bar_renderer, 'available', 'Available', x_start=126, x_step=-4),
+            RendererConfig(bar_renderer, 'free', 'Free', x_start=126, x_step=-4),
+            RendererConfig(bar_renderer, 'active', 'Active', x_start=126, x_step=-4),
+            RendererConfig(bar_renderer, 'inactive', 'Inactive', x_start=126, x_step=-4),
+            RendererConfig(bar_renderer, 'buffers', 'Buffers', x_start=126, x_step=-4),
+            RendererConfig(bar_renderer, 'cached', 'Cached', x_start=126, x_step=-4),
+            RendererConfig(bar_renderer, 'shared', 'Shared', x_start=126, x_step=-4),
         ]
         self.screen_index = 0
 
@@ -327,50 +578,352 @@ class MemoryScreen(Screen):
 
     def reset_screen(self):
         self.screen_index = 0
+        self.header_index = 0
+        self.set_scale(0)
 
     def get_pct_header(self, config, data):
-        return "Memory:%s%%" % data[config.measure][-1]
+        return self.quantile_header('Memory', data[config.measure]) or \
+            self.scaled_header("Memory:%s%%" % data[config.measure].newest())
 
     def get_mem_header(self, config, data):
-        return "%s:%s/%s" % (config.name, bytes_to_human(data[config.measure][-1]), bytes_to_human(self.total))
+        return self.quantile_header(config.name, data[config.measure], lambda value: bytes_to_human(int(value))) or \
+            self.scaled_header("%s:%s/%s" % (config.name, bytes_to_human(data[config.measure].newest()),
+                                             bytes_to_human(self.total)))
 
     def get_max_mem(self, config, data):
         return self.total + 0.0
 
-    def render(self, display):
-        with canvas(display) as draw:
-            config = self.screen_config[self.screen_index]
+    def draw_frame(self, draw, display):
+        config = self.screen_config[self.screen_index]
+        chart = self.get_chart(display)
+
+        if self.screen_index == 0:
+            config.renderer.render(draw,
+                                   config,
+                                   self.measures,
+                                   header_function=self.get_pct_header,
+                                   render_max=False,
+                                   chart=chart)
+        elif self.screen_index in (1, 2, 3, 4, 5, 6, 7, 8):
+            config.renderer.render(draw,
+                                   config,
+                                   self.measures,
+                                   header_function=self.get_mem_header,
+                                   count_function=self.get_max_mem,
+                                   render_max=False,
+                                   chart=chart)
 
-            if self.screen_index == 0:
-                config.renderer.render(draw,
-                                       config,
-                                       self.measures,
-                                       header_function=self.get_pct_header,
-                                       render_max=False)
-            elif self.screen_index in (1, 2, 3, 4, 5, 6, 7, 8):
-                config.renderer.render(draw,
-                                       config,
-                                       self.measures,
-                                       header_function=self.get_mem_header,
-                                       count_function=self.get_max_mem,
-                                       render_max=False)
-
-    def collect(self):
+    def collect(self, sample):
+        usage = sample.virtual_memory
 
-        while True:
-            usage = psutil.virtual_memory()
-
-            self.used = usage.used
-            self.total = usage.total
-
-            self.measures['percent'].append(usage.percent)
-            self.measures['used'].append(usage.used)
-            self.measures['available'].append(usage.available)
-            self.measures['free'].append(usage.free)
-            self.measures['active'].append(usage.active)
-            self.measures['inactive'].append(usage.inactive)
-            self.measures['buffers'].append(usage.buffers)
-            self.measures['cached'].append(usage.cached)
-            self.measures['shared'].append(usage.shared)
-
-            time.sleep(1)
+        self.used = usage.used
+        self.total = usage.total
+
+        self.measures['percent'].append(usage.percent, sample.timestamp)
+        self.measures['used'].append(usage.used, sample.timestamp)
+        self.measures['available'].append(usage.available, sample.timestamp)
+        self.measures['free'].append(usage.free, sample.timestamp)
+        self.measures['active'].append(usage.active, sample.timestamp)
+        self.measures['inactive'].append(usage.inactive, sample.timestamp)
+        self.measures['buffers'].append(usage.buffers, sample.timestamp)
+        self.measures['cached'].append(usage.cached, sample.timestamp)
+        self.measures['shared'].append(usage.shared, sample.timestamp)
+
+    def export(self):
+        if not self.total:
+            return []
+
+        metrics = [('memory_percent', (), self.measures['percent'].raw.newest()),
+                   ('memory_bytes', (('field', 'total'),), self.total)]
+
+        for name in MEMORY_FIELDS:
+            metrics.append(('memory_bytes', (('field', name),), self.measures[name].raw.newest()))
+
+        return metrics
+
+
+class ProcessScreen(Screen):
+    """
+    The processes using the most CPU and the most memory, refreshed every time the screen collects.
+
+    There is no history to keep, so /proc is only scanned once the screen has been shown.
+    """
+
+    def __init__(self, scrolling=False, count=5, root='/proc'):
+        Screen.__init__(self, scrolling)
+
+        self.name = 'processes'
+        self.count = count
+        self.root = root
+        self.scanner = None
+        self.prepared = None
+        self.process_count = 0
+        self.measures = {
+            'cpu': [],
+            'rss': []
+        }
+        self.screen_config = [
+            RendererConfig(list_renderer, 'cpu', 'Top CPU'),
+            RendererConfig(list_renderer, 'rss', 'Top Memory')
+        ]
+        self.screen_index = 0
+
+    def next_screen(self):
+        self.screen_index = self.screen_index + 1 if self.screen_index + 1 < len(self.screen_config) else 0
+
+    def previous_screen(self):
+        self.screen_index = self.screen_index - 1 if self.screen_index - 1 >= 0 else len(self.screen_config) - 1
+
+    def reset_screen(self):
+        self.screen_index = 0
+
+    def get_header(self, config, data):
+        return '%s (%s)' % (config.name, self.process_count)
+
+    def draw_frame(self, draw, display):
+        config = self.screen_config[self.screen_index]
+
+        config.renderer.render(draw,
+                               config,
+                               self.measures,
+                               header_function=self.get_header)
+
+    def prepare(self, sample):
+        # Scanning /proc takes milliseconds, renderers reading the screen meanwhile would wait on it
+        if not self.shown:
+            return
+
+        if self.scanner is None:
+            self.scanner = ProcessScanner(self.root, self.count)
+
+        self.scanner.refresh(sample.timestamp)
+
+        top = self.scanner.top_cpu
+        highest = max(top[0].cpu if top else 0, 1.0)
+        cpu = [(process.name, '%.1f%%' % process.cpu, process.cpu / highest) for process in top]
+
+        top = self.scanner.top_rss
+        highest = max(top[0].rss if top else 0, 1)
+        rss = [(process.name, bytes_to_human(process.rss), float(process.rss) / highest) for process in top]
+
+        self.prepared = (sample, cpu, rss, len(self.scanner.processes))
+
+    def collect(self, sample):
+        if not self.shown:
+            return
+
+        # Called on its own, the scan happens here
+        if self.prepared is None or self.prepared[0] is not sample:
+            self.prepare(sample)
+
+        sample, self.measures['cpu'], self.measures['rss'], self.process_count = self.prepared
+        self.prepared = None
+
+
+class DiagnosticsScreen(Screen):
+    """
+    Shows what the monitor itself costs: render time per frame, the time, bytes and transfers each
+    frame took on the bus, how late the sampler ticks, how long renders wait for the monitor's lock
+    and the process's own CPU and memory use.
+
+    Charts show the worst value of each tick, headers the p50/p95/p99 over the counters' window.
+    """
+
+    def __init__(self, counters, scrolling=False):
+        Screen.__init__(self, scrolling)
+
+        self.name = 'diagnostics'
+        self.counters = counters
+        self.stat = SelfStat()
+        self.cpus = os.sysconf('SC_NPROCESSORS_ONLN') or 1
+        self.timestamp = None
+        self.cpu_time = None
+        self.measures = {
+            RENDER_TIME: self.history(31),
+            BUS_TIME: self.history(31),
+            BUS_BYTES: self.history(31),
+            BUS_TRANSACTIONS: self.history(31),
+            SAMPLER_JITTER: self.history(31),
+            LOCK_WAIT: self.history(31),
+            PROCESS_CPU: self.history(31),
+            PROCESS_RSS: self.history(31)
+        }
+        self.screen_config = [
+            RendererConfig(bar_renderer, RENDER_TIME, 'Render', x_start=126, x_step=-4),
+            RendererConfig(bar_renderer, BUS_TIME, 'Bus', x_start=126, x_step=-4),
+            RendererConfig(bar_renderer, BUS_BYTES, 'Bus', x_start=126, x_step=-4),
+            RendererConfig(bar_renderer, BUS_TRANSACTIONS, 'Xfer', x_start=126, x_step=-4),
+            RendererConfig(bar_renderer, SAMPLER_JITTER, 'Jitter', x_start=126, x_step=-4),
+            RendererConfig(bar_renderer, LOCK_WAIT, 'Lock', x_start=126, x_step=-4),
+            RendererConfig(bar_renderer, PROCESS_CPU, 'CPU', x_start=126, x_step=-4),
+            RendererConfig(bar_renderer, PROCESS_RSS, 'RSS', x_start=126, x_step=-4)
+        ]
+        self.screen_index = 0
+
+    def next_screen(self):
+        self.screen_index = self.screen_index + 1 if self.screen_index + 1 < len(self.screen_config) else 0
+
+    def previous_screen(self):
+        self.screen_index = self.screen_index - 1 if self.screen_index - 1 >= 0 else len(self.screen_config) - 1
+
+    def reset_screen(self):
+        self.screen_index = 0
+        self.set_scale(0)
+
+    def get_header(self, config, data):
+        p50, p95, p99 = self.counters.percentiles(config.measure)
+
+        if config.measure in (PROCESS_RSS, BUS_BYTES):
+            values = '%s/%s/%s' % (bytes_to_human(int(p50)), bytes_to_human(int(p95)), bytes_to_human(int(p99)))
+        elif config.measure == BUS_TRANSACTIONS:
+            values = '%d/%d/%d' % (p50, p95, p99)
+        elif config.measure == PROCESS_CPU:
+            values = '%.1f/%.1f/%.1f%%' % (p50, p95, p99)
+        else:
+            values = '%.1f/%.1f/%.1fms' % (p50, p95, p99)
+
+        return self.scaled_header('%s %s' % (config.name, values))
+
+    def get_max_value(self, config, data):
+        # Autoscale, the values are far too small for the default scale of 100
+        return float(max(data[config.measure].maximum(), 1))
+
+    def draw_frame(self, draw, display):
+        config = self.screen_config[self.screen_index]
+        chart = self.get_chart(display)
+
+        config.renderer.render(draw,
+                               config,
+                               self.measures,
+                               header_function=self.get_header,
+                               count_function=self.get_max_value,
+                               render_max=False,
+                               chart=chart)
+
+    def collect(self, sample):
+        cpu_time, rss = self.stat.usage()
+        cpu = 0.0
+
+        # CPU use since the previous sample, as a share of all the cores
+        if self.timestamp is not None and sample.timestamp > self.timestamp:
+            cpu = (cpu_time - self.cpu_time) / (sample.timestamp - self.timestamp) / self.cpus * 100
+
+        self.timestamp = sample.timestamp
+        self.cpu_time = cpu_time
+
+        self.counters.record(PROCESS_CPU, cpu)
+        self.counters.record(PROCESS_RSS, rss)
+
+        self.measures[PROCESS_CPU].append(cpu, sample.timestamp)
+        self.measures[PROCESS_RSS].append(rss, sample.timestamp)
+
+        for name in (RENDER_TIME, BUS_TIME, BUS_BYTES, BUS_TRANSACTIONS, SAMPLER_JITTER, LOCK_WAIT):
+            peak = self.counters.drain(name)
+            self.measures[name].append(peak if peak is not None else 0.0, sample.timestamp)
+
+
+class FleetScreen(Screen):
+    """
+    The nodes sending to a fleet receiver: CPU and memory of every node as one bar each, then a page
+    with the CPU history of each node in turn.
+
+    Up and down move through the pages, with cycle_time set they also advance on their own.
+    """
+
+    def __init__(self, receiver, scrolling=False, cycle_time=0):
+        Screen.__init__(self, scrolling)
+
+        self.name = 'fleet'
+        self.receiver = receiver
+        self.cycle_time = cycle_time
+        self.cycled = None
+        self.nodes = []
+        self.node_configs = {}
+        self.measures = {
+            'cpu': [],
+            'memory': []
+        }
+        self.screen_config = [
+            RendererConfig(fleet_renderer, 'cpu', 'CPU'),
+            RendererConfig(fleet_renderer, 'memory', 'Mem')
+        ]
+        self.screen_index = 0
+
+    def next_screen(self):
+        pages = len(self.screen_config) + len(self.nodes)
+        self.screen_index = self.screen_index + 1 if self.screen_index + 1 < pages else 0
+
+    def previous_screen(self):
+        pages = len(self.screen_config) + len(self.nodes)
+        self.screen_index = self.screen_index - 1 if self.screen_index - 1 >= 0 else pages - 1
+
+    def reset_screen(self):
+        self.screen_index = 0
+
+    def node_config(self, node):
+        # One config per node, the scrolling chart keeps its bars per config
+        config = self.node_configs.get(node.name)
+
+        if config is None:
+            config = self.node_configs[node.name] = RendererConfig(bar_renderer, 'cpu', node.name,
+                                                                   x_start=126, x_step=-4)
+
+        return config
+
+    def get_fleet_header(self, config, data):
+        values = [value for value in data[config.measure] if value is not None]
+        average = sum(values) / len(values) if values else 0.0
+
+        return '%s %s/%s up %.0f%%' % (config.name, len(values), len(self.nodes), average)
+
+    def get_node_header(self, config, data):
+        node = self.nodes[self.screen_index - len(self.screen_config)]
+
+        if not node.up:
+            return '%s down' % node.name
+
+        return '%s %.0f%% m%.0f%%' % (node.name, node.report.cpu, node.report.memory)
+
+    def draw_frame(self, draw, display):
+        if self.screen_index < len(self.screen_config):
+            config = self.screen_config[self.screen_index]
+
+            config.renderer.render(draw,
+                                   config,
+                                   self.measures,
+                                   header_function=self.get_fleet_header)
+            return
+
+        node = self.nodes[self.screen_index - len(self.screen_config)]
+        config = self.node_config(node)
+
+        config.renderer.render(draw,
+                               config,
+                               node.measures,
+                               header_function=self.get_node_header,
+                               render_max=False,
+                               chart=self.get_chart(display))
+
+    def collect(self, sample):
+        self.receiver.update()
+        self.nodes = list(self.receiver.nodes)
+
+        # Expired nodes leave the pages and their configs behind
+        if len(self.node_configs) > len(self.nodes):
+            names = set(node.name for node in self.nodes)
+            self.node_configs = dict((name, config) for name, config in self.node_configs.items() if name in names)
+
+        if self.screen_index >= len(self.screen_config) + len(self.nodes):
+            self.reset_screen()
+
+        self.measures['cpu'] = [node.report.cpu if node.up else None for node in self.nodes]
+        self.measures['memory'] = [node.report.memory if node.up else None for node in self.nodes]
+
+        if self.cycle_time <= 0 or not self.nodes:
+            return
+
+        if self.cycled is None:
+            self.cycled = sample.timestamp
+        elif sample.timestamp - self.cycled >= self.cycle_time:
+            self.cycled = sample.timestamp
+            self.next_screen()
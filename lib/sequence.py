@@ -0,0 +1,37 @@
+import time
+
+
+class SequenceCounter:
+    """
+    A single-writer sequence counter that lets readers detect they overlapped a write.
+
+    The writer moves the counter to an odd value before it touches the shared state and back to an
+    even value when it is done. A reader notes the counter before reading and its view is consistent
+    when the counter still holds that same even value afterwards, so readers never take a lock or
+    copy the data they read. The even values double as a version number of the published state.
+    """
+
+    def __init__(self):
+        self.value = 0
+
+    def begin_write(self):
+        self.value += 1
+
+    def end_write(self):
+        self.value += 1
+
+    def begin_read(self):
+        value = self.value
+
+        # A write is in progress, let the writer thread finish it
+        while value & 1:
+            time.sleep(0)
+            value = self.value
+
+        return value
+
+    def validate(self, value):
+        return self.value == value
+
+    def version(self):
+        return self.value >> 1
@@ -0,0 +1,233 @@
+import mmap
+import os
+import struct
+import time
+import zlib
+
+from monotonic import monotonic
+
+from history import named_histories
+
+MAGIC = b'PIMH'
+VERSION = 1
+
+# magic, format version, buffer capacity, number of buffers
+FILE_HEADER = struct.Struct('<4sHHH6x')
+# sequence number, wall clock time of the save, crc32 of the sequence, time and payload
+SLOT_HEADER = struct.Struct('<QdI4x')
+SLOT_STAMP = struct.Struct('<Qd')
+# start and count of one ring buffer, followed by its values
+BUFFER_HEADER = struct.Struct('<HH')
+
+
+class RingFile:
+    """
+    A fixed-size, memory-mapped file holding every ring buffer of one History.
+
+    The file has two state slots that are written alternately. A save writes the buffers into the
+    older slot and only then its header with a new sequence number and a crc32 of the contents, so a
+    writer killed mid-save leaves the other slot intact and the torn one fails its checksum.
+    """
+
+    def __init__(self, path, history):
+        self.path = path
+        self.history = history
+        self.capacity = history.capacity
+        self.buffers = history.buffers()
+        self.values = struct.Struct('<%dd' % self.capacity)
+        self.slot_size = RingFile.get_slot_size(history)
+        self.size = RingFile.get_size(history)
+        self.sequence = 0
+
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+
+        if os.fstat(self.fd).st_size != self.size:
+            os.ftruncate(self.fd, 0)
+            os.ftruncate(self.fd, self.size)
+
+        self.map = mmap.mmap(self.fd, self.size)
+
+        if FILE_HEADER.unpack_from(self.map, 0) != (MAGIC, VERSION, self.capacity, len(self.buffers)):
+            # A new file, or one written by a different format version or buffer layout
+            self.map[:] = b'\0' * self.size
+            FILE_HEADER.pack_into(self.map, 0, MAGIC, VERSION, self.capacity, len(self.buffers))
+
+    @staticmethod
+    def get_slot_size(history):
+        return SLOT_HEADER.size + len(history.buffers()) * (BUFFER_HEADER.size + history.capacity * 8)
+
+    @staticmethod
+    def get_size(history):
+        return FILE_HEADER.size + 2 * RingFile.get_slot_size(history)
+
+    def slot_offset(self, slot):
+        return FILE_HEADER.size + slot * self.slot_size
+
+    def pages_per_save(self):
+        """
+        Pages of the file a save dirties, the most of either slot. Flash is written a page at a time, a
+        slot sharing a page with the other one or the file header still costs that whole page.
+        """
+        pages = 0
+
+        for slot in (0, 1):
+            offset = self.slot_offset(slot)
+            pages = max(pages, (offset + self.slot_size - 1) // mmap.PAGESIZE - offset // mmap.PAGESIZE + 1)
+
+        return pages
+
+    def checksum(self, offset, sequence, saved_at):
+        payload = self.map[offset + SLOT_HEADER.size:offset + self.slot_size]
+
+        return zlib.crc32(payload, zlib.crc32(SLOT_STAMP.pack(sequence, saved_at))) & 0xffffffff
+
+    def newest_slot(self):
+        newest = None
+
+        for slot in (0, 1):
+            offset = self.slot_offset(slot)
+            sequence, saved_at, crc = SLOT_HEADER.unpack_from(self.map, offset)
+
+            if sequence == 0 or crc != self.checksum(offset, sequence, saved_at):
+                continue
+
+            if newest is None or sequence > newest[0]:
+                newest = (sequence, saved_at, offset)
+
+        return newest
+
+    def load(self):
+        """
+        Restores the history from the newest intact slot, returns the wall clock time it was saved at.
+        """
+        newest = self.newest_slot()
+
+        if newest is None:
+            return None
+
+        self.sequence, saved_at, offset = newest
+        offset += SLOT_HEADER.size
+
+        for buffer in self.buffers:
+            start, count = BUFFER_HEADER.unpack_from(self.map, offset)
+            offset += BUFFER_HEADER.size
+
+            if start < self.capacity and count <= self.capacity:
+                buffer.load(self.values.unpack_from(self.map, offset), start, count)
+
+            offset += self.values.size
+
+        return saved_at
+
+    def skip(self, elapsed, interval):
+        """
+        Moves the reloaded buffers on by the seconds nothing was sampled, with a sample every interval
+        seconds. A buffer whose whole window went by is emptied, the others get an empty value for every
+        one they missed, so the samples from before and after the gap are not charted or aggregated as
+        if they were contiguous.
+        """
+        for buffer, resolution in zip(self.buffers, self.history.resolutions(interval)):
+            missed = int(elapsed / resolution)
+
+            if missed >= buffer.capacity:
+                buffer.clear()
+            else:
+                for i in range(missed):
+                    buffer.append(0.0)
+
+    def save(self, saved_at):
+        self.sequence += 1
+        offset = self.slot_offset(self.sequence % 2)
+        position = offset + SLOT_HEADER.size
+
+        for buffer in self.buffers:
+            BUFFER_HEADER.pack_into(self.map, position, buffer.start, buffer.count)
+            position += BUFFER_HEADER.size
+
+            self.values.pack_into(self.map, position, *buffer.values)
+            position += self.values.size
+
+        # The header goes last, until it is written the slot still reads as torn
+        crc = self.checksum(offset, self.sequence, saved_at)
+        SLOT_HEADER.pack_into(self.map, offset, self.sequence, saved_at, crc)
+
+    def sync(self):
+        self.map.flush()
+
+    def close(self):
+        self.map.close()
+        os.close(self.fd)
+
+
+class HistoryStore:
+    """
+    Keeps the history of every attached screen in RingFiles under one directory.
+
+    Saves are batched: every file is written and synced together, no more often than flush_interval
+    seconds and spaced out further if needed so the bytes written per day stay under write_budget.
+    The bytes written are counted in whole pages, however few of a page's bytes a save changes. Files
+    are only created while their total size fits in size_budget.
+    """
+
+    def __init__(self, path, size_budget, write_budget, flush_interval=60):
+        self.path = path
+        self.size_budget = size_budget
+        self.write_budget = write_budget
+        self.flush_interval = flush_interval
+        self.files = []
+        self.size = 0
+        self.written = 0
+        self.last_flush = monotonic()
+
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+    def attach(self, screen):
+        """
+        Opens the ring files of a screen's histories and reloads whatever they hold, moved on by the time
+        since it was saved.
+        """
+        for name, history in named_histories(screen.name, screen.measures):
+            size = RingFile.get_size(history)
+
+            if self.size + size > self.size_budget:
+                print 'History size budget reached, not persisting %s' % name
+                continue
+
+            ring = RingFile(os.path.join(self.path, '%s.ring' % name), history)
+            saved_at = ring.load()
+
+            # A clock behind the save, as on a Pi without a real time clock before NTP, tells nothing
+            # about the gap, the history is taken as it is
+            if saved_at is not None and time.time() > saved_at:
+                ring.skip(time.time() - saved_at, screen.interval)
+
+            self.files.append(ring)
+            self.size += size
+            self.written += ring.pages_per_save() * mmap.PAGESIZE
+
+    def interval(self):
+        return max(self.flush_interval, self.written * 86400.0 / self.write_budget)
+
+    def handle_sample(self, screen):
+        if monotonic() - self.last_flush >= self.interval():
+            self.flush()
+
+    def flush(self):
+        saved_at = time.time()
+
+        for ring in self.files:
+            ring.save(saved_at)
+
+        for ring in self.files:
+            ring.sync()
+
+        self.last_flush = monotonic()
+
+    def close(self):
+        self.flush()
+
+        for ring in self.files:
+            ring.close()
+
+        self.files = []
@@ -0,0 +1,234 @@
+import errno
+import struct
+import time
+
+from luma.core.error import DeviceNotFoundError
+from luma.core.error import DevicePermissionError
+from luma.core.serial import spi
+from smbus2 import SMBus
+from smbus2 import i2c_msg
+
+# Control byte starting every I2C message to an SSD1306/SH1106, telling commands from display data
+I2C_COMMAND = 0x00
+I2C_DATA = 0x40
+# The kernel takes at most this many messages in one I2C_RDWR ioctl and this many bytes in one message
+I2C_RDWR_MESSAGES = 42
+I2C_MESSAGE_SIZE = 8192
+# An SMBus block write carries at most this many bytes after the control byte
+SMBUS_BLOCK_SIZE = 32
+# The clocks luma's SPI interface accepts
+SPI_CLOCKS = [int(mhz * 1000000) for mhz in (0.5, 1, 2, 4, 8, 16, 32)]
+
+
+def i2c_clock(port):
+    """
+    The clock the device tree set the I2C adapter up with, None when it can not be read.
+    """
+    try:
+        with open('/sys/class/i2c-adapter/i2c-%s/of_node/clock-frequency' % port, 'rb') as frequency:
+            return struct.unpack('>I', frequency.read(4))[0]
+    except (IOError, OSError, struct.error):
+        return None
+
+
+def chunks(data, size):
+    for i in range(0, len(data), size):
+        yield data[i:i + size]
+
+
+class Transport:
+    """
+    A display's bus. The page writes of a frame arrive together, as (commands, data) pairs, and are
+    packed into as few transfers as the bus allows. command() and data() work like luma's serial
+    interfaces, for the device's own setup.
+
+    Everything sent is counted: bytes are all the bytes put on the bus, transactions the transfers
+    the kernel was asked for.
+    """
+
+    def __init__(self, clock, block_size):
+        self.clock = clock
+        self.block_size = block_size
+        self.bytes = 0
+        self.transactions = 0
+
+    def command(self, *cmd):
+        self.write([(cmd, ())])
+
+    def data(self, data):
+        self.write([((), data)])
+
+    def write(self, writes):
+        raise NotImplementedError
+
+    def cleanup(self):
+        pass
+
+
+class I2cTransport(Transport):
+    """
+    A display on I2C. Every write is a message with the command control byte and a message with the
+    data control byte, data longer than block_size is split over several. All the messages of a
+    frame go to the kernel in one I2C_RDWR ioctl, up to its limit of messages per call.
+
+    A block_size of 32 or less sends every message as an SMBus block write instead, the way luma
+    does, for adapters that only do SMBus. The bus clock is not set from here, it is the adapter's
+    (dtparam=i2c_arm_baudrate on a Raspberry Pi).
+    """
+
+    def __init__(self, port=1, address=0x3C, clock=400000, block_size=4096, bus=None):
+        Transport.__init__(self, clock, min(block_size, I2C_MESSAGE_SIZE - 1))
+        self.address = address
+        self.managed = bus is None
+
+        try:
+            self.bus = bus or SMBus(port)
+        except (IOError, OSError) as e:
+            if e.errno == errno.ENOENT:
+                raise DeviceNotFoundError('I2C device not found: %s' % e.filename)
+            elif e.errno in (errno.EPERM, errno.EACCES):
+                raise DevicePermissionError('I2C device permission denied: %s' % e.filename)
+
+            raise
+
+    def messages(self, writes):
+        for commands, data in writes:
+            for block in chunks(commands, self.block_size):
+                yield I2C_COMMAND, block
+
+            for block in chunks(data, self.block_size):
+                yield I2C_DATA, block
+
+    def write(self, writes):
+        messages = list(self.messages(writes))
+
+        try:
+            if self.block_size <= SMBUS_BLOCK_SIZE:
+                for control, block in messages:
+                    self.bus.write_i2c_block_data(self.address, control, list(block))
+                    self.bytes += len(block) + 1
+                    self.transactions += 1
+
+                return
+
+            for batch in chunks(messages, I2C_RDWR_MESSAGES):
+                self.bus.i2c_rdwr(*[i2c_msg.write(self.address, bytes(bytearray([control]) + bytearray(block)))
+                                    for control, block in batch])
+                self.bytes += sum(len(block) + 1 for control, block in batch)
+                self.transactions += 1
+        except (IOError, OSError) as e:
+            if e.errno in (errno.EREMOTEIO, errno.EIO):
+                raise DeviceNotFoundError('I2C device not found on address: 0x%02X' % self.address)
+
+            raise
+
+    def cleanup(self):
+        if self.managed:
+            self.bus.close()
+
+
+class SpiTransport(Transport):
+    """
+    A display on SPI, through luma's SPI interface, which drives the D/C and reset pins. The D/C pin
+    tells commands from data, so every write takes a transfer for its commands and one for every
+    block_size bytes of its data.
+    """
+
+    def __init__(self, port=0, device=0, clock=8000000, block_size=4096, gpio=None, dc_pin=24, reset_pin=25,
+                 bus=None):
+        if clock not in SPI_CLOCKS:
+            raise ValueError('SPI clock %s is not one of %s' % (clock, ', '.join(str(hz) for hz in SPI_CLOCKS)))
+
+        Transport.__init__(self, clock, block_size)
+        self.serial = spi(spi=bus, gpio=gpio, port=port, device=device, bus_speed_hz=clock,
+                          transfer_size=block_size, gpio_DC=dc_pin, gpio_RST=reset_pin)
+
+    def write(self, writes):
+        for commands, data in writes:
+            if commands:
+                self.serial.command(*commands)
+                self.bytes += len(commands)
+                self.transactions += 1
+
+            if data:
+                self.serial.data(list(data))
+                self.bytes += len(data)
+                self.transactions += (len(data) + self.block_size - 1) // self.block_size
+
+    def cleanup(self):
+        self.serial.cleanup()
+
+
+class RecordingBus:
+    """
+    Takes the place of an smbus2 SMBus, a spidev SpiDev and the RPi.GPIO module driving the D/C pin,
+    and keeps every transfer instead of sending it.
+
+    transfers holds one list of (command, bytes) messages per transfer, command telling whether the
+    D/C pin was low during a SPI transfer and None on I2C, where the control bytes tell. Each
+    transfer is given the time it would take on the wire, 9 clocks a byte at clock Hz on I2C and 8 a
+    byte at the clock SPI was opened with, plus overhead seconds for the kernel and the bus start and
+    stop. With sleep set it also takes that long.
+    """
+
+    LOW = 0
+    HIGH = 1
+    OUT = 0
+    BCM = 11
+
+    def __init__(self, clock=400000, overhead=0.0, sleep=False, dc_pin=24):
+        self.clock = clock
+        self.overhead = overhead
+        self.sleep = sleep
+        self.dc_pin = dc_pin
+        self.pins = {}
+        self.max_speed_hz = None
+        self.transfers = []
+        self.time = 0.0
+
+    def transfer(self, messages, clocks_per_byte, clock):
+        self.transfers.append(messages)
+
+        # Every I2C message starts with the device's address
+        extra = 1 if clocks_per_byte == 9 else 0
+        duration = self.overhead + sum(len(data) + extra for command, data in messages) * clocks_per_byte / \
+            float(clock)
+        self.time += duration
+
+        if self.sleep:
+            time.sleep(duration)
+
+    def write_i2c_block_data(self, address, register, data):
+        self.transfer([(None, bytearray([register]) + bytearray(data))], 9, self.clock)
+
+    def i2c_rdwr(self, *messages):
+        self.transfer([(None, bytearray(list(message))) for message in messages], 9, self.clock)
+
+    def open(self, port, device):
+        pass
+
+    def writebytes(self, data):
+        command = self.pins.get(self.dc_pin) == self.LOW
+        self.transfer([(command, bytearray(data))], 8, self.max_speed_hz or self.clock)
+
+    def setmode(self, mode):
+        pass
+
+    def setwarnings(self, enabled):
+        pass
+
+    def setup(self, pin, direction):
+        pass
+
+    def output(self, pin, value):
+        self.pins[pin] = value
+
+    def close(self):
+        pass
+
+    def cleanup(self):
+        pass
+
+    def reset(self):
+        self.transfers = []
+        self.time = 0.0
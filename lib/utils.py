@@ -1,3 +1,12 @@
+import errno
+import fcntl
+import os
+import socket
+import struct
+
+SIOCGIFADDR = 0x8915
+
+
 def bytes_to_human(n):
     symbols = ('K', 'M', 'G', 'T', 'P', 'E', 'Z', 'Y')
     prefix = {}
@@ -11,3 +20,69 @@ def bytes_to_human(n):
             return '%s%s' % (value, s)
 
     return "%sB" % n
+
+
+def human_to_bytes(s):
+    symbols = ('K', 'M', 'G', 'T', 'P', 'E', 'Z', 'Y')
+    s = s.strip().upper().rstrip('B')
+
+    if s and s[-1] in symbols:
+        return int(float(s[:-1]) * (1 << (symbols.index(s[-1]) + 1) * 10))
+
+    return int(s)
+
+
+def number_to_human(n):
+    # At most five characters: two significant digits below 10, whole numbers up to 999, then K/M/G
+    for symbol, scale in (('G', 1e9), ('M', 1e6), ('K', 1e3)):
+        if abs(n) >= scale:
+            return '%.3g%s' % (n / scale, symbol)
+
+    if abs(n) >= 10 or n == 0:
+        return '%.0f' % n
+
+    return '%.2g' % n
+
+
+def human_to_seconds(s):
+    units = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+    s = s.strip().lower()
+
+    if s and s[-1] in units:
+        return float(s[:-1]) * units[s[-1]]
+
+    return float(s)
+
+
+def wakeup_pipe():
+    """
+    A pipe for waking a thread that sleeps in select(), writing to it never blocks.
+    """
+    read, write = os.pipe()
+    fcntl.fcntl(write, fcntl.F_SETFL, fcntl.fcntl(write, fcntl.F_GETFL) | os.O_NONBLOCK)
+
+    return read, write
+
+
+def wake_up(fd):
+    try:
+        os.write(fd, b'.')
+    except OSError as e:
+        # A full pipe wakes the thread all the same
+        if e.errno != errno.EAGAIN:
+            raise
+
+
+def interface_address(interface):
+    """
+    The IPv4 address of a network interface, None when it has none or does not exist.
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    try:
+        request = struct.pack('256s', interface[:15])
+        return socket.inet_ntoa(fcntl.ioctl(sock.fileno(), SIOCGIFADDR, request)[20:24])
+    except IOError:
+        return None
+    finally:
+        sock.close()
@@ -0,0 +1,195 @@
+import threading
+import traceback
+
+from monotonic import monotonic
+
+from metrics import BUS_BYTES
+from metrics import BUS_TIME
+from metrics import BUS_TRANSACTIONS
+from metrics import LOCK_WAIT
+from metrics import RENDER_TIME
+
+
+class DisplayWorker:
+    """
+    One display and the screens it shows, rendered and flushed on a thread of its own so a slow bus
+    only holds up its own display.
+
+    A frame is asked for when the visible screen collected a new sample or a button changed what is
+    shown, requests that arrive while a frame is pending are merged into that frame. With cycle_time
+    set the display moves on to its next screen by itself every cycle_time seconds. An alert that
+    fires on one of its screens brings that screen and sub-screen to the front.
+    """
+
+    def __init__(self, name, device, screens, counters, cycle_time=0):
+        self.name = name
+        self.device = device
+        self.screens = screens
+        self.counters = counters
+        self.cycle_time = cycle_time
+        self.screen_index = 0
+        self.lock = threading.Lock()
+        self.condition = threading.Condition()
+        self.render_pending = False
+        self.render_state = None
+        self.idle = False
+        self.idle_pending = None
+        self.cycled = monotonic()
+        self.alert = None
+        self.failing = False
+        self.running = False
+        self.thread = None
+
+    def visible_screen(self):
+        return self.screens[self.screen_index]
+
+    def set_idle(self, idle):
+        """
+        Has the display's thread blank or show the display before its next frame. The sampler blanks
+        the displays and alerts wake them, neither waits for a frame going out on a slow bus.
+        """
+        self.condition.acquire()
+
+        try:
+            self.idle_pending = idle
+            self.render_pending = True
+            self.condition.notify()
+        finally:
+            self.condition.release()
+
+    def show_alert(self, screen, index):
+        """
+        Has the next sample bring screen, showing sub-screen index, to the front.
+        """
+        self.alert = (screen, index)
+
+    def handle_sample(self, screen):
+        """
+        Asks for a frame when the screen is the visible one, returns whether the display cycled on to
+        another screen.
+        """
+        # A frame going out on a slow bus holds the lock, the sampler tries again on its next sample
+        # rather than wait for it
+        if self.alert is not None and self.lock.acquire(False):
+            try:
+                alert, index = self.alert
+                self.alert = None
+                self.screen_index = self.screens.index(alert)
+                alert.screen_index = index
+                self.cycled = monotonic()
+                alert.show()
+            finally:
+                self.lock.release()
+
+            self.request_render()
+            return True
+
+        if self.cycle_time > 0 and len(self.screens) > 1 and monotonic() - self.cycled >= self.cycle_time \
+                and self.lock.acquire(False):
+            try:
+                self.screen_index = self.screen_index + 1 if self.screen_index + 1 < len(self.screens) else 0
+                self.cycled = monotonic()
+                self.screens[self.screen_index].show()
+            finally:
+                self.lock.release()
+
+            self.request_render()
+            return True
+
+        if screen is self.screens[self.screen_index]:
+            self.request_render()
+
+        return False
+
+    def request_render(self):
+        self.condition.acquire()
+
+        try:
+            self.render_pending = True
+            self.condition.notify()
+        finally:
+            self.condition.release()
+
+    def wait_for_render(self):
+        self.condition.acquire()
+
+        try:
+            while not self.render_pending:
+                self.condition.wait()
+
+            self.render_pending = False
+        finally:
+            self.condition.release()
+
+    def render(self):
+        self.condition.acquire()
+
+        try:
+            idle, self.idle_pending = self.idle_pending, None
+        finally:
+            self.condition.release()
+
+        start = monotonic()
+        self.lock.acquire()
+        self.counters.record(LOCK_WAIT, (monotonic() - start) * 1000)
+
+        try:
+            if idle is not None:
+                # The panel keeps the last frame in its RAM, it is back as soon as the display is shown
+                self.idle = idle
+
+                if idle:
+                    self.device.hide()
+                else:
+                    self.device.show()
+
+            # The display is blanked, nothing is drawn or sent until a button wakes it
+            if self.idle:
+                return
+
+            screen = self.screens[self.screen_index]
+            state = (self.screen_index, screen.screen_index, screen.scale_index, screen.header_index,
+                     screen.alerting(), screen.sequence.version())
+
+            # Nothing visible changed since the last frame
+            if state == self.render_state:
+                return
+
+            start = monotonic()
+            screen.render(self.device)
+            self.counters.record(RENDER_TIME, (monotonic() - start) * 1000)
+            self.counters.record(BUS_TIME, self.device.write_time * 1000)
+            self.counters.record(BUS_BYTES, self.device.write_bytes)
+            self.counters.record(BUS_TRANSACTIONS, self.device.write_transactions)
+
+            self.render_state = state
+        finally:
+            self.lock.release()
+
+    def run(self):
+        while self.running:
+            try:
+                self.render()
+                self.failing = False
+            except Exception:
+                # One bad frame must not stop the display for good, the next sample asks for another
+                if not self.failing:
+                    print 'Rendering failed on [%s], carrying on with the next frame' % self.name
+                    traceback.print_exc()
+
+                self.failing = True
+
+            self.wait_for_render()
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.run, args=())
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        self.request_render()
+
+        if self.thread is not None:
+            self.thread.join()